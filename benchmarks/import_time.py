@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Import time of CLI startup (python -X importtime), fails on heavy imports or over budget
+
+  benchmarks/import_time.py
+  benchmarks/import_time.py --budget-ms 150 --top 20
+  benchmarks/import_time.py --config config.yaml --runs 5
+"""
+import os, sys, argparse, re, subprocess, tempfile
+
+DN = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.abspath(DN + '/../src')
+CLI = os.path.abspath(DN + '/../cloudinventario')
+
+# must not be imported by startup of --list (storage, metrics, error reporting and cloud SDKs)
+FORBIDDEN = ["sqlalchemy", "sentry_sdk", "prometheus_client", "psutil", "setproctitle",
+             "boto3", "botocore", "azure", "google", "googleapiclient", "pyarrow", "zstandard"]
+
+CONFIG = """
+collectors:
+  bench:
+    module: amazon-aws
+    config: {}
+"""
+
+# name -> command (config file appended to CLI commands)
+CASES = {
+  "core": [sys.executable, "-X", "importtime", "-c", "import cloudinventario.cloudinventario"],
+  "cli-list": [sys.executable, "-X", "importtime", CLI, "--list", "-c"],
+}
+
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def getArgs():
+  parser = argparse.ArgumentParser(description='CLI startup import time benchmark')
+  parser.add_argument('--config', action='store', help='Config for --list (default: temporary config with one collector)')
+  parser.add_argument('--case', action='append', choices=list(CASES.keys()), help='Cases to run (default: all)')
+  parser.add_argument('--runs', action='store', type=int, default=3, help='Runs per case, best one is reported')
+  parser.add_argument('--top', action='store', type=int, default=10, help='Slowest imports to show')
+  parser.add_argument('--budget-ms', action='store', type=float, help='Fail when total import time of a case is over budget')
+  return parser.parse_args()
+
+def parse(stderr):
+  """-X importtime output as [(module, self us, cumulative us, top level)]"""
+  imports = []
+  for line in stderr.splitlines():
+    match = LINE.match(line)
+    if match:
+      imports.append((match.group(4), int(match.group(1)), int(match.group(2)), len(match.group(3)) <= 1))
+  return imports
+
+def run(cmd):
+  env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [SRC, os.environ.get("PYTHONPATH")]))}
+  proc = subprocess.run(cmd, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, text = True)
+  if proc.returncode != 0:
+    raise Exception("{} failed ({}):\n{}".format(" ".join(cmd), proc.returncode,
+                    "\n".join(line for line in proc.stderr.splitlines() if not LINE.match(line))))
+  return parse(proc.stderr)
+
+def main(args):
+  config = args.config
+  if config is None:
+    fd, config = tempfile.mkstemp(suffix = ".yaml")
+    with os.fdopen(fd, "w") as f:
+      f.write(CONFIG)
+
+  failed = False
+  try:
+    for name in args.case or CASES.keys():
+      cmd = CASES[name] + ([config] if name.startswith("cli") else [])
+      imports = min((run(cmd) for idx in range(max(args.runs, 1))),
+                    key = lambda imports: sum(cum for mod, own, cum, top in imports if top))
+      total = sum(cum for mod, own, cum, top in imports if top) / 1000
+      print("{:<10} modules={:<5} total={:>8.1f} ms".format(name, len(imports), total))
+      for mod, own, cum, top in sorted(imports, key = lambda imp: -imp[1])[:args.top]:
+        print("  {:>8.1f} ms self {:>8.1f} ms cumulative  {}".format(own / 1000, cum / 1000, mod))
+
+      heavy = sorted({mod.split(".")[0] for mod, own, cum, top in imports} & set(FORBIDDEN))
+      if heavy:
+        print("  FAIL: imports {}".format(", ".join(heavy)))
+        failed = True
+      if args.budget_ms is not None and total > args.budget_ms:
+        print("  FAIL: {:.1f} ms over budget {:.1f} ms".format(total, args.budget_ms))
+        failed = True
+  finally:
+    if args.config is None:
+      os.unlink(config)
+  return 1 if failed else 0
+
+if __name__ == '__main__':
+  sys.exit(main(getArgs()))
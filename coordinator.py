@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+import os
+import sys
+import logging
+import argparse
+import threading
+import time
+
+# Flask
+from flask import Flask, request
+
+# Cloudinventario
+DN = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(DN + '/src')
+from cloudinventario.work_queue import WorkQueue, WORK_QUEUE_DEFAULTS
+
+# Create APP
+app = Flask(__name__)
+# Durable queue of collector tasks
+QUEUE = None
+# Seconds between lease expiry checks
+EXPIRE_INTERVAL = 10
+# Longest lease long poll of a worker
+MAX_LEASE_WAIT = 30
+
+# --- ROUTES ---
+# curl -X POST -H "Content-Type: application/json" -d '{"collectors": {"aws1": {"module": "amazon-aws", "config": {...}}}}' http://0.0.0.0:8100/submit
+@app.route("/submit", methods=["POST"])
+def submit():
+  data = request.get_json()
+  run, ids = QUEUE.submit(data['collectors'], data.get('run'))
+  return {"status": "success", "code": 200, "run": run, "IDs": ids,
+          "skipped": [name for name in data['collectors'] if name not in ids]}
+
+# curl -X POST -H "Content-Type: application/json" -d '{"worker": "node1:8000", "count": 2, "wait": 20}' http://0.0.0.0:8100/lease
+@app.route("/lease", methods=["POST"])
+def lease():
+  data = request.get_json()
+  wait = min(float(data.get('wait', 0)), MAX_LEASE_WAIT)
+  tasks = QUEUE.lease(data['worker'], int(data.get('count', 1)), wait, data.get('status'))
+  return {"status": "success", "code": 200, "tasks": tasks, "lease": QUEUE.lease_time}
+
+# curl -X POST -H "Content-Type: application/json" -d '{"worker": "node1:8000", "tasks": [1, 2]}' http://0.0.0.0:8100/heartbeat
+@app.route("/heartbeat", methods=["POST"])
+def heartbeat():
+  data = request.get_json()
+  held = QUEUE.heartbeat(data['worker'], data.get('tasks', []), data.get('status'))
+  return {"status": "success", "code": 200, "tasks": held}
+
+# curl -X POST -H "Content-Type: application/json" -d '{"worker": "node1:8000", "id": 1, "success": true}' http://0.0.0.0:8100/complete
+@app.route("/complete", methods=["POST"])
+def complete():
+  data = request.get_json()
+  if not QUEUE.complete(data['worker'], data['id'], data['success'], data.get('result'), data.get('error')):
+    return {"status": "error", "code": 409, "description": "Lease not held"}, 409
+  return {"status": "success", "code": 200}
+
+# curl -X GET http://0.0.0.0:8100/status
+# curl -X GET http://0.0.0.0:8100/status?run=1700000000.000000
+@app.route("/status")
+def status():
+  return {"status": "success", **QUEUE.status(request.args.get('run'))}
+
+# curl -X GET http://0.0.0.0:8100/tasks?run=1700000000.000000&state=failed
+@app.route("/tasks")
+def tasks():
+  return {"status": "success", "tasks": QUEUE.tasks(request.args.get('run'), request.args.get('state'))}
+
+# --- HELPERS METHOD ---
+def expire_leases():
+  # leases of dead workers expire even when nobody asks for tasks
+  while True:
+    time.sleep(EXPIRE_INTERVAL)
+    try:
+      QUEUE.expire()
+      QUEUE.cleanup()
+    except Exception as e:
+      logging.error("lease expiry failed", exc_info=e)
+
+# --- CONFIGS ---
+def getArgs():
+  parser = argparse.ArgumentParser(description='CloudInventory coordinator args')
+  parser.add_argument('--port', action='store', help='Endpoint port')
+  parser.add_argument('--host', action='store', help='Endpoint host')
+  parser.add_argument('--db', action='store', help='Work queue database (SQLite file)')
+  return parser.parse_args()
+
+# Load config from env and args
+def coordinatorConfig():
+  args = getArgs()
+  return {
+    'queue': {
+      'path': args.db or os.getenv('COORDINATOR_DB') or WORK_QUEUE_DEFAULTS['path'],
+      'lease': int(os.getenv('COORDINATOR_LEASE') or WORK_QUEUE_DEFAULTS['lease']),
+      'attempts': int(os.getenv('COORDINATOR_ATTEMPTS') or WORK_QUEUE_DEFAULTS['attempts']),
+    },
+    'endpoint_host': args.host if args.host else os.getenv('ENDPOINT_HOST'),
+    'endpoint_port': args.port if args.port else os.getenv('ENDPOINT_PORT')
+  }
+# export ENDPOINT_PORT=8100 ENDPOINT_HOST=0.0.0.0 COORDINATOR_DB=/data/coordinator.db COORDINATOR_LEASE=120 COORDINATOR_ATTEMPTS=3
+
+if __name__ == '__main__':
+  logging.basicConfig(level=logging.INFO)
+  CONFIG = coordinatorConfig()
+
+  logging.info(f"Initializing work queue with {CONFIG['queue']}")
+  QUEUE = WorkQueue(CONFIG['queue'])
+  threading.Thread(target=expire_leases, name="lease-expiry", daemon=True).start()
+
+  # Run server (threaded, lease requests long poll)
+  logging.info(f"Running coordinator with {CONFIG['endpoint_host']}:{CONFIG['endpoint_port']}")
+  app.run(host=CONFIG['endpoint_host'], port=CONFIG['endpoint_port'], threaded=True)
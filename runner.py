@@ -9,10 +9,14 @@ import time
 import copy
 import random
 
+DN = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(DN + '/src')
+
 def getArgs():
     parser = argparse.ArgumentParser(description='CloudInventory args')
     parser.add_argument('-c', '--config', action='store', required=True, help='Config file')
     parser.add_argument('--wait', action='store_true', required=False, help='Wait for all collectors to be finished')
+    parser.add_argument('--coordinator', action='store', required=False, help='Coordinator URL to queue collectors to (default: coordinator.url from config)')
     args = parser.parse_args()
     return args
 
@@ -36,12 +40,50 @@ def status_collector(host, port, id):
     url = url_creator(host, port) + "/status/" + str(id)
     return requests.get(url=url)
 
+def submit(url, collectors):
+    return requests.post(url=url + "/submit", json={"collectors": collectors})
+
+def run_status(url, run):
+    return requests.get(url=url + "/status", params={"run": run})
+
+def collectorOrder(config):
+    # order: runtime sends longest expected collectors first, needs storage with their history
+    order = config.get('order', 'config')
+    if order == 'config':
+        return list(config['collectors'])
+    from cloudinventario.cloudinventario import CloudInventario
+    cinv = CloudInventario({'storage': config.get('storage', {}), 'collectors': config['collectors']})
+    workers = len(config.get('endpoints') or [None]) * int(config.get('process', {}).get('forks', 1))
+    return cinv.orderedCollectors(order, workers, collectors=config['collectors'])
+
+def coordinate(url, config, wait):
+    # services lease queued collectors from coordinator, one status request covers all of them
+    ordered = {name: config['collectors'][name] for name in collectorOrder(config)}
+    response = submit(url, ordered).json()
+    print(f"[+] Queued run={response['run']} collectors={len(response['IDs'])} skipped={response['skipped']}")
+
+    if wait:
+        last = None
+        while True:
+            run = run_status(url, response['run']).json()['runs'].get(response['run'], {"done": True, "tasks": {}})
+            if run['tasks'] != last:
+                print(f"Run={response['run']} tasks={run['tasks']}")
+                last = run['tasks']
+            if run['done']:
+                break
+            time.sleep(5)
+    return list(response['IDs'])
+
 def main(args):
     config = loadConfig(args.config)
     collectors = []
 
+    url = args.coordinator or (config.get('coordinator') or {}).get('url')
+    if url:
+        return coordinate(url.rstrip('/'), config, args.wait)
+
     print(f"Load runner len_col={len(config['collectors'])}, len_end={len(config['endpoints'])}, max_process={config['process']['tasks']}")
-    for collector in config['collectors']:
+    for collector in collectorOrder(config):
         index = 0
         while (1):
             host = config['endpoints'][index]['host']
@@ -9,6 +9,12 @@ import time
 import re
 import traceback
 import argparse
+import threading
+import requests
+import socket
+import concurrent.futures
+import signal
+import atexit
 
 
 # Flask
@@ -28,6 +34,7 @@ from sentry_sdk.integrations.excepthook import ExcepthookIntegration
 DN = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(DN + '/src')
 from cloudinventario.cloudinventario import CloudInventario
+from cloudinventario.storage_queue import StorageQueue
 import cloudinventario.storage as storage
 
 # Create APP
@@ -40,6 +47,12 @@ CONFIG, METRICS_DICT = None, None
 TASKS = []
 # Lock as mutex in collect
 LOCK = Lock()
+# Asynchronous writer of collected data (None = collectors store themselves)
+STORAGE_QUEUE = None
+# Pool running collectors (PROCESS_FORKS workers), created in main
+COLLECTOR_POOL = None
+# Tasks leased from coordinator: job ID -> coordinator task ID, finished futures to report
+LEASES, FINISHED = {}, {}
 
 # --- ROUTES ---
 # curl -X GET http://0.0.0.0:8000/metrics
@@ -51,27 +64,36 @@ def metrics():
 @app.route("/status/<job_id>")
 def status_job(job_id):
   logging.info(f"[+] Status about task={job_id}")
-  if job_id in TASKS:
-    if executor.futures.done(job_id):
-      TASKS.remove(job_id)
-      future = executor.futures.pop(job_id)
-      do_metrics(future, METRICS_DICT)
-      return {"status": "success", "result": future.result()}
-    else:
-      return {"status": "pending", "result": "Task is still running"}
+  with LOCK:
+    if job_id in TASKS:
+      if executor.futures.done(job_id):
+        TASKS.remove(job_id)
+        future = executor.futures.pop(job_id)
+        if job_id in LEASES:
+          FINISHED[job_id] = future
+        do_metrics(future, METRICS_DICT)
+        return {"status": "success", "result": future.result()[:2]}
+      else:
+        return {"status": "pending", "result": "Task is still running"}
   return {"status": "error", "result": "Task not found or not in queue"}
 
 # curl -X GET http://0.0.0.0:8000/status
 @app.route("/status")
 def status():
-  finished_tasks_id = check_tasks()
+  with LOCK:
+    finished_tasks_id = check_tasks()
+    not_finished_tasks_id = list(TASKS)
   return {
     "status": "success",
     "finished_tasks": len(finished_tasks_id),
-    "not_finished_tasks": len(TASKS),
+    "not_finished_tasks": len(not_finished_tasks_id),
     "names_finished_tasks": finished_tasks_id,
-    "names_not_finished_tasks": TASKS,
-    "ready": True if CONFIG['process']['forks'] > len(TASKS) else False
+    "names_not_finished_tasks": not_finished_tasks_id,
+    "ready": True if CONFIG['process']['forks'] > len(not_finished_tasks_id) and storage_ready() else False,
+    "storage": storage.pool_stats(),
+    "storage_queue": STORAGE_QUEUE.status() if STORAGE_QUEUE else None,
+    "coordinator": CONFIG['coordinator']['url'],
+    "leased_tasks": len(LEASES)
   }
 
 # curl -X POST -H "Content-Type: application/json" -d '{"collectors": {"aws1": {"module": "amazon-aws","config": {"access_key": "","secret_key": "", "region": "eu-west-1","collect": ["snapshot"]}}}}' http://0.0.0.0:8000/collect
@@ -91,29 +113,16 @@ def collect():
       # Queue is full, release lock and return 429 code
       LOCK.release()
       return {"status": "error", "code": 429 , "description": "Queue is full"}
+    if not storage_ready():
+      # storage writes are behind, don't collect more
+      LOCK.release()
+      return {"status": "error", "code": 429 , "description": "Storage queue is full"}
 
     try:
       ids = {}
-      for col in cinv.collectors:
-        METRICS_DICT['cloudinventario_source'].inc()
-        METRICS_DICT['cloudinventario_entries_collected'].labels(source=col).inc()
-        
-        # Copy parameters for cloudinventario collector
-        data = {         
-          "config": collector_config,
-          "name": col,
-          "options": {'tasks': int(CONFIG['process']['tasks']), 'check_permission': False}
-        }
-
-        # Define id for task, add into result(ids), add id into TASKS
-        id = col + ":" + str(time.time())
-        ids[col] = id
-        TASKS.append(id)
-
-        # Submit task to collect
-        executor.submit_stored(id, collect, data)
-
-        METRICS_DICT['cloudinventario_up'].inc() if executor.futures.done(id) else None
+      # longest expected first when more collectors come in one request
+      for col in cinv.orderedCollectors(CONFIG['process']['order'], CONFIG['process']['forks']):
+        ids[col] = submit_collector(COLLECTOR_POOL, collector_config, col)
       return {"status": "success", "code": 200 , "description": f"Add {len(cinv.collectors)} collectors", "IDs": ids}
     except Exception as e: 
       print(traceback.format_exc())
@@ -122,6 +131,33 @@ def collect():
       LOCK.release()
 
 # --- HELPERS METHOD ---
+# Submit collector to pool, under LOCK, returns its job ID
+def submit_collector(pool, collector_config, col):
+  METRICS_DICT['cloudinventario_source'].inc()
+  METRICS_DICT['cloudinventario_entries_collected'].labels(source=col).inc()
+
+  # Copy parameters for cloudinventario collector
+  data = {
+    "config": collector_config,
+    "name": col,
+    "options": {'tasks': int(CONFIG['process']['tasks']), 'check_permission': False},
+    "async": STORAGE_QUEUE is not None
+  }
+
+  # Define id for task, add id into TASKS
+  id = col + ":" + str(time.time())
+  TASKS.append(id)
+
+  # Submit task to collect, results are stored by storage queue
+  # run_collector() needs no flask context, pool works outside of requests too, executor keeps the futures
+  future = pool.submit(run_collector, data)
+  executor.futures.add(id, future)
+  if STORAGE_QUEUE:
+    future.add_done_callback(enqueue_store)
+
+  METRICS_DICT['cloudinventario_up'].inc() if executor.futures.done(id) else None
+  return id
+
 def do_metrics(future, metrics_dict):
   future_result = future.result()
   metrics_dict['cloudinventario_cpu_usage'].labels(source=future_result[1]['name']).set(future_result[1]['cpu_usage'])
@@ -132,21 +168,108 @@ def do_metrics(future, metrics_dict):
   else:
     metrics_dict['cloudinventario_error'].labels(source=future_result[1]['name'], stage=future_result[1]['stage']).inc()
 
+def storage_ready():
+  return STORAGE_QUEUE is None or STORAGE_QUEUE.ready
+
+def enqueue_store(future):
+  # runs as done callback in pool thread, must neither block it nor write to database there
+  if future.cancelled() or future.exception():
+    return
+  future_result = future.result()
+  if len(future_result) > 2 and future_result[2]:
+    if not STORAGE_QUEUE.offer(future_result[2]):
+      logging.warning(f"[+] Storage queue is full, name={future_result[1]['name']} is spooled or queued once there is space")
+
+# Collect finished tasks, under LOCK
 def check_tasks():
   finished_task_id = []
-  for task in TASKS:
+  for task in list(TASKS):
     if executor.futures.done(task):
       finished_task_id.append(task)
       TASKS.remove(task)
 
       future = executor.futures.pop(task)
+      if task in LEASES:
+        FINISHED[task] = future
       do_metrics(future, METRICS_DICT)
   return finished_task_id
 
-def collect(data):
+def coordinator_post(path, data):
+  url = CONFIG['coordinator']['url'] + path
+  return requests.post(url=url, json=data, timeout=CONFIG['coordinator']['wait'] + 30).json()
+
+def report_finished(finished):
+  # outside of LOCK, coordinator ignores completion of lost leases
+  for job_id, future in list(finished.items()):
+    task_id = LEASES.get(job_id)
+    if task_id is None:
+      # lease lost after it finished, coordinator queued it again
+      del finished[job_id]
+      continue
+    if future.exception() is not None:
+      success, result, error = False, None, str(future.exception())
+    else:
+      success, result, error = future.result()[0], future.result()[1], None
+    coordinator_post("/complete", {"worker": CONFIG['coordinator']['worker'], "id": task_id,
+                                   "success": success, "result": result, "error": error})
+    LEASES.pop(job_id, None)
+    del finished[job_id]
+    logging.info(f"[+] Task={task_id} job={job_id} reported success={success}")
+
+# Pull collectors from coordinator while there are free forks, heartbeat leased ones
+def pull_tasks():
+  worker = CONFIG['coordinator']['worker']
+  heartbeat_at, finished = 0, {}
+  while True:
+    try:
+      LOCK.acquire()
+      try:
+        check_tasks()
+        finished.update(FINISHED)
+        FINISHED.clear()
+        free = CONFIG['process']['forks'] - len(TASKS) if storage_ready() else 0
+      finally:
+        LOCK.release()
+      report_finished(finished)
+
+      node_status = {"running": len(TASKS), "forks": CONFIG['process']['forks'],
+                     "storage_queue": STORAGE_QUEUE.status() if STORAGE_QUEUE else None}
+      if LEASES and time.time() >= heartbeat_at:
+        held = coordinator_post("/heartbeat", {"worker": worker, "tasks": list(LEASES.values()), "status": node_status})['tasks']
+        with LOCK:
+          for job_id, task_id in list(LEASES.items()):
+            if task_id not in held:
+              # requeued by coordinator, keep collecting but result is not reported
+              logging.warning(f"[+] Lease of task={task_id} job={job_id} lost")
+              LEASES.pop(job_id)
+        heartbeat_at = time.time() + CONFIG['coordinator']['heartbeat']
+
+      if free <= 0:
+        time.sleep(1)
+        continue
+      # long poll, wakes up as soon as coordinator has a task
+      wait = min(CONFIG['coordinator']['wait'], CONFIG['coordinator']['heartbeat']) if LEASES else CONFIG['coordinator']['wait']
+      tasks = coordinator_post("/lease", {"worker": worker, "count": free, "wait": wait, "status": node_status})['tasks']
+
+      LOCK.acquire()
+      try:
+        for task in tasks:
+          collector_config = {'collectors': {task['name']: task['config']}, 'storage': CONFIG['storage']}
+          LEASES[submit_collector(COLLECTOR_POOL, collector_config, task['name'])] = task['id']
+          logging.info(f"[+] Leased task={task['id']} collector={task['name']}")
+      finally:
+        LOCK.release()
+    except Exception as e:
+      # unreported finished ones are kept for next try
+      logging.error("coordinator request failed", exc_info=e)
+      time.sleep(5)
+
+# returns (success, metrics, data for storage queue or None)
+def run_collector(data):
    config = data['config']
    name = data['name']
    options = data['options']
+   store_async = data.get('async', False)
 
    proctitle = setproctitle.getproctitle()
    setproctitle.setproctitle("[cloudinventario] {}".format(name))
@@ -165,20 +288,32 @@ def collect(data):
      proc.cpu_percent(0.1)
      runtime_start = time.time()
 
-     inventory = cinv.collect(name, options)
+     # streaming stores records while collecting
+     if cinv.streaming:
+       inventory = cinv.collectStore(name, options)
+     else:
+       inventory = cinv.collect(name, options)
 
      runtime = time.time() - runtime_start
      cpu_usage = proc.cpu_percent()
      mem_usage = psutil.virtual_memory()[2]
 
      if inventory is not None:
-        logging.info("storing data for name={}".format(name))
-        cinv.store(inventory, runtime)
+        result = {'name': name, 'runtime': runtime, 'cpu_usage': cpu_usage, 'mem_usage': mem_usage}
+        if store_async:
+          logging.info("queueing data for name={}".format(name))
+          return True, result, {"inventory": inventory, "runtime": runtime}
+        if not cinv.streaming:
+          logging.info("storing data for name={}".format(name))
+          cinv.store(inventory, runtime)
         logging.debug("collector name={} finished".format(name))
-        return True, {'name': name, 'runtime': runtime, 'cpu_usage': cpu_usage, 'mem_usage': mem_usage}
+        return True, result, None
      else:
-        cinv.store_status(name, storage.STATUS_FAIL, runtime)
         logging.info("collector failed name={}".format(name))
+        if store_async:
+          return False, {'name': name, 'runtime': runtime, 'cpu_usage': cpu_usage, 'mem_usage': mem_usage, 'stage': 'end'}, \
+                 {"status": {"source": name, "status": storage.STATUS_FAIL, "runtime": runtime, "error": None}}
+        cinv.store_status(name, storage.STATUS_FAIL, runtime)
    except Exception as e:
     # Not added to error previous -> # cpu_usage = psutil.cpu_percent(round(runtime))
      proc_error = psutil.Process()
@@ -195,12 +330,22 @@ def collect(data):
           stage = stage.group(2) if stage else None 
           break
 
-     cinv.store_status(name, storage.STATUS_ERROR, runtime, trace)
      logging.error("collector name={} failed with exception".format(name), exc_info=e)
-     return False, {'name': name, 'runtime': runtime, 'cpu_usage': cpu_usage, 'mem_usage': mem_usage, 'stage': stage}
+     result = {'name': name, 'runtime': runtime, 'cpu_usage': cpu_usage, 'mem_usage': mem_usage, 'stage': stage}
+     if store_async:
+       return False, result, {"status": {"source": name, "status": storage.STATUS_ERROR, "runtime": runtime, "error": trace}}
+     cinv.store_status(name, storage.STATUS_ERROR, runtime, trace)
+     return False, result, None
    finally:
      setproctitle.setproctitle(proctitle)
-   return False, {'name': name, 'runtime': runtime, 'cpu_usage': cpu_usage, 'mem_usage': mem_usage, 'stage': 'end'}
+   return False, {'name': name, 'runtime': runtime, 'cpu_usage': cpu_usage, 'mem_usage': mem_usage, 'stage': 'end'}, None
+
+# Shutdown of service: queued data is written, then data buffered by sinks becomes visible
+def shutdown(cinv):
+  if STORAGE_QUEUE:
+    logging.info("Stopping storage queue")
+    STORAGE_QUEUE.stop()
+  cinv.flushSinks()
 
 # --- CONFIGS ---
 # Create metrics for Prometheus
@@ -278,6 +423,7 @@ def getArgs():
   parser = argparse.ArgumentParser(description='CloudInventory args')
   parser.add_argument('--port', action='store', help='Endpoint port')
   parser.add_argument('--host', action='store', help='Endpoint host')
+  parser.add_argument('--coordinator', action='store', help='Coordinator URL to pull collectors from')
   return parser.parse_args()
 
 # Load config for Process
@@ -287,11 +433,25 @@ def processesConfig():
   app.config['EXECUTOR_MAX_WORKERS'] = int(os.getenv('PROCESS_FORKS') or 1)
   logging.info(f"Config with EXECUTOR_MAX_WORKERS={os.getenv('PROCESS_FORKS') or 1}, PROCESS_TASKS={os.getenv('PROCESS_TASKS')}")
   return {
-    'storage': {'dsn': os.getenv('STORAGE_DSN')},
+    'storage': {'dsn': os.getenv('STORAGE_DSN'), 'stream': (os.getenv('STORAGE_STREAM') or '').lower() in ['1', 'true'],
+                'spool': os.getenv('STORAGE_SPOOL')},
+    'storage_queue': {
+      'workers': int(os.getenv('STORAGE_WRITERS') or 0),
+      'size': int(os.getenv('STORAGE_QUEUE_SIZE') or 10),
+      'batch': int(os.getenv('STORAGE_BATCH') or 5),
+      'retries': int(os.getenv('STORAGE_RETRIES') or 2)
+    },
     'process': {
       'forks': int(os.getenv('PROCESS_FORKS') or 1),
       'tasks': int(os.getenv('PROCESS_TASKS') or 1),
-      'die_after_request': os.getenv('PROCESS_DIE_AFTER_REQUEST')
+      'die_after_request': os.getenv('PROCESS_DIE_AFTER_REQUEST'),
+      'order': os.getenv('PROCESS_ORDER') or 'config'
+    },
+    'coordinator': {
+      'url': args.coordinator if args.coordinator else os.getenv('COORDINATOR_URL'),
+      'worker': os.getenv('COORDINATOR_WORKER') or f"{socket.gethostname()}:{args.port if args.port else os.getenv('ENDPOINT_PORT')}",
+      'heartbeat': int(os.getenv('COORDINATOR_HEARTBEAT') or 30),
+      'wait': int(os.getenv('COORDINATOR_WAIT') or 20)
     },
     'endpoint_host': args.host if args.host else os.getenv('ENDPOINT_HOST'),
     'endpoint_port': args.port if args.port else os.getenv('ENDPOINT_PORT')
@@ -313,6 +473,24 @@ if __name__ == '__main__':
   cinv = CloudInventario({'storage': CONFIG['storage']})
   cinv.store(None)
 
+  # Collectors run in pool of PROCESS_FORKS workers
+  COLLECTOR_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=CONFIG['process']['forks'], thread_name_prefix="collector")
+
+  # Asynchronous storage writers (STORAGE_WRITERS=0 stores in collector processes)
+  if CONFIG['storage_queue']['workers'] > 0 and not CONFIG['storage']['stream']:
+    STORAGE_QUEUE = StorageQueue(CONFIG['storage'], **CONFIG['storage_queue'])
+    STORAGE_QUEUE.start()
+
+  # SIGTERM (container stop) exits through atexit as well
+  atexit.register(shutdown, cinv)
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+  # Pull collectors from coordinator (/collect still accepts pushed ones)
+  if CONFIG['coordinator']['url']:
+    logging.info(f"Pulling collectors from coordinator {CONFIG['coordinator']['url']} as worker={CONFIG['coordinator']['worker']}")
+    threading.Thread(target=pull_tasks, name="coordinator-pull", daemon=True).start()
+
   # Run server
   logging.info(f"Running server with {CONFIG['endpoint_host']}:{CONFIG['endpoint_port']}")
-  app.run(debug=True, host=CONFIG['endpoint_host'], port=CONFIG['endpoint_port'])
+  # reloader would run second puller with the same worker name
+  app.run(debug=True, use_reloader=not CONFIG['coordinator']['url'], host=CONFIG['endpoint_host'], port=CONFIG['endpoint_port'])
@@ -0,0 +1,73 @@
+"""Resumable collection checkpoints (checkpoint: {path, window})"""
+import os, re, time, shutil, logging
+
+from cloudinventario.spool import write_lines, read_lines
+
+CHECKPOINT_DEFAULTS = {
+  "path": None,
+  "window": 3600,   # seconds, failed run older than this is collected from scratch
+  "fsync": True,
+}
+
+PART_SUFFIX = ".jsonl"
+
+class CollectorCheckpoint:
+   """Records of completed parts (resource collectors, sub-accounts) of one collector.
+
+   Parts are kept until the collection finishes. A retry started within the
+   window after the failed run loads completed parts instead of fetching them.
+   """
+
+   def __init__(self, name, config):
+     if isinstance(config, str):
+       config = {"path": config}
+     self.config = {**CHECKPOINT_DEFAULTS, **config}
+     if not self.config["path"]:
+       raise Exception("Checkpoint path is not configured")
+     self.name = name
+     self.path = os.path.join(self.config["path"], re.sub(r'[^\w@.-]', '_', name))
+     self.parts = set()
+     self.resumed = set()
+     self.__open()
+
+   def __part_name(self, part):
+     return re.sub(r'[^\w@.:-]', '_', part)
+
+   def __part_file(self, part):
+     return os.path.join(self.path, self.__part_name(part) + PART_SUFFIX)
+
+   def __open(self):
+     run = os.path.join(self.path, "run" + PART_SUFFIX)
+     if os.path.exists(run):
+       started = next(read_lines(run))["started"]
+       if time.time() - started <= self.config["window"]:
+         self.parts = {name[:-len(PART_SUFFIX)] for name in os.listdir(self.path)
+                       if name.endswith(PART_SUFFIX) and name != "run" + PART_SUFFIX}
+         logging.info("checkpoint: resuming collector={}, {} parts completed".format(self.name, len(self.parts)))
+         return
+       logging.info("checkpoint: discarding expired checkpoint of collector={}".format(self.name))
+       shutil.rmtree(self.path, ignore_errors = True)
+
+     os.makedirs(self.path, exist_ok = True)
+     write_lines(run, [{"started": time.time()}], self.config["fsync"])
+
+   def done(self, part):
+     return self.__part_name(part) in self.parts
+
+   def load(self, part):
+     records = list(read_lines(self.__part_file(part)))
+     self.resumed.add(part)
+     logging.info("checkpoint: collector={} part={} resumed, {} records".format(self.name, part, len(records)))
+     return records
+
+   def save(self, part, records):
+     write_lines(self.__part_file(part), filter(None, records or []), self.config["fsync"])
+     self.parts.add(self.__part_name(part))
+     return True
+
+   def clear(self):
+     """Collection finished, next run starts from scratch"""
+     shutil.rmtree(self.path, ignore_errors = True)
+     if self.resumed:
+       logging.info("checkpoint: collector={} finished, {} parts resumed".format(self.name, len(self.resumed)))
+     return True
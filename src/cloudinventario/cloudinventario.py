@@ -8,9 +8,12 @@ import time
 import logging
 from pprint import pprint
 import traceback
-import psutil
 
-from cloudinventario.storage import InventoryStorage
+# storage (sqlalchemy) and psutil are imported when used, --list and --test-login don't need them
+from cloudinventario.spool import InventorySpool
+from cloudinventario.sinks import get_sinks, SinkBuffer
+import cloudinventario.scheduler as scheduler
+import cloudinventario.planner as planner
 
 COLLECTOR_PREFIX = 'cloudinventario'
 
@@ -19,6 +22,12 @@ class CloudInventario:
     def __init__(self, config):
         self.config = config
         self.lock = threading.Lock()
+        self.storage = None
+        self.spool = None
+        self.sinks = None
+        self.scheduler = None
+        if config.get('scheduler'):
+            self.scheduler = scheduler.configure(config['scheduler'])
 
     @property
     def collectors(self):
@@ -33,6 +42,26 @@ class CloudInventario:
         # TODO
         pass
 
+    def orderedCollectors(self, order="config", workers=1, collectors=None):
+        """Collectors in config order, or longest expected runtime (ci_source history) first"""
+        collectors = list(self.collectors if collectors is None else collectors)
+        if order not in planner.ORDERS:
+            raise Exception("Unknown collector order '{}', use one of: {}".format(order, ", ".join(planner.ORDERS)))
+        if order == "config" or not collectors:
+            return collectors
+
+        try:
+            store = self.getStorage()
+            store.connect()
+            try:
+                runtimes = store.runtimes(collectors)
+            finally:
+                store.disconnect()
+        except Exception as e:
+            logging.warning("collector runtimes not available, using config order: {}".format(e))
+            return collectors
+        return planner.plan(collectors, runtimes, workers)
+
     def collectorConfig(self, collector):
         return self.config['collectors'][collector]
 
@@ -42,15 +71,42 @@ class CloudInventario:
         mod_name = mod_cfg['module']
         mod_config = mod_cfg['config']
         mod_defaults = mod_cfg.get('default', {})
+        if self.config.get('checkpoint'):
+            options = {'checkpoint': self.config['checkpoint'], **(options or {})}
         return CloudInventario.loadCollectorModule(mod_name, collector, mod_config, mod_defaults, options)
 
     @staticmethod
-    def loadCollectorModule(mod_name, collector, config, defaults=None, options=None):
+    def collectorPackage(mod_name):
         # basic safety, should throw error
         mod_name = re.sub(r'[/.]', '_', mod_name)
         mod_name = re.sub(r'_', '__', mod_name)
         mod_name = re.sub(r'-', '_', mod_name)
-        mod_pkg = COLLECTOR_PREFIX + '_' + mod_name
+        return COLLECTOR_PREFIX + '_' + mod_name
+
+    def preloadCollectors(self):
+        """Import modules of configured collectors and their resources ahead,
+        workers forked afterwards start with them loaded"""
+        loaded = set()
+        for collector in self.collectors:
+            mod_cfg = self.collectorConfig(collector)
+            mod_pkg = CloudInventario.collectorPackage(mod_cfg['module'])
+            modules = [mod_pkg + '.collector'] + [mod_pkg + '.resources.' + res
+                                                  for res in mod_cfg.get('config', {}).get('collect', [])]
+            for mod_name in modules:
+                if mod_name in loaded:
+                    continue
+                try:
+                    importlib.import_module(mod_name)
+                    loaded.add(mod_name)
+                except Exception as e:
+                    # reported by the collector itself
+                    logging.debug("preload of module={} failed: {}".format(mod_name, e))
+        logging.info("preloaded {} collector modules".format(len(loaded)))
+        return sorted(loaded)
+
+    @staticmethod
+    def loadCollectorModule(mod_name, collector, config, defaults=None, options=None):
+        mod_pkg = CloudInventario.collectorPackage(mod_name)
 
         mod = importlib.import_module(mod_pkg + '.collector')
         mod_instance = mod.setup(collector, config, defaults, options or {})
@@ -98,7 +154,7 @@ class CloudInventario:
         if 'prometheus_pushadd' in options:
             options['prometheus_pushadd']()
 
-    def collect(self, collector, options=None):
+    def collect(self, collector, options=None, writer=None):
         # workaround for buggy libs
         wd = os.getcwd()
         os.chdir("/tmp")
@@ -106,22 +162,25 @@ class CloudInventario:
 
         self.doMetric(options, 'cloudinventario_source')
         self.doMetric(options, 'cloudinventario_entries_collected', source=collector)
+        import psutil
         try:
             runtime_start = time.time()
+            # cpu usage since this call, measuring over an interval would block for the whole runtime
+            psutil.cpu_percent()
             instance = self.loadCollector(collector, options)
             instance.login()
-            inventory = instance.fetch()
+            inventory = instance.fetch(writer=writer)
             instance.logout()
             runtime = time.time() - runtime_start
 
-            self.doMetric(options, 'cloudinventario_cpu_usage', source=collector, set=psutil.cpu_percent(round(runtime)))
+            self.doMetric(options, 'cloudinventario_cpu_usage', source=collector, set=psutil.cpu_percent())
             self.doMetric(options, 'cloudinventario_mem_usage', source=collector, set=psutil.virtual_memory()[2])
             self.doMetric(options, 'cloudinventario_runtime', source=collector, set=runtime)
             self.doMetric(options, 'cloudinventario_success', source=collector)
         except Exception as e:
           # Find stage from trackback
             runtime = time.time() - runtime_start
-            self.doMetric(options, 'cloudinventario_cpu_usage', source=collector, set=psutil.cpu_percent(round(runtime)))
+            self.doMetric(options, 'cloudinventario_cpu_usage', source=collector, set=psutil.cpu_percent())
             self.doMetric(options, 'cloudinventario_mem_usage', source=collector, set=psutil.virtual_memory()[2])
             self.doMetric(options, 'cloudinventario_runtime', source=collector, set=runtime)
 
@@ -140,11 +199,119 @@ class CloudInventario:
             os.chdir(wd)
         return inventory
 
-    def store(self, inventory, runtime=None):
-        store_config = self.config["storage"]
+    def getStorage(self):
+        # engine is shared process-wide, storage keeps its schema handles
+        if self.storage is None:
+            from cloudinventario.storage import InventoryStorage
+            self.storage = InventoryStorage(self.config["storage"])
+        return self.storage
+
+    def getSpool(self):
+        # write-ahead spool, None if not configured
+        config = self.config.get("storage", {}).get("spool")
+        if self.spool is None and config:
+            self.spool = InventorySpool(config)
+        return self.spool
+
+    def getSinks(self):
+        # file sinks configured in storage: sinks: [...]
+        if self.sinks is None:
+            self.sinks = get_sinks(self.config.get("storage", {}))
+        return self.sinks
+
+    def storeSinks(self, inventory, runtime=None):
+        # every sink batches on its own, failing sink does not stop others
+        for sink in self.getSinks():
+            try:
+                sink.save(inventory, runtime)
+            except Exception as e:
+                logging.error("failed to write sink={} path={}".format(sink.type, sink.path), exc_info=e)
+        return True
+
+    def flushSinks(self):
+        # end of run, data buffered by sinks become visible
+        for sink in self.getSinks():
+            try:
+                sink.flush()
+            except Exception as e:
+                logging.error("failed to flush sink={} path={}".format(sink.type, sink.path), exc_info=e)
+        return True
+
+    def replaySpool(self):
+        spool = self.getSpool()
+        if spool is None or not self.config["storage"].get("dsn"):
+            return 0
+        return spool.replay(self.getStorage())
+
+    def storageStats(self):
+        if self.storage is None:
+            return None
+        return self.storage.pool_stats()
+
+    @property
+    def streaming(self):
+        return bool(self.config.get("storage", {}).get("stream"))
 
+    def collectStore(self, collector, options=None, claim=None):
+        """Collect and stream records into storage as they are produced.
+
+        Returns number of stored entries (None if collection failed). Every
+        chunk is committed on its own, source versions of the run become
+        visible at once when the collection finishes, unless claim() says
+        the result is not wanted anymore.
+        """
+        store = self.getStorage()
+        store.connect()
+        store.disconnect()
+
+        runtime_start = time.time()
+        writer = store.writer(incremental=True)
+        # sinks get records of the run once it is committed, as with store()
+        buffer = SinkBuffer(writer) if self.getSinks() else None
+        try:
+            inventory = self.collect(collector, options, buffer or writer)
+            if inventory is None:
+                writer.abort()
+                return None
+
+            errors = []
+            if type(inventory) is dict:
+                errors = inventory['errors']
+                writer.add_status(errors)
+                inventory = inventory['data']
+            (buffer or writer).append(inventory)
+            if claim is not None and not claim():
+                logging.error("collector={} finished after its time limit, data discarded".format(collector))
+                writer.abort()
+                return None
+            runtime = time.time() - runtime_start
+            writer.commit(runtime)
+            if buffer is not None:
+                self.storeSinks({"data": buffer, "errors": errors}, runtime)
+        except Exception:
+            writer.abort()
+            raise
+        finally:
+            if buffer is not None:
+                buffer.close()
+        return writer.entries
+
+    def store(self, inventory, runtime=None):
         with self.lock:
-            store = InventoryStorage(store_config)
+            self.storeSinks(inventory, runtime)
+            if not self.config["storage"].get("dsn"):
+                return True
+
+            spool = self.getSpool()
+            if spool:
+                # spooled data survives storage outage, replayed on next store
+                if inventory is not None:
+                    spool.write(inventory, runtime)
+                    spool.replay(self.getStorage())
+                    return True
+                spool.replay(self.getStorage())
+
+            store = self.getStorage()
 
             store.connect()
             store.save(inventory, runtime)
@@ -153,19 +320,32 @@ class CloudInventario:
         return True
 
     def store_status(self, source, status, runtime=None, error=None):
-        store_config = self.config["storage"]
+        if self.getSpool() or not self.config["storage"].get("dsn"):
+            return self.store({"data": [], "errors": [
+                {"source": source, "status": status, "runtime": runtime, "error": error}]})
 
         with self.lock:
-            store = InventoryStorage(store_config)
+            self.storeSinks({"data": [], "errors": [
+                {"source": source, "status": status, "runtime": runtime, "error": error}]})
+            store = self.getStorage()
             store.connect()
             store.log_status(source, status, runtime, error)
             store.disconnect()
         return True
 
     def cleanup(self, days):
-        store_config = self.config["storage"]
-        store = InventoryStorage(store_config)
+        with self.lock:
+            store = self.getStorage()
+
+            store.connect()
+            store.cleanup(days)
+            store.disconnect()
+
+    def export(self, path, format="parquet", source=None, version=None):
+        store = self.getStorage()
 
         store.connect()
-        store.cleanup(days)
-        store.disconnect()
+        try:
+            return store.export(path, format, source, version)
+        finally:
+            store.disconnect()
@@ -0,0 +1,190 @@
+"""Compression of stored JSON/binary columns (storage: codec: {...})"""
+import base64, hashlib, logging, re, threading, zlib
+
+import sqlalchemy as sa
+
+# encoded values: MARKER + "<codec>.<dictionary>:<base64 data>" (text), binary with raw data;
+# unit separator is escaped by JSON and not part of plain collected values
+MARKER = "\x1fciz:"
+HEADER = re.compile(r"(zlib|zstd)\.([0-9a-f]{12})?:")
+HEADER_BINARY = re.compile(HEADER.pattern.encode())
+
+CODEC_DEFAULTS = {
+  "type": "zlib",
+  "level": None,
+  "dictionary": True,
+  "dict_size": 32768,
+  "dict_samples": 1000,
+}
+
+# trained dictionaries by id, shared by all storages of the process
+_DICTIONARIES = {}
+# callables loading dictionaries unknown to this process, by storage DSN
+_LOADERS = {}
+# (de)compressors are not thread safe, setting up dictionary is costly
+_LOCAL = threading.local()
+
+def dictionary_id(data):
+   return hashlib.sha256(data).hexdigest()[:12]
+
+def add_dictionary(data):
+   _DICTIONARIES[dictionary_id(data)] = data
+   return dictionary_id(data)
+
+def register_loader(key, loader):
+   _LOADERS[key] = loader
+
+def _dictionary(dictionary):
+   if dictionary not in _DICTIONARIES:
+     # trained by other process after we connected
+     for loader in list(_LOADERS.values()):
+       loader()
+   if dictionary not in _DICTIONARIES:
+     raise Exception("Codec dictionary {} not found".format(dictionary))
+   return _DICTIONARIES[dictionary]
+
+def _zstd():
+   try:
+     import zstandard
+   except ImportError:
+     raise Exception("Codec zstd requires zstandard package")
+   return zstandard
+
+class Codec:
+
+   def __init__(self, name, level = None, dictionary = None):
+     if name not in ["zlib", "zstd"]:
+       raise Exception("Unknown codec '{}', use zlib or zstd".format(name))
+     self.name = name
+     self.level = level
+     self.dictionary = dictionary
+     self.prefix = "{}.{}:".format(name, dictionary or "")
+     if name == "zstd":
+       _zstd()
+
+   def __compressor(self):
+     compressors = _LOCAL.__dict__.setdefault("compressors", {})
+     key = (self.name, self.level, self.dictionary)
+     if key not in compressors:
+       zdict = _dictionary(self.dictionary) if self.dictionary else None
+       if self.name == "zstd":
+         zstd = _zstd()
+         params = {"level": self.level or 3}
+         if zdict:
+           params["dict_data"] = zstd.ZstdCompressionDict(zdict)
+         compressors[key] = zstd.ZstdCompressor(**params)
+       elif zdict:
+         # copied for every value, cheaper than loading dictionary again
+         compressors[key] = zlib.compressobj(self.level or 6, zdict=zdict)
+       else:
+         compressors[key] = None
+     return compressors[key]
+
+   def compress(self, data):
+     comp = self.__compressor()
+     if self.name == "zstd":
+       return comp.compress(data)
+     if comp:
+       comp = comp.copy()
+       return comp.compress(data) + comp.flush()
+     return zlib.compress(data, self.level or 6)
+
+   def encode(self, value):
+     if value is None or _header(value):
+       return value
+     if isinstance(value, (bytes, bytearray)):
+       return (MARKER + self.prefix).encode() + self.compress(bytes(value))
+     return MARKER + self.prefix + base64.b64encode(self.compress(value.encode())).decode()
+
+   @staticmethod
+   def train(name, samples, size):
+     """Train dictionary on sample values, returns dictionary data or None"""
+     samples = [sample.encode() if isinstance(sample, str) else sample for sample in samples if sample]
+     if not samples:
+       return None
+     try:
+       if name == "zstd":
+         return _zstd().train_dictionary(size, samples).as_bytes()
+       # zlib preset dictionary: most useful content goes last (32k window)
+       return b"".join(reversed(samples))[:size][-32768:]
+     except Exception as e:
+       logging.warning("codec dictionary training failed: {}".format(e))
+       return None
+
+def _decompressor(name, dictionary):
+   decompressors = _LOCAL.__dict__.setdefault("decompressors", {})
+   key = (name, dictionary)
+   if key not in decompressors:
+     zdict = _dictionary(dictionary) if dictionary else None
+     if name == "zstd":
+       zstd = _zstd()
+       params = {"dict_data": zstd.ZstdCompressionDict(zdict)} if zdict else {}
+       decompressors[key] = zstd.ZstdDecompressor(**params)
+     elif zdict:
+       decompressors[key] = zlib.decompressobj(zdict=zdict)
+     else:
+       decompressors[key] = None
+   return decompressors[key]
+
+def _decompress(name, dictionary, data):
+   decomp = _decompressor(name, dictionary)
+   if name == "zstd":
+     # frames written by compress() carry content size
+     return decomp.decompress(data)
+   if decomp:
+     decomp = decomp.copy()
+     return decomp.decompress(data) + decomp.flush()
+   return zlib.decompress(data)
+
+def _header(value):
+   # match of codec header of encoded value, None for plain values
+   if isinstance(value, (bytes, bytearray)):
+     marker, header = MARKER.encode(), HEADER_BINARY
+   else:
+     marker, header = MARKER, HEADER
+   if not value.startswith(marker):
+     return None
+   return header.match(value, len(marker))
+
+def decode(value):
+   """Decode value written by any codec, plain values are returned as they are"""
+   if value is None:
+     return None
+   if isinstance(value, memoryview):
+     value = bytes(value)
+   match = _header(value)
+   if not match:
+     return value
+
+   text = isinstance(value, str)
+   name, dictionary = [group.decode() if not text and group else group for group in match.groups()]
+   # missing dictionary is an error, not a plain value
+   _decompressor(name, dictionary)
+   try:
+     data = value[match.end():]
+     if text:
+       return _decompress(name, dictionary, base64.b64decode(data, validate = True)).decode()
+     return _decompress(name, dictionary, data)
+   except Exception as e:
+     logging.debug("codec: value with {} header not decoded, returned as is: {}".format(name, e))
+     return value
+
+class CompressedText(sa.types.TypeDecorator):
+   """Text column transparently decoded on read"""
+   impl = sa.Text
+   cache_ok = True
+
+   def process_result_value(self, value, dialect):
+     return decode(value)
+
+class CompressedString(CompressedText):
+   impl = sa.String
+   cache_ok = True
+
+class CompressedBinary(sa.types.TypeDecorator):
+   """Binary column transparently decoded on read"""
+   impl = sa.LargeBinary
+   cache_ok = True
+
+   def process_result_value(self, value, dialect):
+     return decode(value)
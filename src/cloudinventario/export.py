@@ -0,0 +1,230 @@
+"""Columnar export of stored inventory (Parquet / Arrow IPC), requires pyarrow"""
+import json, logging
+
+import sqlalchemy as sa
+
+EXPORT_FORMATS = ["parquet", "arrow"]
+EXPORT_CHUNK_SIZE = 50000
+
+# JSON text columns of regular shape exported as typed nested columns
+NESTED_COLUMNS = ["networks", "storages"]
+# JSON text columns exported as map<string, string>
+MAP_COLUMNS = ["tags"]
+# details, attributes (free form, keys differ by collector) stay JSON text
+
+def _pyarrow():
+   try:
+     import pyarrow
+   except ImportError:
+     raise Exception("Export requires pyarrow package")
+   return pyarrow
+
+def _loads(value):
+   if not isinstance(value, str):
+     return value
+   try:
+     return json.loads(value)
+   except ValueError:
+     return value
+
+class InventoryExport:
+   """Export rows of InventoryStorage.query() in chunks.
+
+   Column types come from the storage table, tags are written as map and
+   other JSON text columns as text. Types of nested columns (networks,
+   storages) are not known upfront, so rows are read twice: first pass
+   merges types of their values (struct fields are union of seen keys,
+   conflicting scalars become strings), second pass writes chunks conformed
+   to that schema. Memory is bounded by chunk size in both passes.
+   """
+
+   def __init__(self, storage, path, format = "parquet", chunk_size = EXPORT_CHUNK_SIZE):
+     if format not in EXPORT_FORMATS:
+       raise Exception("Unknown export format '{}', use one of: {}".format(format, ", ".join(EXPORT_FORMATS)))
+     self.pa = _pyarrow()
+     self.storage = storage
+     self.path = path
+     self.format = format
+     self.chunk_size = chunk_size
+
+   def __chunks(self, **query):
+     chunk = []
+     for row in self.storage.query(**query):
+       for column in NESTED_COLUMNS:
+         if column in row:
+           row[column] = _loads(row[column])
+       for column in MAP_COLUMNS:
+         if column in row:
+           row[column] = self.__map(_loads(row[column]))
+       chunk.append(row)
+       if len(chunk) >= self.chunk_size:
+         yield chunk
+         chunk = []
+     if chunk:
+       yield chunk
+
+   @staticmethod
+   def __map(value):
+     # {key: value} or [{"Key": key, "Value": value}] as (key, text) pairs
+     if isinstance(value, list) and all(isinstance(item, dict) and "Key" in item for item in value):
+       value = {item["Key"]: item.get("Value") for item in value}
+     if not isinstance(value, dict):
+       return None
+     return [(str(key), item if isinstance(item, str) or item is None else json.dumps(item, default=str))
+             for key, item in value.items()]
+
+   def __column_type(self, column, column_type):
+     pa = self.pa
+     if column in MAP_COLUMNS:
+       return pa.map_(pa.string(), pa.string())
+     if isinstance(column_type, sa.types.TypeDecorator):
+       column_type = column_type.impl
+     if isinstance(column_type, sa.Boolean):
+       return pa.bool_()
+     if isinstance(column_type, sa.Integer):
+       return pa.int64()
+     if isinstance(column_type, (sa.Float, sa.Numeric)):
+       return pa.float64()
+     if isinstance(column_type, sa.LargeBinary):
+       return pa.binary()
+     return pa.string()
+
+   def __infer(self, value):
+     pa = self.pa
+     if value is None:
+       return pa.null()
+     if isinstance(value, bool):
+       return pa.bool_()
+     if isinstance(value, int):
+       return pa.int64()
+     if isinstance(value, float):
+       return pa.float64()
+     if isinstance(value, dict):
+       return pa.struct([pa.field(str(key), self.__infer(item)) for key, item in value.items()])
+     if isinstance(value, list):
+       item_type = pa.null()
+       for item in value:
+         item_type = self.__merge(item_type, self.__infer(item))
+       return pa.list_(item_type)
+     return pa.string()
+
+   def __merge(self, a, b):
+     pa = self.pa
+     if a == b or pa.types.is_null(b):
+       return a
+     if pa.types.is_null(a):
+       return b
+     if pa.types.is_struct(a) and pa.types.is_struct(b):
+       fields = {field.name: field.type for field in a}
+       for field in b:
+         fields[field.name] = self.__merge(fields[field.name], field.type) if field.name in fields else field.type
+       return pa.struct([pa.field(name, field_type) for name, field_type in fields.items()])
+     if pa.types.is_list(a) and pa.types.is_list(b):
+       return pa.list_(self.__merge(a.value_type, b.value_type))
+     if pa.types.is_integer(a) and pa.types.is_floating(b) or pa.types.is_floating(a) and pa.types.is_integer(b):
+       return pa.float64()
+     return pa.string()
+
+   def __chunk_type(self, values):
+     # let arrow infer whole chunk, walk values only on mixed types
+     try:
+       return self.pa.array(values).type
+     except (self.pa.ArrowInvalid, self.pa.ArrowTypeError):
+       value_type = self.pa.null()
+       for value in values:
+         value_type = self.__merge(value_type, self.__infer(value))
+       return value_type
+
+   def __finalize(self, value_type):
+     # parquet can't store struct without fields, nor null type
+     pa = self.pa
+     if pa.types.is_null(value_type):
+       return pa.string()
+     if pa.types.is_struct(value_type):
+       if value_type.num_fields == 0:
+         return pa.string()
+       return pa.struct([pa.field(field.name, self.__finalize(field.type)) for field in value_type])
+     if pa.types.is_list(value_type):
+       return pa.list_(self.__finalize(value_type.value_type))
+     return value_type
+
+   def __conform(self, value, value_type):
+     pa = self.pa
+     if value is None or pa.types.is_null(value_type):
+       return None
+     if pa.types.is_struct(value_type):
+       if not isinstance(value, dict):
+         return None
+       return {field.name: self.__conform(value.get(field.name), field.type) for field in value_type}
+     if pa.types.is_list(value_type):
+       if not isinstance(value, list):
+         return None
+       return [self.__conform(item, value_type.value_type) for item in value]
+     if pa.types.is_string(value_type):
+       if isinstance(value, str):
+         return value
+       return json.dumps(value, default=str)
+     if pa.types.is_binary(value_type):
+       return value if isinstance(value, bytes) else None
+     if pa.types.is_map(value_type):
+       return value if isinstance(value, list) else None
+     if isinstance(value, (dict, list, str)):
+       return None
+     if pa.types.is_boolean(value_type):
+       return bool(value)
+     if pa.types.is_integer(value_type):
+       return int(value)
+     return float(value)
+
+   def schema(self, **query):
+     pa = self.pa
+     columns = self.storage.query_columns(query.get("table", "inventory"))
+     types = {column: self.__column_type(column, column_type) for column, column_type in columns.items()}
+
+     nested = [column for column in NESTED_COLUMNS if column in types]
+     if nested:
+       for column in nested:
+         types[column] = pa.null()
+       for chunk in self.__chunks(**query):
+         for column in nested:
+           values = [row[column] for row in chunk]
+           types[column] = self.__merge(types[column], self.__chunk_type(values))
+     return pa.schema([pa.field(column, self.__finalize(column_type)) for column, column_type in types.items()])
+
+   def write(self, source = None, version = None, table = 'inventory'):
+     """Write rows of source version (latest of all sources if None), returns row count"""
+     pa = self.pa
+     query = {"table": table, "source": source, "version": version}
+     schema = self.schema(**query)
+
+     if self.format == "parquet":
+       import pyarrow.parquet as pq
+       writer = pq.ParquetWriter(self.path, schema, compression = "zstd")
+       write = writer.write_table
+     else:
+       sink = pa.OSFile(self.path, "wb")
+       writer = pa.ipc.new_file(sink, schema)
+       write = writer.write_table
+
+     rows = 0
+     try:
+       for chunk in self.__chunks(**query):
+         columns = []
+         for field in schema:
+           values = [row.get(field.name) for row in chunk]
+           try:
+             columns.append(pa.array(values, type = field.type))
+           except (pa.ArrowInvalid, pa.ArrowTypeError):
+             # values of mixed types, convert one by one
+             columns.append(pa.array([self.__conform(value, field.type) for value in values], type = field.type))
+         write(pa.Table.from_arrays(columns, schema = schema))
+         rows += len(chunk)
+         logging.debug("export: {} rows written to {}".format(rows, self.path))
+     finally:
+       writer.close()
+       if self.format != "parquet":
+         sink.close()
+
+     logging.info("export: {} rows of table={} source={} version={} written to {}".format(
+                    rows, table, source, version, self.path))
+     return rows
@@ -2,14 +2,21 @@
 import requests
 import datetime
 import json
+import time
 import logging
 import importlib
+import concurrent.futures
 import dns.resolver
 import dns.exception
 from pprint import pprint
 
 import cloudinventario.platform as platform
 from cloudinventario.limiter import CloudInventarioLimiter
+from cloudinventario.checkpoint import CollectorCheckpoint
+from cloudinventario.scheduler import get_scheduler, PoolExecutor
+
+# node of the main _fetch() pass in resource scheduling
+MAIN_PASS = None
 
 class CloudEncoder(json.JSONEncoder):
   def default(self, z):
@@ -42,10 +49,13 @@ class CloudCollector:
 
     self.resource_manager = None
     self.resource_collectors = {}
+    self.writer = None
+    self.checkpoint = None
     return
 
   def _init(self, **kwargs):
     self.collector_pkg = kwargs['collector_pkg']
+    self.provider = self.collector_pkg[len("cloudinventario_"):].replace("_", "-")
     self.resources = kwargs['resources']
     self.dependencies = self._get_dependencies()
 
@@ -82,13 +92,15 @@ class CloudCollector:
         raise
     return True
 
-  def fetch(self, collect = None):
+  def fetch(self, collect = None, writer = None):
     self.__pre_request()
+    self.writer = writer
     try:
-      data = []
-      data.extend(self._resource_fetch())
-      data.extend(self._fetch(collect))
+      self.checkpoint = self._checkpoint()
+      data = self._resource_fetch(lambda: self._stream(self._fetch(collect)))
 
+      if self.checkpoint:
+        self.checkpoint.clear()
       data = list(filter(lambda x: x, data))
       if 'status_error' in self.__dict__:
         if len(self.status_error) > 0:
@@ -98,21 +110,90 @@ class CloudCollector:
       if not (self.options['check_permission'] and self.check_permission(self.client, error)):
         raise
     finally:
+      self.writer = None
+      self.checkpoint = None
       self.__post_request()
 
-  def _resource_fetch(self):
-    if not self.resource_manager:
-      return []
+  def _checkpoint(self):
+    config = self.config.get('checkpoint', self.options.get('checkpoint'))
+    if not config:
+      return None
+    return CollectorCheckpoint(self.name, config)
+
+  def _checkpointed(self, part, fetch):
+    # part completed by previous failed run (within checkpoint window) is not fetched again
+    if self.checkpoint is None:
+      return fetch()
+    if self.checkpoint.done(part):
+      return self.checkpoint.load(part)
+    records = fetch()
+    if isinstance(records, list):
+      self.checkpoint.save(part, records)
+    return records
+
+  def _stream(self, records):
+    # with storage writer, records are written right away and not kept
+    if self.writer is None or records is None:
+      return records or []
+    self.writer.append(records)
+    return []
+
+  def _resource_fetch(self, main = None):
+    # every resource starts once resources it reads are fetched (up to tasks in parallel),
+    # main pass once resources of get_dependencies() are fetched
+    if not self.resource_manager or not self.resource_collectors:
+      return main() if main else []
+
+    manager = self.resource_manager
+    graph = {name: manager.dependencies.get(name, set()) & set(self.resource_collectors) for name in self.resource_collectors}
+    if main:
+      graph[MAIN_PASS] = set(self.get_dependencies()) & set(self.resource_collectors)
+    required = set().union(*graph.values())
+
+    results = {}
+    times = {}
+    with self._executor() as executor:
+      pending = {}
+      try:
+        while graph or pending:
+          for name in [name for name, deps in graph.items() if deps <= results.keys()]:
+            del graph[name]
+            pending[executor.submit(self.__fetch_node, name, main, name in required, times)] = name
+          done, _ = executor.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+          for future in done:
+            results[pending.pop(future)] = future.result()
+      except Exception:
+        for future in pending:
+          future.cancel()
+        raise
 
+    manager.timing(times)
     data = []
+    for name in self.resource_collectors:
+      data.extend(results[name])
+    data.extend(results.get(MAIN_PASS, []))
+    return data
+
+  def _executor(self):
+    # shared scheduler of the process if configured, own pool of tasks otherwise
+    scheduler = get_scheduler()
+    if scheduler is not None:
+      return scheduler.executor(self.provider)
+    return PoolExecutor(max_workers = self.options.get("tasks") or 1)
+
+  def __fetch_node(self, name, main, required, times):
+    start = time.time()
     try:
-      res = ''
-      for res in self.resource_collectors.values(): # self.resource_collectors is already ordered by dependecy
-        data.extend(res.fetch())
-      return data
-    except Exception:
-      if not (self.options['check_permission'] and self.check_permission(self.client, error)):
-        raise
+      if name == MAIN_PASS:
+        return main()
+      res = self.resource_collectors[name]
+      if required:
+        # others read its data/raw_data, always fetched
+        return self._stream(res.fetch())
+      res.data = self._checkpointed("resource-" + name, res.fetch)
+      return self._stream(res.data)
+    finally:
+      times[name] = (start, time.time())
 
   def logout(self):
     self.__pre_request()
@@ -264,29 +345,19 @@ class CloudInvetarioResourceManager:
     self.res_list = res_list or []
     self.collector_pkg = collector_pkg
     self.collector = collector
-    self.dep_classif = {  # dependency_classification
-      "dependency": set(),
-      "not_dependency": set(),
-    }
+    self.dependencies = {}  # resource -> resources it reads (declared by resource)
+    self.levels = []        # topological levels, resources of one level are independent
+    self.level_times = []   # seconds per level of last fetch
 
   def get_resource_objs(self, res_dep_list = []):
     obj_dict = {}
 
-    # sorting based on whether a resource needs priority in fetching or not
-    res_list = list(set((res_dep_list or []) + self.res_list))
-    for resource in res_list:
-      if resource in res_dep_list:
-        self.dep_classif["dependency"].add(resource)
-      else:
-        self.dep_classif["not_dependency"].add(resource)
-
-    res_list = []
-    res_list.extend(self.dep_classif["dependency"] or [])
-    res_list.extend(self.dep_classif["not_dependency"] or [])
-    if res_list:
-      res_list.sort()
-
-    for res in res_list:
+    # requested resources and everything they depend on
+    queue = list(dict.fromkeys((res_dep_list or []) + self.res_list))
+    while queue:
+      res = queue.pop(0)
+      if res in obj_dict:
+        continue
       try:
         mod_name = self.collector_pkg + ".resources." + res
         logging.debug("Importing module: {}".format(mod_name))
@@ -295,8 +366,52 @@ class CloudInvetarioResourceManager:
         logging.error("Failed to load the following module:{}, reason: {}".format(mod_name, e))
         raise
       obj_dict[res] = res_mod.setup(res, self.collector)
-
-    return obj_dict
+      self.dependencies[res] = set(obj_dict[res].get_dependencies())
+      queue.extend(self.dependencies[res] - obj_dict.keys())
+
+    self.levels = self.topological_levels(self.dependencies)
+    logging.debug("resource levels of collector={}: {}".format(self.collector.name, self.levels))
+
+    # ordered by dependency
+    return {res: obj_dict[res] for level in self.levels for res in level}
+
+  @staticmethod
+  def topological_levels(graph):
+    """Levels of {node: dependencies}, every node comes after all its dependencies"""
+    levels = []
+    done = set()
+    remaining = {node: set(deps) for node, deps in graph.items()}
+    while remaining:
+      level = sorted(node for node, deps in remaining.items() if deps <= done)
+      if not level:
+        raise Exception("Resource dependency cycle: {}".format(" -> ".join(CloudInvetarioResourceManager.__cycle(remaining))))
+      for node in level:
+        del remaining[node]
+      done.update(level)
+      levels.append(level)
+    return levels
+
+  @staticmethod
+  def __cycle(remaining):
+    # follow unresolved dependencies until a node repeats
+    path = [min(remaining)]
+    while True:
+      node = min(dep for dep in remaining[path[-1]] if dep in remaining)
+      if node in path:
+        return path[path.index(node):] + [node]
+      path.append(node)
+
+  def timing(self, times):
+    """Wall time of every level from per-resource (start, end) times"""
+    self.level_times = []
+    for idx, level in enumerate(self.levels):
+      spans = [times[res] for res in level if res in times]
+      if not spans:
+        continue
+      seconds = max(end for start, end in spans) - min(start for start, end in spans)
+      self.level_times.append(seconds)
+      logging.info("collector={} resource level={} {} fetched in {:.3f}s".format(self.collector.name, idx, level, seconds))
+    return self.level_times
 
 
 class CloudInvetarioResource():
@@ -337,6 +452,13 @@ class CloudInvetarioResource():
       logging.error("Failed to process the following type of resource: {}".format(self.res_type))
       raise
 
+  def get_dependencies(self):
+    """Resources whose data this resource reads, fetched before it"""
+    return self._get_dependencies() or []
+
+  def _get_dependencies(self):
+    return None
+
   def get_client(self):
     try:
       client = self._get_client()
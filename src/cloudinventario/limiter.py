@@ -1,3 +1,5 @@
+import threading
+
 class Singleton(object):
   _instances = {}
   def __new__(class_, *args, **kwargs):
@@ -6,6 +8,9 @@ class Singleton(object):
     return class_._instances[class_]
 
 class CloudInventarioLimiter(Singleton):
+    # counters are updated by resource collectors fetching in parallel
+    lock = threading.Lock()
+
     def __init__(self):
         self.sources = {}
 
@@ -17,13 +22,14 @@ class CloudInventarioLimiter(Singleton):
             }
 
     def add_counter(self, name, config):
-        if name in self.sources:
-            counter = self.sources[name]['counter']
-            limit = self.sources[name]['inventory-limit']
+        with self.lock:
+            if name in self.sources:
+                counter = self.sources[name]['counter']
+                limit = self.sources[name]['inventory-limit']
 
-            if (counter + 1) > limit:
-                return False, f'Source {name} reached limit for collecting'
-            self.sources[name]['counter'] = counter + 1
-        else:
-            self.add_source(name, config, counter=1)
+                if (counter + 1) > limit:
+                    return False, f'Source {name} reached limit for collecting'
+                self.sources[name]['counter'] = counter + 1
+            else:
+                self.add_source(name, config, counter=1)
         return True, ''
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""Time partitioned inventory table (storage: partition: day|week)"""
+import logging
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+PARTITION_PERIODS = {
+  "day": 1,
+  "week": 7,
+}
+
+# (dsn, partition) known to exist, per process
+_PARTITIONS = set()
+
+class InventoryPartitions:
+   """Partitions of ci_inventory by collection period.
+
+   PostgreSQL uses native declarative partitioning (RANGE on period column),
+   SQLite gets table per period and ci_inventory view (UNION ALL) over them.
+   """
+
+   def __init__(self, storage, period):
+     if period not in PARTITION_PERIODS:
+       raise Exception("Unknown partition period '{}', use one of: {}".format(period, ", ".join(PARTITION_PERIODS)))
+     if storage.engine.dialect.name not in ["sqlite", "postgresql"]:
+       raise Exception("Partitioning is not supported on {}".format(storage.engine.dialect.name))
+
+     self.storage = storage
+     self.period = period
+     self.dialect = storage.engine.dialect.name
+     self.tables = {}
+
+   @property
+   def native(self):
+     return self.dialect == "postgresql"
+
+   @property
+   def table(self):
+     return self.storage.inventory_table
+
+   def start(self, now = None):
+     start = (now or datetime.utcnow()).date()
+     if self.period == "week":
+       start -= timedelta(days=start.weekday())
+     return start
+
+   def end(self, start):
+     return start + timedelta(days=PARTITION_PERIODS[self.period])
+
+   def name(self, start):
+     return "{}_p{}".format(self.table.name, start.strftime("%Y%m%d"))
+
+   def check(self, conn):
+     # existing unpartitioned inventory can't be converted in place
+     if self.dialect == "sqlite":
+       kind = conn.execute(sa.text("SELECT type FROM sqlite_master WHERE name = :name"),
+                           {"name": self.table.name}).scalar()
+       partitioned = kind in [None, "view"]
+     else:
+       kind = conn.execute(sa.text("SELECT c.relkind FROM pg_class c WHERE c.relname = :name"),
+                           {"name": self.table.name}).scalar()
+       partitioned = kind in [None, "p"]
+     if not partitioned:
+       raise Exception("Table {} exists and is not partitioned, migrate it or disable partitioning".format(self.table.name))
+     return True
+
+   def create_schema(self, conn, tables):
+     self.check(conn)
+     if self.native:
+       self.storage.meta.create_all(conn, tables = tables, checkfirst = True)
+     else:
+       self.storage.meta.create_all(conn, tables = [table for table in tables if table is not self.table], checkfirst = True)
+     self.ensure(conn)
+     return True
+
+   def list(self, conn):
+     """Existing partitions as [(name, start)]"""
+     if self.native:
+       res = conn.execute(sa.text("SELECT c.relname FROM pg_inherits i"
+                                  " JOIN pg_class c ON c.oid = i.inhrelid"
+                                  " JOIN pg_class p ON p.oid = i.inhparent"
+                                  " WHERE p.relname = :name"), {"name": self.table.name})
+     else:
+       res = conn.execute(sa.text("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :name ESCAPE '\\'"),
+                          {"name": self.table.name + "\\_p%"})
+     partitions = []
+     for row in res.fetchall():
+       try:
+         partitions.append((row[0], datetime.strptime(row[0][-8:], "%Y%m%d").date()))
+       except ValueError:
+         continue
+     partitions.sort(key = lambda part: part[1])
+     return partitions
+
+   def physical(self, conn):
+     """Tables holding the rows (for ALTER TABLE)"""
+     if self.native:
+       return [self.table.name]
+     return [name for name, start in self.list(conn)]
+
+   def refresh(self, conn):
+     if not self.native:
+       self.__sqlite_view(conn)
+
+   def ensure(self, conn, now = None):
+     """Create partition of current period, returns table to insert into"""
+     start = self.start(now)
+     name = self.name(start)
+     if (self.storage.dsn, name) not in _PARTITIONS:
+       logging.debug("storage partition={}".format(name))
+       if self.native:
+         conn.execute(sa.text("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ('{}') TO ('{}')"
+                        .format(name, self.table.name, start.isoformat(), self.end(start).isoformat())))
+       else:
+         self.__partition_table(name).create(conn, checkfirst = True)
+         self.__sqlite_view(conn)
+       _PARTITIONS.add((self.storage.dsn, name))
+
+     if self.native:
+       return self.table
+     return self.__partition_table(name)
+
+   def drop(self, conn, expired):
+     """Drop partitions which ended before expired date"""
+     dropped = []
+     for name, start in self.list(conn):
+       if self.end(start) > expired:
+         continue
+       logging.info("prune: dropping partition={}".format(name))
+       conn.execute(sa.text("DROP TABLE IF EXISTS {}".format(name)))
+       _PARTITIONS.discard((self.storage.dsn, name))
+       dropped.append(name)
+
+     if dropped and not self.native:
+       self.ensure(conn)
+       self.__sqlite_view(conn)
+     return dropped
+
+   def __partition_table(self, name):
+     if name in self.tables:
+       return self.tables[name]
+
+     # copy of ci_inventory definition, index names must be unique in sqlite
+     args = [column.copy() for column in self.table.columns]
+     for constraint in self.table.constraints:
+       if isinstance(constraint, sa.UniqueConstraint):
+         args.append(sa.UniqueConstraint(*[column.name for column in constraint.columns]))
+     for index in self.table.indexes:
+       args.append(sa.Index(index.name.replace(self.table.name, name, 1), *[column.name for column in index.columns]))
+     self.tables[name] = sa.Table(name, sa.MetaData(), *args)
+     return self.tables[name]
+
+   def __sqlite_view(self, conn):
+     names = [name for name, start in self.list(conn)]
+     conn.execute(sa.text("DROP VIEW IF EXISTS {}".format(self.table.name)))
+     if names:
+       conn.execute(sa.text("CREATE VIEW {} AS {}".format(self.table.name,
+                      " UNION ALL ".join("SELECT * FROM {}".format(name) for name in names))))
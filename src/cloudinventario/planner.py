@@ -0,0 +1,27 @@
+"""Collector order by expected runtime (order: runtime)"""
+import heapq, logging
+
+ORDERS = ["config", "runtime"]
+
+def makespan(collectors, runtimes, workers):
+   """Expected wall time of running collectors in this order on workers (each takes the next free one)"""
+   finish = [0.0] * max(workers, 1)
+   for name in collectors:
+     heapq.heappush(finish, heapq.heappop(finish) + runtimes.get(name, 0))
+   return max(finish)
+
+def plan(collectors, runtimes, workers = 1):
+   """Longest expected runtime first, collectors without history go first.
+
+   Workers take the next collector as they get free, so this order is the
+   longest-processing-time-first schedule (within 4/3 of optimal makespan):
+   long collectors don't start last and stretch the run.
+   """
+   unknown = [name for name in collectors if name not in runtimes]
+   known = sorted((name for name in collectors if name in runtimes), key = lambda name: -runtimes[name])
+   order = unknown + known
+
+   if known:
+     logging.info("plan: {} collectors on {} workers, expected makespan {:.0f}s (config order {:.0f}s), {} without history".format(
+                    len(order), workers, makespan(order, runtimes, workers), makespan(collectors, runtimes, workers), len(unknown)))
+   return order
@@ -0,0 +1,191 @@
+"""Shared task scheduler (scheduler: {workers, limits}) of collectors, accounts, regions and resources"""
+import threading, collections, concurrent.futures, logging
+
+SCHEDULER_DEFAULTS = {
+  "workers": 16,    # tasks in flight in total
+  "limits": {},     # provider (collector module, e.g. amazon-aws) -> tasks in flight
+}
+
+_SCHEDULER = None
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+def configure(config):
+   """Scheduler of this process, created by first call"""
+   global _SCHEDULER
+   with _LOCK:
+     if _SCHEDULER is None:
+       _SCHEDULER = TaskScheduler(config if isinstance(config, dict) else {})
+     return _SCHEDULER
+
+def get_scheduler():
+   return _SCHEDULER
+
+class TaskScheduler:
+   """Worker threads shared by all collectors of a process.
+
+   Every task is tagged with its provider. A free worker takes the oldest
+   queued task whose provider is under its limit, whichever collector
+   submitted it. A worker waiting for subtasks (accounts -> regions ->
+   resources) runs queued tasks meanwhile instead of blocking, and gives up
+   its provider slot while waiting, so nested fan-out can't deadlock and
+   in-flight tasks never exceed workers.
+   """
+
+   def __init__(self, config):
+     self.config = {**SCHEDULER_DEFAULTS, **config}
+     self.workers = self.config["workers"]
+     self.limits = self.config["limits"] or {}
+     self.queue = collections.deque()
+     self.running = collections.Counter()
+     self.cond = threading.Condition()
+     self.threads = []
+     self.stats = {"submitted": 0, "done": 0, "helped": 0}
+
+   def __start(self):
+     # threads start with first task, not in parent of forked collectors
+     while len(self.threads) < self.workers:
+       thread = threading.Thread(target = self.__worker, name = "scheduler-{}".format(len(self.threads)), daemon = True)
+       thread.start()
+       self.threads.append(thread)
+     logging.debug("scheduler started, workers={}, limits={}".format(self.workers, self.limits))
+
+   def submit(self, provider, fn, *args, **kwargs):
+     future = concurrent.futures.Future()
+     with self.cond:
+       if not self.threads:
+         self.__start()
+       self.queue.append((provider, future, fn, args, kwargs))
+       self.stats["submitted"] += 1
+       self.cond.notify_all()
+     return future
+
+   def executor(self, provider):
+     return SchedulerExecutor(self, provider)
+
+   def status(self):
+     with self.cond:
+       return {**self.stats, "queued": len(self.queue), "workers": self.workers,
+               "running": {provider: count for provider, count in self.running.items() if count}}
+
+   def __take(self):
+     # oldest queued task of provider under its limit, under cond
+     for task in self.queue:
+       limit = self.limits.get(task[0])
+       if not limit or self.running[task[0]] < limit:
+         self.queue.remove(task)
+         self.running[task[0]] += 1
+         return task
+     return None
+
+   def __run(self, task):
+     provider, future, fn, args, kwargs = task
+     stack = _LOCAL.__dict__.setdefault("providers", [])
+     stack.append(provider)
+     try:
+       if future.set_running_or_notify_cancel():
+         try:
+           future.set_result(fn(*args, **kwargs))
+         except BaseException as e:
+           future.set_exception(e)
+     finally:
+       stack.pop()
+       with self.cond:
+         self.running[provider] -= 1
+         self.stats["done"] += 1
+         self.cond.notify_all()
+
+   def __worker(self):
+     _LOCAL.worker = self
+     while True:
+       with self.cond:
+         task = self.__take()
+         while task is None:
+           self.cond.wait()
+           task = self.__take()
+       self.__run(task)
+
+   def __finished(self, futures, return_when):
+     done = {future for future in futures if future.done()}
+     if len(done) == len(futures):
+       return done
+     if return_when == concurrent.futures.FIRST_COMPLETED and done:
+       return done
+     if return_when == concurrent.futures.FIRST_EXCEPTION and \
+          any(not future.cancelled() and future.exception() is not None for future in done):
+       return done
+     return None
+
+   def wait(self, futures, return_when = concurrent.futures.ALL_COMPLETED):
+     """concurrent.futures.wait(), workers run queued tasks while waiting"""
+     futures = set(futures)
+     helper = getattr(_LOCAL, "worker", None) is self
+     stack = getattr(_LOCAL, "providers", None)
+     if helper and stack:
+       with self.cond:
+         self.running[stack[-1]] -= 1
+     try:
+       while True:
+         done = self.__finished(futures, return_when)
+         if done is not None:
+           return done, futures - done
+         with self.cond:
+           task = self.__take() if helper else None
+           if task is None:
+             self.cond.wait(0.1)
+             continue
+           self.stats["helped"] += 1
+         self.__run(task)
+     finally:
+       if helper and stack:
+         with self.cond:
+           self.running[stack[-1]] += 1
+
+   def as_completed(self, futures):
+     """concurrent.futures.as_completed(), workers run queued tasks while waiting"""
+     pending = set(futures)
+     while pending:
+       done, pending = self.wait(pending, concurrent.futures.FIRST_COMPLETED)
+       yield from done
+
+
+class SchedulerExecutor(concurrent.futures.Executor):
+   """Executor of one provider submitting to TaskScheduler"""
+
+   def __init__(self, scheduler, provider):
+     self.scheduler = scheduler
+     self.provider = provider
+     self.futures = set()
+
+   def submit(self, fn, /, *args, **kwargs):
+     future = self.scheduler.submit(self.provider, fn, *args, **kwargs)
+     self.futures.add(future)
+     return future
+
+   def map(self, fn, *iterables, timeout = None, chunksize = 1):
+     futures = [self.submit(fn, *args) for args in zip(*iterables)]
+     self.scheduler.wait(futures)
+     return (future.result() for future in futures)
+
+   def wait(self, futures, return_when = concurrent.futures.ALL_COMPLETED):
+     return self.scheduler.wait(futures, return_when)
+
+   def as_completed(self, futures):
+     return self.scheduler.as_completed(futures)
+
+   def shutdown(self, wait = True, *, cancel_futures = False):
+     if cancel_futures:
+       for future in self.futures:
+         future.cancel()
+     if wait:
+       self.scheduler.wait(self.futures)
+
+
+class PoolExecutor(concurrent.futures.ThreadPoolExecutor):
+   """Own thread pool of a collector when no scheduler is configured"""
+
+   def wait(self, futures, return_when = concurrent.futures.ALL_COMPLETED):
+     return concurrent.futures.wait(futures, return_when = return_when)
+
+   def as_completed(self, futures):
+     return concurrent.futures.as_completed(futures)
@@ -0,0 +1,67 @@
+"""Per-process cache of SDK sessions, identities and credentials, kept across collections of a reused worker"""
+import threading, hashlib, time, logging
+from datetime import datetime
+
+SESSION_TTL = 3000    # seconds, below 1 hour lifetime of temporary credentials
+EXPIRY_MARGIN = 300   # seconds before expiration, credentials are not handed out anymore
+
+_CACHE = {}
+_LOCK = threading.Lock()
+_STATS = {"hits": 0, "misses": 0}
+
+def _key(kind, credentials):
+   # secrets are not kept as keys
+   return kind, hashlib.sha256(repr(credentials).encode()).hexdigest()
+
+def until(expiration, margin = EXPIRY_MARGIN):
+   """ttl of value valid until expiration (datetime or timestamp), margin seconds before it"""
+   if isinstance(expiration, datetime):
+     expiration = expiration.timestamp()
+   return max(0, expiration - time.time() - margin)
+
+def cached(kind, credentials, create, ttl = SESSION_TTL):
+   """Value of create() for (kind, credentials), created again after ttl seconds.
+
+   ttl may be a function of the created value (e.g. its expiration, see
+   until()). Creation runs outside of the lock, two threads missing the
+   same key at once may both create it, last one is kept. Expired entries
+   are removed on insert.
+   """
+   key = _key(kind, credentials)
+   now = time.time()
+   with _LOCK:
+     entry = _CACHE.get(key)
+     if entry is not None and entry[0] > now:
+       _STATS["hits"] += 1
+       return entry[1]
+     _STATS["misses"] += 1
+
+   value = create()
+   if callable(ttl):
+     ttl = ttl(value)
+   with _LOCK:
+     for expired in [key for key, entry in _CACHE.items() if entry[0] <= now]:
+       del _CACHE[expired]
+     _CACHE[key] = (now + ttl, value)
+   logging.debug("sessions: new {} cached for {}s".format(kind, ttl))
+   return value
+
+def per_thread(kind, credentials, create, ttl = SESSION_TTL):
+   """Like cached(), for values that must not be shared by threads (SDK sessions).
+
+   One entry per credentials holds a value of create() per thread, values of
+   finished threads go away with them.
+   """
+   local = cached(kind, credentials, threading.local, ttl)
+   value = getattr(local, "value", None)
+   if value is None:
+     value = local.value = create()
+   return value
+
+def clear():
+   with _LOCK:
+     _CACHE.clear()
+
+def stats():
+   with _LOCK:
+     return {**_STATS, "entries": len(_CACHE)}
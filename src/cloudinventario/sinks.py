@@ -0,0 +1,367 @@
+"""File based storage sinks (storage: sinks: [...]), written next to or instead of the database"""
+import os, io, json, time, struct, fcntl, logging, tempfile, threading
+from contextlib import contextmanager
+
+SINK_DEFAULTS = {
+  "jsonl": {"path": None, "batch": 1000, "max_bytes": 256 * 1024 * 1024, "fsync": False},
+  "parquet": {"path": None, "batch": 50000, "max_rows": 1000000},
+  "log": {"path": None, "batch": 1000, "segment_bytes": 256 * 1024 * 1024, "index_interval": 1000, "fsync": True},
+}
+
+def _entries(data, runtime):
+   """save() data as log entries: status, records, commit"""
+   errors = []
+   if type(data) is dict:
+     errors = data['errors']
+     data = data['data']
+   for status in errors:
+     yield {"type": "status", **status}
+   entries = 0
+   for rec in data or []:
+     if rec:
+       entries += 1
+       yield {"type": "record", "data": rec}
+   yield {"type": "commit", "ts": time.time(), "runtime": runtime, "entries": entries}
+
+def _batches(items, size):
+   batch = []
+   for item in items:
+     batch.append(item)
+     if len(batch) >= size:
+       yield batch
+       batch = []
+   if batch:
+     yield batch
+
+class InventorySink:
+   """Sink of collected data, same save()/log_status() calls as InventoryStorage"""
+   type = None
+
+   def __init__(self, config):
+     self.config = {**SINK_DEFAULTS[self.type], **config}
+     self.path = self.config["path"]
+     if not self.path:
+       raise Exception("Sink {} requires path".format(self.type))
+     os.makedirs(self.path, exist_ok = True)
+     self.written = 0
+
+   @contextmanager
+   def _locked(self):
+     # sinks are shared by forked collectors, one writer at a time
+     with open(os.path.join(self.path, ".lock"), "w") as lock:
+       fcntl.flock(lock, fcntl.LOCK_EX)
+       yield
+
+   def save(self, data, runtime = None):
+     if data is None:
+       return False
+     with self._locked():
+       count = self._write(_entries(data, runtime))
+     self.written += count
+     logging.debug("sink {}: {} entries written to {}".format(self.type, count, self.path))
+     return True
+
+   def log_status(self, source, status, runtime = None, error = None):
+     return self.save({"data": [], "errors": [{"source": source, "status": status, "runtime": runtime, "error": error}]})
+
+   def flush(self):
+     """Make data buffered by sink visible (end of run)"""
+     return True
+
+   def _write(self, entries):
+     raise NotImplementedError()
+
+
+class JsonlSink(InventorySink):
+   """Rotating JSON-lines files: inventory-<ts>.jsonl, new file after max_bytes"""
+   type = "jsonl"
+
+   def __current(self):
+     names = sorted(name for name in os.listdir(self.path) if name.startswith("inventory-") and name.endswith(".jsonl"))
+     if names and os.path.getsize(os.path.join(self.path, names[-1])) < self.config["max_bytes"]:
+       return os.path.join(self.path, names[-1])
+     return os.path.join(self.path, "inventory-{:.6f}.jsonl".format(time.time()))
+
+   def _write(self, entries):
+     count = 0
+     name = self.__current()
+     f = open(name, "a")
+     try:
+       for batch in _batches(entries, self.config["batch"]):
+         f.write("".join(json.dumps(entry, default=str) + "\n" for entry in batch))
+         f.flush()
+         count += len(batch)
+         if f.tell() >= self.config["max_bytes"]:
+           f.close()
+           f = open(self.__current(), "a")
+       if self.config["fsync"]:
+         os.fsync(f.fileno())
+     finally:
+       f.close()
+     return count
+
+
+class ParquetSink(InventorySink):
+   """Parquet files of records, requires pyarrow.
+
+   Records of all saves are appended to pending.jsonl and converted to one
+   inventory-<ts>.parquet file (row group per batch, every column as text)
+   when max_rows are pending or on flush(), so small collections do not
+   make a file each. Status and commit entries go to status.jsonl.
+   """
+   type = "parquet"
+   PENDING = "pending.jsonl"
+   STATUS = "status.jsonl"
+
+   def __init__(self, config):
+     super().__init__(config)
+     try:
+       import pyarrow, pyarrow.parquet
+     except ImportError:
+       raise Exception("Sink parquet requires pyarrow package")
+     self.pa = pyarrow
+
+   def __file(self, name):
+     return os.path.join(self.path, name)
+
+   def __pending_rows(self):
+     # counted on append, pending file is not scanned on every save
+     try:
+       with open(self.__file(self.PENDING + ".rows")) as f:
+         return int(f.read() or 0)
+     except FileNotFoundError:
+       return 0
+
+   def _write(self, entries):
+     count, rows = 0, 0
+     with open(self.__file(self.PENDING), "a") as records, open(self.__file(self.STATUS), "a") as status:
+       for batch in _batches(entries, self.config["batch"]):
+         for entry in batch:
+           if entry["type"] == "record":
+             records.write(json.dumps(entry["data"], default=str) + "\n")
+             rows += 1
+           else:
+             status.write(json.dumps(entry, default=str) + "\n")
+         count += len(batch)
+
+     rows += self.__pending_rows()
+     with open(self.__file(self.PENDING + ".rows"), "w") as f:
+       f.write(str(rows))
+     if rows >= self.config["max_rows"]:
+       self.__convert()
+     return count
+
+   def flush(self):
+     with self._locked():
+       if os.path.exists(self.__file(self.PENDING)) and os.path.getsize(self.__file(self.PENDING)):
+         self.__convert()
+     return True
+
+   def __records(self):
+     with open(self.__file(self.PENDING)) as f:
+       for line in f:
+         yield json.loads(line)
+
+   def __convert(self):
+     import pyarrow.parquet as pq
+     # schema of the whole file first, columns differ by collector
+     columns = set()
+     for rec in self.__records():
+       columns.update(rec.keys())
+     schema = self.pa.schema([(column, self.pa.string()) for column in sorted(columns)])
+
+     name = self.__file("inventory-{:.6f}.parquet".format(time.time()))
+     writer = pq.ParquetWriter(name + ".tmp", schema, compression = "zstd")
+     rows = 0
+     try:
+       for batch in _batches(self.__records(), self.config["batch"]):
+         writer.write_table(self.pa.table({column: self.pa.array([self.__text(rec.get(column)) for rec in batch], self.pa.string())
+                                           for column in schema.names}, schema = schema))
+         rows += len(batch)
+     finally:
+       writer.close()
+     os.rename(name + ".tmp", name)
+     os.unlink(self.__file(self.PENDING))
+     if os.path.exists(self.__file(self.PENDING + ".rows")):
+       os.unlink(self.__file(self.PENDING + ".rows"))
+     logging.info("sink parquet: {} rows written to {}".format(rows, name))
+     return rows
+
+   def __text(self, value):
+     if value is None or isinstance(value, str):
+       return value
+     if isinstance(value, (dict, list)):
+       return json.dumps(value, default=str)
+     return str(value)
+
+
+class SegmentLogSink(InventorySink):
+   """Append-only log of length-prefixed JSON entries split to segments.
+
+   Segment <base offset>.log holds entries as 4 byte length + JSON,
+   <base offset>.index has (offset, position) of every index_interval-th
+   entry, so reading from an offset seeks instead of scanning the log.
+   """
+   type = "log"
+   LENGTH = struct.Struct(">I")
+   INDEX = struct.Struct(">QQ")
+
+   def segments(self):
+     return sorted(int(name[:-4]) for name in os.listdir(self.path) if name.endswith(".log"))
+
+   def __segment(self, base, ext):
+     return os.path.join(self.path, "{:020d}.{}".format(base, ext))
+
+   def __scan(self, f, offset):
+     # entries from current position as (offset, position, entry)
+     while True:
+       position = f.tell()
+       header = f.read(self.LENGTH.size)
+       if len(header) < self.LENGTH.size:
+         return
+       data = f.read(self.LENGTH.unpack(header)[0])
+       if len(data) < self.LENGTH.unpack(header)[0]:
+         # torn write of crashed writer
+         return
+       yield offset, position, data
+       offset += 1
+
+   def __seek(self, base, offset):
+     # nearest indexed (offset, position) not after offset
+     found = (base, 0)
+     index = self.__segment(base, "index")
+     if os.path.exists(index):
+       size = os.path.getsize(self.__segment(base, "log"))
+       with open(index, "rb") as f:
+         data = f.read()
+       for idx in range(0, len(data) - len(data) % self.INDEX.size, self.INDEX.size):
+         entry = self.INDEX.unpack_from(data, idx)
+         if entry[0] > offset or entry[1] >= size:
+           break
+         found = entry
+     return found
+
+   def __tail(self):
+     # (base, next offset, end position) of last segment
+     segments = self.segments()
+     if not segments:
+       return 0, 0, 0
+     base = segments[-1]
+     offset, position = self.__seek(base, float("inf"))
+     with open(self.__segment(base, "log"), "rb") as f:
+       f.seek(position)
+       for offset, position, data in self.__scan(f, offset):
+         position = f.tell()
+         offset += 1
+     return base, offset, position
+
+   def _write(self, entries):
+     base, offset, position = self.__tail()
+     # drop torn tail of crashed writer and its index entries
+     log = open(self.__segment(base, "log"), "ab")
+     log.truncate(position)
+     log.seek(position)
+     index = open(self.__segment(base, "index"), "a+b")
+     index.seek(0)
+     data = index.read()
+     valid = len(data) - len(data) % self.INDEX.size
+     for idx in range(0, valid, self.INDEX.size):
+       if self.INDEX.unpack_from(data, idx)[0] >= offset:
+         valid = idx
+         break
+     index.truncate(valid)
+     count = 0
+     try:
+       for batch in _batches(entries, self.config["batch"]):
+         buf = io.BytesIO()
+         for entry in batch:
+           if offset % self.config["index_interval"] == 0 or offset == base:
+             index.write(self.INDEX.pack(offset, log.tell() + buf.tell()))
+           data = json.dumps(entry, default=str).encode()
+           buf.write(self.LENGTH.pack(len(data)))
+           buf.write(data)
+           offset += 1
+         log.write(buf.getvalue())
+         log.flush()
+         index.flush()
+         count += len(batch)
+
+         if log.tell() >= self.config["segment_bytes"]:
+           self.__sync(log, index)
+           log.close()
+           index.close()
+           base = offset
+           log = open(self.__segment(base, "log"), "ab")
+           index = open(self.__segment(base, "index"), "ab")
+       self.__sync(log, index)
+     finally:
+       log.close()
+       index.close()
+     return count
+
+   def __sync(self, log, index):
+     if self.config["fsync"]:
+       os.fsync(log.fileno())
+       os.fsync(index.fileno())
+
+   def read(self, offset = 0):
+     """Entries from offset on as (offset, entry)"""
+     segments = self.segments()
+     for idx, base in enumerate(segments):
+       if idx + 1 < len(segments) and segments[idx + 1] <= offset:
+         continue
+       start, position = self.__seek(base, offset)
+       with open(self.__segment(base, "log"), "rb") as f:
+         f.seek(position)
+         for entry_offset, position, data in self.__scan(f, start):
+           if entry_offset >= offset:
+             yield entry_offset, json.loads(data)
+
+
+class SinkBuffer:
+   """Records of streamed collection for sinks.
+
+   Passed to collector instead of storage writer: records are kept in
+   a temporary file (as they were collected, before writer changes them)
+   and handed to the writer. Iterating the buffer yields them again, so
+   sinks get the whole collection once it is committed, as with save().
+   """
+
+   def __init__(self, writer):
+     self.writer = writer
+     self.file = tempfile.TemporaryFile("w+")
+     self.lock = threading.Lock()
+
+   def append(self, records, runtime = None):
+     # records may be a generator, both buffer and writer need them
+     records = [rec for rec in records or [] if rec]
+     with self.lock:
+       for rec in records:
+         self.file.write(json.dumps(rec, default=str) + "\n")
+     return self.writer.append(records, runtime)
+
+   def __iter__(self):
+     with self.lock:
+       self.file.flush()
+       self.file.seek(0)
+       for line in self.file:
+         yield json.loads(line)
+
+   def close(self):
+     self.file.close()
+
+
+SINKS = {
+  "jsonl": JsonlSink,
+  "parquet": ParquetSink,
+  "log": SegmentLogSink,
+}
+
+def get_sinks(config):
+   """Sinks configured in storage: sinks: [{type: jsonl|parquet|log, path: ...}]"""
+   sinks = []
+   for sink in config.get("sinks") or []:
+     if sink.get("type") not in SINKS:
+       raise Exception("Unknown sink type '{}', use one of: {}".format(sink.get("type"), ", ".join(SINKS)))
+     sinks.append(SINKS[sink["type"]]({key: value for key, value in sink.items() if key != "type"}))
+   return sinks
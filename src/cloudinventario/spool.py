@@ -0,0 +1,148 @@
+"""Write-ahead spool of collected data (storage: spool: {path: ...})"""
+import os, json, time, uuid, fcntl, itertools, logging
+
+SPOOL_DEFAULTS = {
+  "path": None,
+  "fsync": True,
+  "chunk_size": 1000,   # records appended to storage at once on replay
+}
+
+SEGMENT_SUFFIX = ".jsonl"
+
+def fsync_dir(path):
+   fd = os.open(path, os.O_RDONLY)
+   try:
+     os.fsync(fd)
+   finally:
+     os.close(fd)
+
+def write_lines(name, items, fsync = True):
+   """Write JSON lines atomically: temporary file, fsync, rename"""
+   with open(name + ".tmp", "w") as f:
+     for item in items:
+       f.write(json.dumps(item, default=str) + "\n")
+     f.flush()
+     if fsync:
+       os.fsync(f.fileno())
+   os.rename(name + ".tmp", name)
+   if fsync:
+     fsync_dir(os.path.dirname(name) or ".")
+   return name
+
+def read_lines(name):
+   with open(name) as f:
+     for line in f:
+       yield json.loads(line)
+
+class InventorySpool:
+   """Append-only spool of collections, drained into InventoryStorage.
+
+   Every store() is one JSON-lines segment: header line (id, runtime,
+   status-only sources) followed by one record per line. Segment is written
+   to a temporary file, fsync'd and renamed, so a complete segment is never
+   partially visible. Replay writes a segment in one storage transaction
+   together with its id in ci_spool, so a segment is applied exactly once
+   even if removing the file fails.
+   """
+
+   def __init__(self, config):
+     if isinstance(config, str):
+       config = {"path": config}
+     self.config = {**SPOOL_DEFAULTS, **config}
+     self.path = self.config["path"]
+     if not self.path:
+       raise Exception("Spool path is not configured")
+     os.makedirs(self.path, exist_ok = True)
+
+   def write(self, inventory, runtime = None):
+     """Spool save() data (list of records or dict with data/errors), returns segment id"""
+     errors = []
+     if type(inventory) is dict:
+       errors = inventory['errors']
+       inventory = inventory['data']
+
+     segment_id = "{:.6f}-{}-{}".format(time.time(), os.getpid(), uuid.uuid4().hex[:8])
+     header = {"id": segment_id, "runtime": runtime, "errors": errors}
+     write_lines(os.path.join(self.path, segment_id + SEGMENT_SUFFIX),
+                 itertools.chain([header], filter(None, inventory or [])), self.config["fsync"])
+
+     logging.debug("spool: segment={} written".format(segment_id))
+     return segment_id
+
+   def segments(self):
+     """Complete segments, oldest first"""
+     return sorted(name[:-len(SEGMENT_SUFFIX)] for name in os.listdir(self.path) if name.endswith(SEGMENT_SUFFIX))
+
+   def __read(self, segment_id):
+     lines = read_lines(os.path.join(self.path, segment_id + SEGMENT_SUFFIX))
+     header = next(lines)
+     chunk = []
+     for rec in lines:
+       chunk.append(rec)
+       if len(chunk) >= self.config["chunk_size"]:
+         yield header, chunk
+         chunk = []
+     yield header, chunk
+
+   def remove(self, segment_id):
+     os.unlink(os.path.join(self.path, segment_id + SEGMENT_SUFFIX))
+     if self.config["fsync"]:
+       fsync_dir(self.path)
+
+   def replay(self, storage):
+     """Write spooled segments into storage, returns number of replayed segments.
+
+     Stops on first failure (storage unavailable), segments stay spooled.
+     Concurrent replayers skip, the one holding the lock drains the spool
+     until no segment is left, including segments written meanwhile.
+     """
+     replayed = 0
+     while True:
+       with open(os.path.join(self.path, ".lock"), "w") as lock:
+         try:
+           fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+         except BlockingIOError:
+           logging.debug("spool: replay already running")
+           break
+         count, failed = self.__replay_segments(storage)
+       replayed += count
+       # checked after releasing lock: writer locked out of replay meanwhile relies on it
+       if failed or not self.segments():
+         break
+     if replayed:
+       logging.info("spool: {} segments replayed".format(replayed))
+     return replayed
+
+   def __replay_segments(self, storage):
+     # (replayed, failed) of segments spooled now
+     replayed = 0
+     for segment_id in self.segments():
+       try:
+         applied = self.__replay_segment(storage, segment_id)
+       except Exception as e:
+         logging.warning("spool: replay of segment={} failed, {} segments left: {}".format(
+                           segment_id, len(self.segments()), e))
+         return replayed, True
+       self.remove(segment_id)
+       if applied:
+         replayed += 1
+     return replayed, False
+
+   def __replay_segment(self, storage, segment_id):
+     storage.connect()
+     try:
+       if storage.spooled(storage.conn, segment_id):
+         logging.info("spool: segment={} already stored".format(segment_id))
+         return False
+
+       with storage.writer() as writer:
+         for header, records in self.__read(segment_id):
+           if header["errors"]:
+             writer.add_status(header["errors"])
+             header["errors"] = None
+           writer.append(records)
+         writer.mark_spooled(segment_id)
+         writer.commit(header["runtime"])
+     finally:
+       storage.disconnect()
+     return True
@@ -1,51 +1,425 @@
-import logging, re
+import logging, re, os, io, time, threading, hashlib, operator
 from pkgutil import iter_modules
 from pprint import pprint
 from datetime import datetime, timedelta
-from sqlalchemy.pool import NullPool
+from contextlib import contextmanager
+from sqlalchemy.pool import NullPool, QueuePool
 import json
 
 import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from cloudinventario.partition import InventoryPartitions
+from cloudinventario.export import InventoryExport, EXPORT_CHUNK_SIZE
+from cloudinventario.codec import Codec, CompressedText, CompressedString, CompressedBinary, CODEC_DEFAULTS
+import cloudinventario.codec as codec
 
 TABLE_PREFIX = "ci_"
 
 STATUS_OK = "OK"
 STATUS_FAIL = "FAIL"
 STATUS_ERROR = "ERROR"
+# version of incremental writer not committed yet, invisible to readers of latest versions
+STATUS_RUNNING = "RUNNING"
+
+# pool defaults (storage: pool: {...}), pool: false -> NullPool
+POOL_DEFAULTS = {
+  "size": 5,
+  "max_overflow": 10,
+  "timeout": 30,
+  "recycle": 3600,
+  "pre_ping": True,
+}
+
+# bulk insert defaults (storage: bulk: {...}), bulk: false -> plain executemany
+BULK_DEFAULTS = {
+  "chunk_size": 1000,
+  "copy": True,
+}
+
+# bind parameters per statement accepted by drivers, multi-row VALUES chunks stay below
+BIND_PARAM_LIMITS = {
+  "sqlite": 999,
+  "postgresql": 32767,
+  "mysql": 65535,
+  "mssql": 2000,
+  "oracle": 65535,
+}
+BIND_PARAM_LIMIT = 999
+
+# columns stored in ci_blob by content hash (storage: dedup: true)
+BLOB_COLUMNS = ["details", "attributes"]
+
+# columns compressed by codec (storage: codec: {...})
+CODEC_COLUMNS = ["details", "attributes", "tags", "networks", "storages", "attachment"]
+
+# lookup/filter columns of InventoryStorage.query()
+QUERY_FILTERS = ["uniqueid", "primary_ip", "name", "inventory_type", "project", "cluster"]
+
+# columns not part of record fingerprint (storage: delta: true)
+FINGERPRINT_EXCLUDE = ["id", "source_id", "source_version", "period", "fingerprint", "version_to",
+                       "details_hash", "attributes_hash"]
+
+# cleanup() deletes expired source versions in batches of this many
+CLEANUP_BATCH = 100
+
+# runtimes() takes median of this many last successful runs of a source
+RUNTIME_HISTORY = 5
+
+# bump on every schema change, add InventoryStorage._migrate_v<N>(conn) if
+# existing databases need more than create_all() (new indexes, columns, ...)
+SCHEMA_VERSION = 9
+
+# process-wide engines, keyed by DSN
+_ENGINES = {}
+_ENGINES_PID = os.getpid()
+_ENGINES_LOCK = threading.Lock()
+
+# process-wide schema definitions and verified DSNs
+_SCHEMAS = {}
+_SCHEMAS_VERIFIED = set()
+
+class PoolStats:
+
+   def __init__(self):
+     self.lock = threading.Lock()
+     self.connects = 0
+     self.checkouts = 0
+     self.checkout_time = 0.0
+     self.checkout_max = 0.0
+
+   def on_connect(self, *args):
+     with self.lock:
+       self.connects += 1
+
+   def add_checkout(self, duration):
+     with self.lock:
+       self.checkouts += 1
+       self.checkout_time += duration
+       self.checkout_max = max(self.checkout_max, duration)
+
+   def as_dict(self):
+     with self.lock:
+       return {
+         "connects": self.connects,
+         "checkouts": self.checkouts,
+         "checkout_avg": self.checkouts and self.checkout_time / self.checkouts or 0.0,
+         "checkout_max": self.checkout_max,
+       }
+
+def _reset_engines():
+   # called in forked child, parent connections must not be closed from here,
+   # pools are dropped without closing (SQLAlchemy "using pools with multiprocessing")
+   global _ENGINES_PID
+   for engine, stats in _ENGINES.values():
+     engine.dispose(close=False)
+   _ENGINES.clear()
+   _ENGINES_PID = os.getpid()
+
+if hasattr(os, "register_at_fork"):
+   os.register_at_fork(after_in_child=_reset_engines)
+
+def _create_engine(dsn, pool):
+   if pool is False:
+     return sa.create_engine(dsn, echo=False, poolclass=NullPool)
+
+   url = sa.engine.url.make_url(dsn)
+   if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+     # in-memory sqlite is bound to single connection, keep default pool
+     return sa.create_engine(dsn, echo=False)
+
+   # pooled sqlite connections are handed between threads (one at a time)
+   connect_args = {"check_same_thread": False} if url.get_backend_name() == "sqlite" else {}
+
+   pool = {**POOL_DEFAULTS, **(pool or {})}
+   return sa.create_engine(dsn, echo=False, poolclass=QueuePool, connect_args=connect_args,
+                           pool_size=pool["size"],
+                           max_overflow=pool["max_overflow"],
+                           pool_timeout=pool["timeout"],
+                           pool_recycle=pool["recycle"],
+                           pool_pre_ping=pool["pre_ping"])
+
+def _sqlite_pragmas(pragmas):
+   def on_connect(dbapi_conn, conn_record):
+     cursor = dbapi_conn.cursor()
+     for name, value in pragmas.items():
+       cursor.execute("PRAGMA {}={}".format(name, value))
+     cursor.close()
+   return on_connect
+
+def get_engine(config):
+   """Return process-wide (engine, stats) for storage config"""
+   dsn = config["dsn"]
+   with _ENGINES_LOCK:
+     if _ENGINES_PID != os.getpid():
+       _reset_engines()
+
+     if dsn not in _ENGINES:
+       engine = _create_engine(dsn, config.get("pool"))
+       stats = PoolStats()
+       sa.event.listen(engine, "connect", stats.on_connect)
+       # opt-in (storage: sqlite_pragmas: {...}), journal_mode=WAL persists in the database file
+       if engine.dialect.name == "sqlite" and config.get("sqlite_pragmas"):
+         sa.event.listen(engine, "connect", _sqlite_pragmas(config["sqlite_pragmas"]))
+       _ENGINES[dsn] = (engine, stats)
+       logging.debug("storage engine created, pool={}".format(engine.pool.__class__.__name__))
+     return _ENGINES[dsn]
+
+def dispose_engines():
+   with _ENGINES_LOCK:
+     for engine, stats in _ENGINES.values():
+       engine.dispose()
+     _ENGINES.clear()
+
+def pool_stats():
+   stats = {}
+   with _ENGINES_LOCK:
+     for dsn, (engine, engine_stats) in _ENGINES.items():
+       url = sa.engine.url.make_url(dsn)
+       stats[repr(url)] = {**engine_stats.as_dict(), "status": engine.pool.status()}
+   return stats
 
 class InventoryStorage:
 
    def __init__(self, config):
      self.config = config
      self.dsn = config["dsn"]
-     self.engine = self.__create()
+     self.engine, self.stats = get_engine(config)
      self.conn = None
      self.version = 0
-
-
+     self.schema = False
+     self.partition = config.get("partition")
+     self.dedup = bool(config.get("dedup"))
+     self.delta = bool(config.get("delta"))
+     if self.delta and self.partition:
+       raise Exception("Delta storage can't be combined with partitioning")
+
+     self.codec_config = config.get("codec")
+     if self.codec_config:
+       if isinstance(self.codec_config, str):
+         self.codec_config = {"type": self.codec_config}
+       self.codec_config = {**CODEC_DEFAULTS, **self.codec_config}
+     self.codec = None
+     self.codec_trained = False
+
+     self.bulk = config.get("bulk", {})
+     if self.bulk is not False:
+       self.bulk = {**BULK_DEFAULTS, **(self.bulk or {})}
 
    def __del__(self):
      if self.conn:
        self.disconnect()
-     self.engine.dispose()
 
-   def __create(self):
-     return sa.create_engine(self.dsn, echo=False, poolclass=NullPool)
+   def __checkout(self):
+     start = time.time()
+     conn = self.engine.connect()
+     self.stats.add_checkout(time.time() - start)
+     return conn
+
+   @contextmanager
+   def begin(self):
+     conn = self.__checkout()
+     try:
+       with conn.begin():
+         yield conn
+     finally:
+       conn.close()
+
+   def pool_stats(self):
+     return {**self.stats.as_dict(), "status": self.engine.pool.status()}
 
    def connect(self):
-     self.conn = self.engine.connect()
+     self.conn = self.__checkout()
      #self.conn.execution_options(autocommit=True)
-     if not self.__check_schema():
-       self.__create_schema()
-     self.__prepare()
+     if not self.schema:
+       self.__define_schema()
+       version = self.__check_schema()
+       if version != SCHEMA_VERSION:
+         self.__create_schema(version)
+       self.__prepare()
+       self.schema = True
      return True
 
    def __check_schema(self):
-     return False
+     if self.dsn in _SCHEMAS_VERIFIED:
+       return SCHEMA_VERSION
+
+     if not self.engine.dialect.has_table(self.conn, self.schema_table.name):
+       return 0
+
+     version = self.conn.execute(sa.select([sa.func.max(self.schema_table.c.version)])).scalar() or 0
+     if version > SCHEMA_VERSION:
+       raise Exception("Storage schema version {} is newer than supported {}".format(version, SCHEMA_VERSION))
+     if version == SCHEMA_VERSION:
+       _SCHEMAS_VERIFIED.add(self.dsn)
+     return version
+
+   def __create_schema(self, version = 0):
+     logging.info("storage schema upgrade from version={} to version={}".format(version, SCHEMA_VERSION))
+     with self.begin() as conn:
+       if self.partitions:
+         self.partitions.create_schema(conn, self.meta.sorted_tables)
+       else:
+         self.meta.create_all(conn, checkfirst = True)
+       self.__migrate(conn, version)
+       self.__create_views(conn)
+
+       conn.execute(self.schema_table.delete())
+       conn.execute(self.schema_table.insert(), {"version": SCHEMA_VERSION})
+     _SCHEMAS_VERIFIED.add(self.dsn)
+     return True
+
+   def __migrate(self, conn, version):
+     # new tables are created by create_all(), migrations upgrade existing
+     # ones and must be idempotent (version 0 = new or unversioned database)
+     for ver in range(version + 1, SCHEMA_VERSION + 1):
+       migration = getattr(self, "_migrate_v{}".format(ver), None)
+       if migration:
+         logging.info("storage schema migration to version={}".format(ver))
+         migration(conn)
+
+   def __create_indexes(self, conn, columns = None):
+     # only indexes over given columns, migration may run before later ones add their columns
+     for table in [self.source_table, self.inventory_current] + list(self.TABLES.values()):
+       if self.partitions and table is self.inventory_table:
+         continue
+       for index in table.indexes:
+         if columns is None or {column.name for column in index.columns} <= set(columns):
+           index.create(conn, checkfirst = True)
+
+   def _migrate_v2(self, conn):
+     # (source_name, source_version) indexes for cleanup
+     self.__create_indexes(conn, ["ts", "source_name", "source_version"])
+
+   def __add_columns(self, conn, table, names):
+     names_tables = [table.name]
+     if self.partitions and table is self.inventory_table:
+       names_tables = self.partitions.physical(conn)
+
+     for name_table in names_tables:
+       columns = [column["name"] for column in sa.inspect(conn).get_columns(name_table)]
+       for name in names:
+         if name not in columns:
+           column_type = table.c[name].type.compile(dialect=conn.dialect)
+           conn.execute(sa.text("ALTER TABLE {} ADD COLUMN {} {}".format(name_table, name, column_type)))
+
+     if self.partitions and table is self.inventory_table:
+       self.partitions.refresh(conn)
+
+   def _migrate_v3(self, conn):
+     # collection period of inventory rows (partition key)
+     self.__add_columns(conn, self.inventory_table, ["period"])
+
+   def _migrate_v4(self, conn):
+     # references to deduplicated ci_blob content
+     for table in self.TABLES.values():
+       self.__add_columns(conn, table, [column + "_hash" for column in BLOB_COLUMNS])
+
+   def _migrate_v5(self, conn):
+     # delta storage: row valid from source_version to version_to
+     for table in self.TABLES.values():
+       self.__add_columns(conn, table, ["fingerprint", "version_to"])
+     self.__create_indexes(conn, ["source_name", "version_to"])
+
+   def _migrate_v7(self, conn):
+     # fill ci_inventory_current from history
+     sources = conn.execute(sa.select([self.source_table.c.source]).distinct()).fetchall()
+     for row in sources:
+       self.update_current(conn, row["source"])
+
+   def _migrate_v8(self, conn):
+     # lookup indexes of query()
+     self.__create_indexes(conn)
+
+   def __create_views(self, conn):
+     # <table>_full: data tables with deduplicated columns resolved from ci_blob
+     for table in list(self.TABLES.values()) + [self.inventory_current]:
+       query = self.__full_select(table).compile(dialect=conn.dialect)
+       conn.execute(sa.text("DROP VIEW IF EXISTS {}_full".format(table.name)))
+       conn.execute(sa.text("CREATE VIEW {}_full AS {}".format(table.name, query)))
+
+   def __full_select(self, table):
+     # deduplicated columns resolved from ci_blob, without storage internals
+     columns = []
+     joins = table
+     for column in table.columns:
+       if column.name in BLOB_COLUMNS:
+         blob = self.blob_table.alias(column.name + "_blob")
+         joins = joins.outerjoin(blob, blob.c.hash == table.c[column.name + "_hash"])
+         columns.append(sa.func.coalesce(column, blob.c.data, type_=column.type).label(column.name))
+       elif not column.name.endswith("_hash") and column.name not in ["fingerprint", "version_to"]:
+         columns.append(column)
+     return sa.select(columns).select_from(joins)
+
+   def __define_schema(self):
+     if self.dsn not in _SCHEMAS:
+       _SCHEMAS[self.dsn] = self.__build_schema()
+
+     schema = _SCHEMAS[self.dsn]
+     self.meta = schema["meta"]
+     self.schema_table = schema["schema"]
+     self.source_table = schema["source"]
+     self.inventory_table = schema["inventory"]
+     self.inventory_current = schema["inventory_current"]
+     self.dns_domain = schema["dns_domain"]
+     self.dns_record = schema["dns_record"]
+     self.usage_cost = schema["usage_cost"]
+     self.blob_table = schema["blob"]
+     self.codec_table = schema["codec"]
+     self.spool_table = schema["spool"]
+
+     self.TABLES = {
+       'inventory':  self.inventory_table,
+       'dns_domain': self.dns_domain,
+       'dns_record': self.dns_record,
+       'usage_cost': self.usage_cost,
+     }
+
+     self.partitions = None
+     if self.partition:
+       self.partitions = InventoryPartitions(self, self.partition)
+     return True
+
+   def period(self):
+     """Collection period of new inventory rows"""
+     if self.partitions:
+       return self.partitions.start().isoformat()
+     return datetime.utcnow().date().isoformat()
+
+   def write_table(self, conn, table):
+     # partitioned inventory is written to partition of current period
+     if table == 'inventory' and self.partitions:
+       return self.partitions.ensure(conn)
+     return self.TABLES[table]
 
-   def __create_schema(self):
+   def __build_schema(self):
      meta = sa.MetaData()
-     self.source_table = sa.Table(TABLE_PREFIX + 'source', meta,
+     schema = {"meta": meta}
+
+     schema["schema"] = sa.Table(TABLE_PREFIX + 'schema', meta,
+       sa.Column('version', sa.Integer, nullable=False),
+       sa.Column('ts', sa.String, default=sa.func.now()),
+     )
+
+     schema["blob"] = sa.Table(TABLE_PREFIX + 'blob', meta,
+       sa.Column('hash', sa.String, primary_key=True),
+       sa.Column('data', CompressedText),
+     )
+
+     # replayed spool segments (cloudinventario.spool)
+     schema["spool"] = sa.Table(TABLE_PREFIX + 'spool', meta,
+       sa.Column('id', sa.String, primary_key=True),
+       sa.Column('ts', sa.String, default=sa.func.now()),
+     )
+
+     schema["codec"] = sa.Table(TABLE_PREFIX + 'codec', meta,
+       sa.Column('id', sa.String, primary_key=True),
+       sa.Column('ts', sa.String, default=sa.func.now()),
+       sa.Column('codec', sa.String, nullable=False),
+       sa.Column('data', sa.LargeBinary, nullable=False),
+     )
+
+     schema["source"] = sa.Table(TABLE_PREFIX + 'source', meta,
        sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
 
        sa.Column('ts', sa.String, default=sa.func.now()),
@@ -57,11 +431,18 @@ class InventoryStorage:
        sa.Column('status', sa.String),
        sa.Column('error', sa.Text),
 
-       sa.UniqueConstraint('source', 'version')
+       sa.UniqueConstraint('source', 'version'),
+       sa.Index(TABLE_PREFIX + 'source_ts_idx', 'ts')
      )
 
-     self.inventory_table = sa.Table(TABLE_PREFIX + 'inventory', meta,
+     # native partitions need partition key in primary and unique keys
+     native = self.partition and self.engine.dialect.name == "postgresql"
+     partition_args = {"postgresql_partition_by": "RANGE (period)"} if native else {}
+     partition_keys = ['period'] if native else []
+
+     schema["inventory"] = sa.Table(TABLE_PREFIX + 'inventory', meta,
        sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+       sa.Column('period', sa.String, primary_key=bool(native)),
        sa.Column('source_id', sa.Integer, nullable=True),
        sa.Column('source_name', sa.String, nullable=False),
        sa.Column('source_version', sa.Integer, nullable=False),
@@ -89,21 +470,42 @@ class InventoryStorage:
        sa.Column('status', sa.String),
        sa.Column('is_on', sa.Integer),
 
-       sa.Column('networks', sa.String),
-       sa.Column('storages', sa.String),
+       sa.Column('networks', CompressedString),
+       sa.Column('storages', CompressedString),
 
        sa.Column('owner', sa.String),
-       sa.Column('tags', sa.Text),
+       sa.Column('tags', CompressedText),
 
        sa.Column('description', sa.String),
 
-       sa.Column('attributes', sa.Text),
-       sa.Column('details', sa.Text),
+       sa.Column('attributes', CompressedText),
+       sa.Column('details', CompressedText),
+       sa.Column('attributes_hash', sa.String),
+       sa.Column('details_hash', sa.String),
+       sa.Column('fingerprint', sa.String),
+       sa.Column('version_to', sa.Integer),
+
+       sa.UniqueConstraint('source_version', 'source_name', 'inventory_type', 'name', "cluster", 'project', 'uniqueid', *partition_keys),
+       sa.Index(TABLE_PREFIX + 'inventory_source_idx', 'source_name', 'source_version'),
+       sa.Index(TABLE_PREFIX + 'inventory_delta_idx', 'source_name', 'version_to'),
+       sa.Index(TABLE_PREFIX + 'inventory_uniqueid_idx', 'uniqueid'),
+       sa.Index(TABLE_PREFIX + 'inventory_ip_idx', 'primary_ip'),
+       sa.Index(TABLE_PREFIX + 'inventory_name_idx', 'name'),
+       **partition_args
+     )
 
-       sa.UniqueConstraint('source_version', 'source_name', 'inventory_type', 'name', "cluster", 'project', 'uniqueid')
+     # rows of latest version of every source, maintained by InventoryWriter.commit()
+     schema["inventory_current"] = sa.Table(TABLE_PREFIX + 'inventory_current', meta,
+       *[sa.Column(column.name, column.type, primary_key=(column.name == 'id'), autoincrement=False)
+           for column in schema["inventory"].columns],
+       sa.Index(TABLE_PREFIX + 'inventory_current_source_idx', 'source_name'),
+       sa.Index(TABLE_PREFIX + 'inventory_current_uniqueid_idx', 'uniqueid'),
+       sa.Index(TABLE_PREFIX + 'inventory_current_ip_idx', 'primary_ip'),
+       sa.Index(TABLE_PREFIX + 'inventory_current_name_idx', 'name'),
+       sa.Index(TABLE_PREFIX + 'inventory_current_type_idx', 'inventory_type', 'project', 'cluster'),
      )
 
-     self.dns_domain = sa.Table(TABLE_PREFIX + 'dns_domain', meta,
+     schema["dns_domain"] = sa.Table(TABLE_PREFIX + 'dns_domain', meta,
        sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
 
        sa.Column('source_id', sa.Integer, nullable=True),
@@ -122,17 +524,23 @@ class InventoryStorage:
        sa.Column('ttl', sa.String),
 
        sa.Column('owner', sa.String),
-       sa.Column('tags', sa.Text),
+       sa.Column('tags', CompressedText),
 
        sa.Column('description', sa.String),
 
-       sa.Column('attributes', sa.Text),
-       sa.Column('details', sa.Text),
+       sa.Column('attributes', CompressedText),
+       sa.Column('details', CompressedText),
+       sa.Column('attributes_hash', sa.String),
+       sa.Column('details_hash', sa.String),
+       sa.Column('fingerprint', sa.String),
+       sa.Column('version_to', sa.Integer),
 
        #sa.UniqueConstraint('source_version', 'source_name', 'inventory_type', 'name', 'uniqueid')  # TODO !
+       sa.Index(TABLE_PREFIX + 'dns_domain_source_idx', 'source_name', 'source_version'),
+       sa.Index(TABLE_PREFIX + 'dns_domain_delta_idx', 'source_name', 'version_to')
      )
 
-     self.dns_record = sa.Table(TABLE_PREFIX + 'dns_record', meta,
+     schema["dns_record"] = sa.Table(TABLE_PREFIX + 'dns_record', meta,
        sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
 
        sa.Column('source_id', sa.Integer, nullable=False),
@@ -155,17 +563,23 @@ class InventoryStorage:
        sa.Column('data', sa.Text),
 
        sa.Column('owner', sa.String),
-       sa.Column('tags', sa.Text),
+       sa.Column('tags', CompressedText),
 
        sa.Column('description', sa.String),
 
-       sa.Column('attributes', sa.Text),
-       sa.Column('details', sa.Text),
+       sa.Column('attributes', CompressedText),
+       sa.Column('details', CompressedText),
+       sa.Column('attributes_hash', sa.String),
+       sa.Column('details_hash', sa.String),
+       sa.Column('fingerprint', sa.String),
+       sa.Column('version_to', sa.Integer),
 
        #sa.UniqueConstraint('source_version', 'source_name', 'inventory_type', 'name', 'uniqueid') # TODO !
+       sa.Index(TABLE_PREFIX + 'dns_record_source_idx', 'source_name', 'source_version'),
+       sa.Index(TABLE_PREFIX + 'dns_record_delta_idx', 'source_name', 'version_to')
      )
 
-     self.usage_cost = sa.Table(TABLE_PREFIX + 'usage_cost', meta,
+     schema["usage_cost"] = sa.Table(TABLE_PREFIX + 'usage_cost', meta,
        sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
 
        sa.Column('source_id', sa.Integer, nullable=False),
@@ -182,168 +596,768 @@ class InventoryStorage:
        sa.Column('cost', sa.Float),
        sa.Column('unit', sa.String),
 
-       sa.Column('attributes', sa.Text),
-       sa.Column('details', sa.Text),
-       sa.Column('attachment', sa.LargeBinary),
-     )
+       sa.Column('attributes', CompressedText),
+       sa.Column('details', CompressedText),
+       sa.Column('attributes_hash', sa.String),
+       sa.Column('details_hash', sa.String),
+       sa.Column('fingerprint', sa.String),
+       sa.Column('version_to', sa.Integer),
+       sa.Column('attachment', CompressedBinary),
 
-     meta.create_all(self.engine, checkfirst = True)
+       sa.Index(TABLE_PREFIX + 'usage_cost_source_idx', 'source_name', 'source_version'),
+       sa.Index(TABLE_PREFIX + 'usage_cost_delta_idx', 'source_name', 'version_to')
+     )
 
-     self.TABLES = {
-       'inventory':  self.inventory_table,
-       'dns_domain': self.dns_domain,
-       'dns_record': self.dns_record,
-       'usage_cost': self.usage_cost,
-     }
-     return True
+     return schema
 
    def __prepare(self):
-     pass
-
-   def __get_sources_version_max(self):
-     # get active version
-     res = self.conn.execute(sa.select([
+     codec.register_loader(self.dsn, self.load_dictionaries)
+     self.load_dictionaries(self.conn)
+
+   def load_dictionaries(self, conn = None):
+     if conn is None:
+       with self.begin() as conn:
+         return self.load_dictionaries(conn)
+
+     res = conn.execute(sa.select([self.codec_table.c.id, self.codec_table.c.codec, self.codec_table.c.data])
+                          .order_by(self.codec_table.c.ts))
+     dictionaries = {}
+     for row in res.fetchall():
+       codec.add_dictionary(bytes(row["data"]))
+       dictionaries[row["codec"]] = row["id"]
+     return dictionaries
+
+   def get_codec(self, conn, samples = None):
+     """Codec for new values, trains dictionary on samples if there is none yet"""
+     if not self.codec_config:
+       return None
+     if self.codec is not None:
+       return self.codec
+
+     name = self.codec_config["type"]
+     dictionary = None
+     if self.codec_config["dictionary"]:
+       dictionary = self.load_dictionaries(conn).get(name)
+       if dictionary is None and samples:
+         data = Codec.train(name, samples[:self.codec_config["dict_samples"]], self.codec_config["dict_size"])
+         if data:
+           dictionary = codec.add_dictionary(data)
+           conn.execute(self.codec_table.insert(), {"id": dictionary, "codec": name, "data": data})
+           # not usable by others until writer commits
+           self.codec_trained = True
+           logging.info("codec {} dictionary={} trained on {} samples".format(name, dictionary, len(samples)))
+
+     self.codec = Codec(name, self.codec_config["level"], dictionary)
+     return self.codec
+
+   def encode(self, rec):
+     for column in CODEC_COLUMNS:
+       if rec.get(column) is not None:
+         rec[column] = self.codec.encode(rec[column])
+     return rec
+
+   def __get_sources_version_max(self, conn, names):
+     # get active version of given sources only (ci_source unique index on source, version)
+     names = list(set(names))
+     if not names:
+       return {}
+
+     res = conn.execute(sa.select([
                    self.source_table.c.source,
                    sa.func.max(self.source_table.c.version).label("version")
                    ])
+                    .where(self.source_table.c.source.in_(names))
      	              .group_by(self.source_table.c.source)
                     )
-     res = res.fetchall()
-     if res and res[0]['version']:
-       sources = [dict(row) for row in res]
+     return {row["source"]: row["version"] or 0 for row in res.fetchall()}
+
+   def allocate_source(self, conn, source):
+     """Insert ci_source row with next free version, returns (id, version)"""
+     # concurrent writer allocating the same version fails on unique
+     # (source, version), re-read max version and retry
+     name = source["source"]
+     retries = self.config.get("retries", 3)
+     for attempt in range(retries + 1):
+       source["version"] = self.__get_sources_version_max(conn, [name]).get(name, 0) + 1
+       try:
+         if conn.dialect.name == "sqlite":
+           # failed statement does not abort sqlite transaction
+           result = conn.execute(self.source_table.insert(), source)
+         else:
+           with conn.begin_nested():
+             result = conn.execute(self.source_table.insert(), source)
+         return result.inserted_primary_key[0], source["version"]
+       except sa.exc.IntegrityError:
+         if attempt >= retries:
+           raise
+         logging.warning("source version conflict, source={}, retrying attempt={}".format(name, attempt + 1))
+         time.sleep(0.1 * (attempt + 1))
+
+   def spooled(self, conn, segment_id):
+     return conn.execute(sa.select([self.spool_table.c.id])
+                           .where(self.spool_table.c.id == segment_id)).fetchone() is not None
+
+   def writer(self, incremental = False):
+     """Open streaming writer, see InventoryWriter"""
+     return InventoryWriter(self, self.__checkout(), incremental)
+
+   def discard_versions(self, conn, source, status = STATUS_RUNNING, error = None):
+     """Delete rows of source versions in status, mark the versions ERROR (or delete them if error is None)"""
+     versions = [row["version"] for row in conn.execute(sa.select([self.source_table.c.version])
+                   .where((self.source_table.c.source == source) & (self.source_table.c.status == status)))]
+     if not versions:
+       return 0
+     for table in self.TABLES.values():
+       conn.execute(table.delete().where((table.c.source_name == source) & table.c.source_version.in_(versions)))
+     where = (self.source_table.c.source == source) & self.source_table.c.version.in_(versions)
+     if error is None:
+       conn.execute(self.source_table.delete().where(where))
      else:
-       sources = []
-    #  res = self.conn.execute(sa.select(
-    #                self.source_table.c.source,
-    #                sa.func.max(self.source_table.c.version).label("version")
-    #                )
-    #  	              .group_by(self.source_table.c.source)
-    #                 )
-    #  res = res.fetchall()
-    #  if res and res[0][1]:
-    #    sources = [{"source": row[0], "version": row[1]} for row in res]
-    #  else:
-    #    sources = []
-     return sources
-
-   def __get_source_version_max(self, name):
-     sources = self.__get_sources_version_max()
-     for source in sources:
-       if name == source["source"]:
-         return source["version"]
-     return 0
+       conn.execute(self.source_table.update().where(where).values(status = STATUS_ERROR, entries = 0, error = error))
+     return len(versions)
 
    def log_status(self, source, status, runtime = None, error = None):
-     version = self.__get_source_version_max(source)
-
      data = {
-       "source_id": -1,
        "source": source,
-       "version": version + 1,
        "status": status,
        "runtime": runtime,
        "error": error
      }
 
-     with self.engine.begin() as conn:
-       conn.execute(self.source_table.insert(), data)
+     with self.writer() as writer:
+       writer.add_status([data])
      return True
 
    def save(self, data, runtime = None):
      if data is None:
        return False
 
-     # define array of sources_save to save 
-     sources_save = []
+     # define array of errors to save
+     errors = []
      if type(data) is dict:
-      for error in data['errors']:
-        error['version'] = self.__get_source_version_max(error['source']) + 1
-      sources_save += data['errors']
+      errors = data['errors']
       data = data['data']
 
-     sources = self.__get_sources_version_max()
-
-     # increment versions
-     versions = {}
-     for source in sources:
-       source["version"] += 1
-       versions[source["source"]] = source["version"]
-
-     # collect data sources versions
-     source_entries = {}
-     for rec in data:
-       if rec["source_name"] not in versions.keys():
-         versions[rec["source_name"]] = 1
-         sources.append({ "source": rec["source_name"],
-                          "version": versions[rec["source_name"]] })
-       rec["source_version"] = versions.get(rec["source_name"], 1)
-       source_entries.setdefault(rec["source_name"], 0)
-       source_entries[rec["source_name"]] += 1
-
-     # save entry counts
-     for source in sources:
-       if not source["source"] in source_entries:
-         continue
-       source["entries"] = source_entries[source["source"]]
-       source["status"] = STATUS_OK
-       source["runtime"] = runtime
-       sources_save.append(source)
+     if len(data) == 0 and len(errors) == 0:
+       return False
 
-     # known tables
-     data_to_insert = dict()
-     for table in self.TABLES.keys():
-       data_to_insert[table] = []
+     # store data
+     with self.writer() as writer:
+       writer.add_status(errors)
+       writer.append(data)
+       writer.commit(runtime)
+     return True
 
-     for item in data:
-         table = item.pop('__table', 'inventory') or 'inventory'
+   def fingerprint(self, table, rec):
+     """uniqueid + hash of all stored fields of record"""
+     columns = [column.name for column in table.columns if column.name not in FINGERPRINT_EXCLUDE]
+     digest = hashlib.sha256(json.dumps([rec.get(column) for column in columns], default=str).encode()).hexdigest()
+     return "{}:{}".format(rec.get("uniqueid") or "", digest)
+
+   def open_rows(self, conn, table, source):
+     """Delta rows valid in latest version of source as {fingerprint: [id]}"""
+     res = conn.execute(sa.select([table.c.id, table.c.fingerprint])
+                          .where((table.c.source_name == source) &
+                                 (table.c.version_to.is_(None)) &
+                                 (table.c.fingerprint.isnot(None))))
+     rows = {}
+     for row in res.fetchall():
+       rows.setdefault(row["fingerprint"], []).append(row["id"])
+     return rows
+
+   def close_rows(self, conn, table, ids, version):
+     """Mark delta rows as valid up to version"""
+     for start in range(0, len(ids), 500):
+       conn.execute(table.update().where(table.c.id.in_(ids[start:start + 500])).values(version_to = version))
+     return len(ids)
+
+   def close_source(self, conn, source, version):
+     # full snapshot follows, delta rows must not leak into next versions
+     for table in self.TABLES.values():
+       conn.execute(table.update()
+                      .where((table.c.source_name == source) &
+                             (table.c.version_to.is_(None)) &
+                             (table.c.fingerprint.isnot(None)))
+                      .values(version_to = version))
+
+   def latest_version(self, conn, source):
+     return conn.execute(sa.select([sa.func.max(self.source_table.c.version)])
+                           .where((self.source_table.c.source == source) &
+                                  (self.source_table.c.status == STATUS_OK))).scalar()
+
+   def select_version(self, source, version = None, table = 'inventory'):
+     """Select of all rows of source version (latest if None) for full and delta storage"""
+     table = self.TABLES[table]
+     if version is None:
+       version = self.latest_version(self.conn, source) or 0
+     return sa.select([table]).where(self.__version_clause(table, source, version))
+
+   def __version_clause(self, table, source, version):
+     # full rows belong to one version, delta rows to range of versions
+     return (table.c.source_name == source) & (
+               (table.c.source_version == version) |
+               ((table.c.fingerprint.isnot(None)) &
+                (table.c.source_version < version) &
+                ((table.c.version_to.is_(None)) | (table.c.version_to >= version))))
+
+   def get_source(self, source, version = None):
+     """ci_source row of source version (latest successful if None) as dict"""
+     where = self.source_table.c.source == source
+     if version is None:
+       where &= self.source_table.c.status == STATUS_OK
+     else:
+       where &= self.source_table.c.version == version
+     row = self.conn.execute(sa.select([self.source_table]).where(where)
+                               .order_by(self.source_table.c.version.desc()).limit(1)).fetchone()
+     return dict(row) if row else None
+
+   def latest_versions(self, conn = None):
+     """Latest successful version of every source as {source: version}"""
+     res = (conn or self.conn).execute(sa.select([
+                   self.source_table.c.source,
+                   sa.func.max(self.source_table.c.version).label("version")])
+                 .where(self.source_table.c.status == STATUS_OK)
+                 .group_by(self.source_table.c.source))
+     return {row["source"]: row["version"] for row in res.fetchall()}
+
+   def runtimes(self, sources = None, history = RUNTIME_HISTORY, days = 30, conn = None):
+     """Expected runtime of sources as {source: seconds}, median of last successful runs within days"""
+     since = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+     where = (self.source_table.c.status == STATUS_OK) & (self.source_table.c.ts >= since) & \
+             self.source_table.c.runtime.isnot(None)
+     if sources is not None:
+       where &= self.source_table.c.source.in_(list(sources))
+     res = (conn or self.conn).execute(sa.select([self.source_table.c.source, self.source_table.c.runtime])
+                 .where(where)
+                 .order_by(self.source_table.c.source, self.source_table.c.version.desc()))
+
+     runs = {}
+     for row in res:
+       if len(runs.setdefault(row["source"], [])) < history:
+         runs[row["source"]].append(row["runtime"])
+     return {source: sorted(values)[len(values) // 2] for source, values in runs.items()}
+
+   def query(self, table = 'inventory', source = None, version = None, limit = None, after = None, **filters):
+     """Stream rows of latest (or given) source version as dicts.
+
+     Latest inventory is read from ci_inventory_current, anything else from
+     history. Filters (QUERY_FILTERS) take a value or list of values, rows are
+     ordered by id, continue paging with after=<id of last row>.
+     """
+     if version is not None and source is None:
+       raise Exception("Query of version requires source")
+
+     if table == 'inventory' and version is None:
+       table = self.inventory_current
+       where = sa.true() if source is None else table.c.source_name == source
+     else:
+       table = self.TABLES[table]
+       if source is None:
+         versions = self.latest_versions()
+       elif version is None:
+         versions = {source: self.latest_version(self.conn, source) or 0}
+       else:
+         versions = {source: version}
+       where = sa.or_(sa.false(), *[self.__version_clause(table, name, ver) for name, ver in versions.items()])
+
+     for name, value in filters.items():
+       if name not in QUERY_FILTERS or name not in table.c:
+         raise Exception("Unknown query filter '{}' of table {}".format(name, table.name))
+       if isinstance(value, (list, tuple, set)):
+         where &= table.c[name].in_(list(value))
+       else:
+         where &= table.c[name] == value
+     if after is not None:
+       where &= table.c.id > after
+
+     # same columns as <table>_full views
+     query = self.__full_select(table).where(where).order_by(table.c.id)
+     if limit is not None:
+       query = query.limit(limit)
+
+     # server side cursor where supported, rows are fetched in chunks
+     res = self.conn.execution_options(stream_results=True).execute(query)
+     try:
+       while True:
+         rows = res.fetchmany(self.config.get("query_chunk_size", 1000))
+         if not rows:
+           break
+         for row in rows:
+           yield dict(row)
+     finally:
+       res.close()
+
+   def update_current(self, conn, source, version = None):
+     """Replace ci_inventory_current rows of source by its version (latest if None)"""
+     latest = self.latest_version(conn, source)
+     if version is None:
+       version = latest
+     elif latest is not None and version < latest:
+       # newer version committed meanwhile by concurrent writer
+       return False
 
-         data_to_insert[table].append(item)
+     current = self.inventory_current
+     conn.execute(current.delete().where(current.c.source_name == source))
+     if version is None:
+       return True
 
-     if len(sources_save) == 0:
-       return False
-     # store data
+     columns = [column.name for column in current.columns]
+     query = self.select_version(source, version).with_only_columns([self.inventory_table.c[name] for name in columns])
+     conn.execute(current.insert().from_select(columns, query))
+     return True
+
+   def query_columns(self, table = 'inventory'):
+     """Columns of rows returned by query() as {name: SQLAlchemy type}"""
+     return {column.name: column.type for column in self.__full_select(self.TABLES[table]).selected_columns}
+
+   def export(self, path, format = "parquet", source = None, version = None, table = 'inventory',
+              chunk_size = EXPORT_CHUNK_SIZE):
+     """Write source version (latest of all sources if None) as Parquet or Arrow IPC file"""
+     return InventoryExport(self, path, format, chunk_size).write(source, version, table)
+
+   def store_blobs(self, conn, blobs):
+     """Store {hash: content} not stored yet, returns hashes of new blobs"""
+     hashes = list(blobs.keys())
+     existing = set()
+     for start in range(0, len(hashes), 500):
+       res = conn.execute(sa.select([self.blob_table.c.hash])
+                            .where(self.blob_table.c.hash.in_(hashes[start:start + 500])))
+       existing.update(row[0] for row in res.fetchall())
+
+     new = [digest for digest in hashes if digest not in existing]
+     if not new:
+       return set()
+
+     # concurrent writer may store the same content meanwhile
+     if conn.dialect.name == "postgresql":
+       insert = postgresql.insert(self.blob_table).on_conflict_do_nothing()
+     elif conn.dialect.name == "sqlite":
+       insert = self.blob_table.insert().prefix_with("OR IGNORE")
+     elif conn.dialect.name == "mysql":
+       insert = self.blob_table.insert().prefix_with("IGNORE")
+     else:
+       insert = self.blob_table.insert()
+     if self.codec:
+       conn.execute(insert, [{"hash": digest, "data": self.codec.encode(blobs[digest])} for digest in new])
+     else:
+       conn.execute(insert, [{"hash": digest, "data": blobs[digest]} for digest in new])
+     return set(new)
+
+   def bulk_insert(self, conn, table, rows):
+     if self.bulk is False:
+       conn.execute(table.insert(), rows)
+       return len(rows)
+
+     columns = [col.name for col in table.columns if col.name != "id"]
+     if conn.dialect.name == "postgresql" and conn.dialect.driver == "psycopg2" and self.bulk["copy"]:
+       return self.__copy_insert(conn, table, columns, rows)
+     if conn.dialect.name == "sqlite" and not any(table.c[col].type.bind_processor(conn.dialect) for col in columns):
+       return self.__dbapi_insert(conn, table, columns, rows)
+
+     # every value of multi-row VALUES is a bind parameter
+     limit = BIND_PARAM_LIMITS.get(conn.dialect.name, BIND_PARAM_LIMIT)
+     chunk_size = max(1, min(self.bulk["chunk_size"], limit // len(columns)))
+     keys = set(columns)
+     for start in range(0, len(rows), chunk_size):
+       chunk = rows[start:start + chunk_size]
+       # rows may carry extra keys (not table columns) or miss some, normalize
+       if any(row.keys() != keys for row in chunk):
+         chunk = [{col: row.get(col) for col in columns} for row in chunk]
+       if conn.dialect.name == "sqlite":
+         # column types with bind processing, let SQLAlchemy executemany handle them
+         conn.execute(table.insert(), chunk)
+       else:
+         conn.execute(table.insert().values(chunk))
+     return len(rows)
+
+   def __dbapi_insert(self, conn, table, columns, rows):
+     # sqlite executemany of plain tuples, SQLAlchemy per-row parameter processing
+     # is skipped (only used if no column type processes bound values)
+     compiled = table.insert().values({col: sa.bindparam(col) for col in columns}).compile(dialect=conn.dialect)
+     sql, names = str(compiled), compiled.positiontup
+     values = operator.itemgetter(*names)
+
+     chunk_size = self.bulk["chunk_size"]
+     cursor = conn.connection.cursor()
+     try:
+       for start in range(0, len(rows), chunk_size):
+         chunk = rows[start:start + chunk_size]
+         try:
+           params = list(map(values, chunk))
+         except KeyError:
+           # rows missing some columns
+           params = [tuple(row.get(col) for col in names) for row in chunk]
+         cursor.executemany(sql, params)
+     finally:
+       cursor.close()
+     return len(rows)
+
+   @staticmethod
+   def __copy_value(value):
+     # PostgreSQL COPY text format
+     if value is None:
+       return "\\N"
+     if isinstance(value, (bytes, bytearray, memoryview)):
+       return "\\\\x" + bytes(value).hex()
+     return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+   def __copy_insert(self, conn, table, columns, rows):
+     sql = "COPY {} ({}) FROM STDIN".format(
+             conn.dialect.identifier_preparer.format_table(table),
+             ", ".join(conn.dialect.identifier_preparer.quote(col) for col in columns))
+
+     chunk_size = self.bulk["chunk_size"]
+     cursor = conn.connection.cursor()
+     try:
+       for start in range(0, len(rows), chunk_size):
+         buf = io.StringIO()
+         for row in rows[start:start + chunk_size]:
+           buf.write("\t".join(self.__copy_value(row.get(col)) for col in columns))
+           buf.write("\n")
+         buf.seek(0)
+         cursor.copy_expert(sql, buf)
+     finally:
+       cursor.close()
+     return len(rows)
 
-     with self.engine.begin() as conn:
-      sources = dict()
+   def cleanup(self, days):
+     # ts is stored as text by the database (UTC on sqlite), compare as text
+     expired = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+     batch = self.config.get("cleanup_batch", CLEANUP_BATCH)
+
+     total = self.conn.execute(sa.select([sa.func.count()])
+                 .where(self.source_table.c.ts <= expired)).scalar()
+     logging.info("prune: {} source versions older than {}".format(total, expired))
+
+     # partitioned inventory is pruned by whole partitions only
+     tables = list(self.TABLES.values())
+     if self.partitions:
+       with self.begin() as conn:
+         self.partitions.drop(conn, datetime.strptime(expired, "%Y-%m-%d %H:%M:%S").date())
+       tables.remove(self.inventory_table)
+
+     pruned, rows = 0, 0
+     while True:
+       res = self.conn.execute(sa.select([
+                     self.source_table.c.id,
+                     self.source_table.c.source,
+                     self.source_table.c.version])
+                   .where(self.source_table.c.ts <= expired)
+                   .order_by(self.source_table.c.id)
+                   .limit(batch)).fetchall()
+       if not res:
+         break
+
+       ids = [row["id"] for row in res]
+       versions = [(row["source"], row["version"]) for row in res]
+
+       # one transaction per batch, keeps locks short
+       with self.begin() as conn:
+         for table in tables:
+           # full rows of expired versions, delta rows closed in expired versions
+           result = conn.execute(table.delete().where(
+                 sa.tuple_(table.c.source_name, table.c.source_version).in_(versions) &
+                 table.c.fingerprint.is_(None)))
+           rows += max(result.rowcount, 0)
+           result = conn.execute(table.delete().where(
+                 sa.tuple_(table.c.source_name, table.c.version_to).in_(versions)))
+           rows += max(result.rowcount, 0)
+         conn.execute(self.source_table.delete().where(self.source_table.c.id.in_(ids)))
+
+       pruned += len(ids)
+       logging.info("prune: {}/{} source versions, {} rows deleted".format(pruned, total, rows))
+
+     with self.begin() as conn:
+       conn.execute(self.spool_table.delete().where(self.spool_table.c.ts <= expired))
+
+     if pruned > 0:
+       # sources with no version left, their open delta rows are not referenced by any version
+       with self.begin() as conn:
+         remaining = sa.select([self.source_table.c.source])
+         for table in tables:
+           result = conn.execute(table.delete().where(table.c.fingerprint.isnot(None) &
+                                                      table.c.source_name.notin_(remaining)))
+           rows += max(result.rowcount, 0)
+         current = self.inventory_current
+         conn.execute(current.delete().where(current.c.source_name.notin_(remaining)))
+
+     blobs = 0
+     if self.dedup and pruned > 0:
+       blobs = self.__prune_blobs()
+     return {"versions": pruned, "rows": rows, "blobs": blobs}
+
+   def __prune_blobs(self):
+     refs = []
+     for table in list(self.TABLES.values()) + [self.inventory_current]:
+       for column in BLOB_COLUMNS:
+         column = table.c[column + "_hash"]
+         refs.append(sa.select([column]).where(column.isnot(None)))
+
+     with self.begin() as conn:
+       result = conn.execute(self.blob_table.delete().where(self.blob_table.c.hash.notin_(sa.union(*refs))))
+     logging.info("prune: {} unreferenced blobs deleted".format(max(result.rowcount, 0)))
+     return max(result.rowcount, 0)
 
-      for source_save in sources_save:
-        result = conn.execute(self.source_table.insert(), [source_save])
+   def disconnect(self):
+     # return connection to the pool
+     self.conn.close()
+     self.conn = None
+     return True
 
-        for index, source in enumerate([source_save]):
-          sources[source['source'] + '|' + str(source['version'])] = result.inserted_primary_key[index]
 
-      for table in data_to_insert.keys():
-        if len(data_to_insert[table]) > 0:
-          for item in data_to_insert[table]:
-            item['source_id'] = sources[item['source_name'] + "|" + str(item['source_version'])]
+class InventoryWriter:
+   """Streaming writer of one collection run.
+
+   Records can be appended in chunks as they are produced, every source
+   gets its version on first record. Everything is written in a single
+   transaction, so the versions appear (commit) or vanish (abort) atomically.
+
+   Incremental writer (collector streaming for its whole run) commits every
+   append on its own instead, so no write transaction (SQLite database lock)
+   is held while collecting. Its versions are RUNNING (invisible to latest
+   version readers) until commit() closes previous rows and flips them to
+   OK in one transaction, abort() deletes them. Versions left RUNNING by a
+   killed writer are discarded by the next run of the source, so one
+   source must not be streamed by two writers at once.
+   """
+
+   def __init__(self, storage, conn, incremental = False):
+     self.storage = storage
+     self.conn = conn
+     self.incremental = incremental
+     self.trans = None if incremental else conn.begin()
+     self.status_ids = []
+     self.period = storage.period()
+     self.lock = threading.Lock()
+     self.sources = {}
+     self.entries = 0
+     self.blobs = set()
+     self.previous = {}
+
+   def __enter__(self):
+     return self
+
+   def __exit__(self, exc_type, exc_value, tb):
+     if exc_type is None:
+       self.commit()
+     else:
+       self.abort()
+     return False
 
-          conn.execute(self.TABLES[table].insert(), data_to_insert[table])
+   @contextmanager
+   def __transaction(self):
+     # incremental writer commits every write on its own, otherwise all is in self.trans
+     if not self.incremental:
+       yield
+       return
+     with self.conn.begin():
+       yield
+     self.storage.codec_trained = False
+
+   def __source(self, name):
+     if name not in self.sources:
+       if self.incremental:
+         discarded = self.storage.discard_versions(self.conn, name, error = "writer interrupted")
+         if discarded:
+           logging.warning("discarded {} interrupted versions of source={}".format(discarded, name))
+       source_id, version = self.storage.allocate_source(self.conn, {
+         "source": name,
+         "entries": 0,
+         "status": STATUS_RUNNING if self.incremental else STATUS_OK
+       })
+       self.sources[name] = {"id": source_id, "version": version, "entries": 0,
+                             "blobs": 0, "blobs_new": 0, "blob_bytes": 0, "blob_bytes_new": 0,
+                             "added": 0, "unchanged": 0, "closed": 0}
+
+       if self.storage.delta:
+         self.previous[name] = {}
+         for table, table_obj in self.storage.TABLES.items():
+           self.previous[name][table] = self.storage.open_rows(self.conn, table_obj, name)
+       elif not self.storage.partitions and not self.incremental:
+         self.storage.close_source(self.conn, name, version - 1)
+     return self.sources[name]
+
+   def add_status(self, sources):
+     # status only sources (errors of sub-accounts, failed collections)
+     with self.lock, self.__transaction():
+       for source in sources:
+         self.status_ids.append(self.storage.allocate_source(self.conn, source)[0])
      return True
 
-   def cleanup(self, days):
-     res = self.conn.execute(sa.select([
-                   self.source_table.c.source,
-                   self.source_table.c.version])
-		.where(self.source_table.c.ts <= datetime.today() - timedelta(days=days)))
-     res = res.fetchall()
-
-     with self.engine.begin() as conn:
-       for row in res:
-         logging.debug("prune: source={}, version={}".format(row["source"], row["version"]))
-         conn.execute(self.source_table.delete().where(
-               (self.source_table.c.source == row["source"]) &
-                  (self.source_table.c.version == row["version"])
-           ))
-
-         for table in self.TABLES.keys():
-           conn.execute(self.TABLES[table].delete().where(
-                 (self.TABLES[table].c.source_name == row["source"]) &
-                    (self.TABLES[table].c.source_version == row["version"])
-             ))
+   def __dedup(self, source, rec, blobs, refs):
+     # replace content by reference to ci_blob
+     for column in BLOB_COLUMNS:
+       value = rec.get(column)
+       if not isinstance(value, str):
+         continue
+       digest = hashlib.sha256(value.encode()).hexdigest()
+       rec[column + "_hash"], rec[column] = digest, None
+       blobs[digest] = value
+       refs.append((source, digest, len(value)))
+
+   def __encode(self, data_to_insert, blobs):
+     if self.storage.codec is None:
+       samples = list(blobs.values())
+       for rows in data_to_insert.values():
+         for rec in rows:
+           samples.extend(rec[column] for column in CODEC_COLUMNS if isinstance(rec.get(column), str))
+       self.storage.get_codec(self.conn, samples)
+
+     for rows in data_to_insert.values():
+       for rec in rows:
+         self.storage.encode(rec)
+
+   def mark_spooled(self, segment_id):
+     # commits together with data of spool segment
+     if self.incremental:
+       raise Exception("Spooled data requires single transaction writer")
+     with self.lock:
+       self.conn.execute(self.storage.spool_table.insert(), {"id": segment_id})
+
+   def __changed(self, source, rec, table):
+     # unchanged record stays valid in its previous row
+     rec["fingerprint"] = self.storage.fingerprint(self.storage.TABLES[table], rec)
+     previous = self.previous[rec["source_name"]][table].get(rec["fingerprint"])
+     if previous:
+       previous.pop()
+       source["unchanged"] += 1
+       return False
+     source["added"] += 1
      return True
 
-   def disconnect(self):
-     self.conn.invalidate()
+   def append(self, records, runtime = None):
+     # runtime of sources of these records (batch of collections), else commit(runtime)
+     data_to_insert = dict()
+     blobs, refs = dict(), []
+     with self.lock, self.__transaction():
+       for rec in records:
+         if not rec:
+           continue
+         source = self.__source(rec["source_name"])
+         source["entries"] += 1
+         if runtime is not None:
+           source["runtime"] = runtime
+         rec["source_id"], rec["source_version"] = source["id"], source["version"]
+
+         table = rec.pop('__table', 'inventory') or 'inventory'
+         if table == 'inventory':
+           rec["period"] = self.period
+
+         if self.storage.delta and not self.__changed(source, rec, table):
+           continue
+         if self.storage.dedup:
+           self.__dedup(source, rec, blobs, refs)
+         data_to_insert.setdefault(table, []).append(rec)
+
+       if self.storage.codec_config:
+         self.__encode(data_to_insert, blobs)
+
+       if blobs:
+         new = self.storage.store_blobs(self.conn, blobs)
+         for source, digest, size in refs:
+           source["blobs"] += 1
+           source["blob_bytes"] += size
+           if digest in new and digest not in self.blobs:
+             self.blobs.add(digest)
+             source["blobs_new"] += 1
+             source["blob_bytes_new"] += size
+
+       count = 0
+       for table in data_to_insert.keys():
+         count += self.storage.bulk_insert(self.conn, self.storage.write_table(self.conn, table), data_to_insert[table])
+       self.entries += count
+     return count
+
+   def commit(self, runtime = None):
+     with self.lock:
+       if self.conn is None:
+         return False
+       try:
+         if self.incremental:
+           self.trans = self.conn.begin()
+           if not self.storage.partitions:
+             for name, source in self.sources.items():
+               if name not in self.previous:
+                 self.storage.close_source(self.conn, name, source["version"] - 1)
+
+         for name, previous in self.previous.items():
+           self.__close_removed(self.sources[name], previous)
+
+         for name, source in self.sources.items():
+           self.conn.execute(self.storage.source_table.update()
+                   .where(self.storage.source_table.c.id == source["id"])
+                   .values(entries = source["entries"], runtime = source.get("runtime", runtime), status = STATUS_OK))
+           self.storage.update_current(self.conn, name, source["version"])
+         self.trans.commit()
+         self.storage.codec_trained = False
+         self.__log_dedup()
+         self.__log_delta()
+       except Exception:
+         if self.incremental:
+           self.trans.rollback()
+           self.__discard()
+         raise
+       finally:
+         self.__close()
+     return True
+
+   def dedup_stats(self):
+     """Per source blob references vs. newly stored blobs"""
+     stats = {}
+     for name, source in self.sources.items():
+       if source["blobs"] == 0:
+         continue
+       stats[name] = {
+         "blobs": source["blobs"],
+         "blobs_new": source["blobs_new"],
+         "bytes": source["blob_bytes"],
+         "bytes_new": source["blob_bytes_new"],
+         "ratio": 1 - source["blob_bytes_new"] / max(source["blob_bytes"], 1)
+       }
+     return stats
+
+   def __close_removed(self, source, previous):
+     # rows of previous version not seen again (removed or changed)
+     for table, rows in previous.items():
+       ids = [row_id for row_ids in rows.values() for row_id in row_ids]
+       source["closed"] += self.storage.close_rows(self.conn, self.storage.TABLES[table], ids, source["version"] - 1)
+
+   def __log_delta(self):
+     for name in self.previous.keys():
+       source = self.sources[name]
+       logging.info("delta source={}, version={}, added={}, unchanged={}, closed={}".format(
+               name, source["version"], source["added"], source["unchanged"], source["closed"]))
+
+   def __log_dedup(self):
+     for name, stats in self.dedup_stats().items():
+       logging.info("dedup source={}, blobs={}, new={}, bytes={}, new_bytes={}, ratio={:.2f}".format(
+               name, stats["blobs"], stats["blobs_new"], stats["bytes"], stats["bytes_new"], stats["ratio"]))
+
+   def abort(self):
+     with self.lock:
+       if self.conn is None:
+         return False
+       try:
+         if self.incremental:
+           self.__discard()
+         else:
+           self.trans.rollback()
+         if self.storage.codec_trained:
+           # dictionary was rolled back too
+           self.storage.codec, self.storage.codec_trained = None, False
+       finally:
+         self.__close()
+     return True
+
+   def __discard(self):
+     # incremental writer deletes what was committed so far
+     with self.conn.begin():
+       for name in self.sources.keys():
+         self.storage.discard_versions(self.conn, name)
+       if self.status_ids:
+         self.conn.execute(self.storage.source_table.delete()
+                             .where(self.storage.source_table.c.id.in_(self.status_ids)))
+
+   def __close(self):
      self.conn.close()
      self.conn = None
-     return True
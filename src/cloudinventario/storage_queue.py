@@ -0,0 +1,226 @@
+"""Asynchronous storage writes: bounded queue drained by writer threads"""
+import logging, queue, threading, time
+
+from cloudinventario.storage import InventoryStorage
+from cloudinventario.spool import InventorySpool
+from cloudinventario.sinks import get_sinks
+
+QUEUE_DEFAULTS = {
+  "size": 10,       # queued collections, producers block (or get not ready) when full
+  "workers": 1,     # writer threads
+  "batch": 5,       # collections written in one transaction
+  "retries": 2,     # retries of failed collection before it is spooled (or dropped)
+  "retry_delay": 5, # seconds between retries
+}
+
+class StorageQueue:
+   """Collections handed off by producers, written in batched transactions.
+
+   Items are results of whole collections (inventory or status), a batch
+   is written by one InventoryWriter. Failing batch is retried item by item
+   so one bad collection does not lose the others. An item that still fails
+   after retries is written to the spool (storage: spool), replayed with
+   the next successful batch; without spool it is dropped. Sinks (storage:
+   sinks) get every item before it is written to the database.
+   """
+
+   def __init__(self, config, size = None, workers = None, batch = None, retries = None, retry_delay = None):
+     self.config = config
+     self.size = size or QUEUE_DEFAULTS["size"]
+     self.workers = workers or QUEUE_DEFAULTS["workers"]
+     self.batch = batch or QUEUE_DEFAULTS["batch"]
+     self.retries = QUEUE_DEFAULTS["retries"] if retries is None else retries
+     self.retry_delay = QUEUE_DEFAULTS["retry_delay"] if retry_delay is None else retry_delay
+     self.spool = InventorySpool(config["spool"]) if config.get("spool") else None
+     self.sinks = get_sinks(config)
+     self.queue = queue.Queue(maxsize = self.size)
+     self.threads = []
+     self.lock = threading.Lock()
+     self.stats = {"queued": 0, "written": 0, "failed": 0, "spooled": 0, "batches": 0, "last_error": None}
+
+   def start(self):
+     for idx in range(self.workers):
+       thread = threading.Thread(target = self.__worker, name = "storage-writer-{}".format(idx), daemon = True)
+       thread.start()
+       self.threads.append(thread)
+     logging.info("storage queue started, size={}, workers={}, batch={}".format(self.size, self.workers, self.batch))
+     return True
+
+   def stop(self, timeout = None):
+     # writers finish queued items before exiting, then sinks are flushed
+     for thread in self.threads:
+       self.queue.put(None)
+     for thread in self.threads:
+       thread.join(timeout)
+     self.threads = []
+     self.flush()
+     return True
+
+   @property
+   def ready(self):
+     return not self.queue.full()
+
+   def status(self):
+     with self.lock:
+       return {**self.stats, "pending": self.queue.qsize(), "size": self.size, "ready": self.ready}
+
+   def put(self, item, block = True, timeout = None):
+     """Queue item, raises queue.Full when not blocking (or timed out) and queue is full"""
+     self.queue.put(item, block, timeout)
+     with self.lock:
+       self.stats["queued"] += 1
+     return True
+
+   def offer(self, item):
+     """Queue item without blocking caller (nor writing in its thread).
+
+     When queue is full, item is written to the spool (storage: spool) and
+     replayed with the next successful batch, without spool it is queued by
+     a thread waiting for free space. Returns False if item is not queued yet.
+     """
+     try:
+       return self.put(item, block = False)
+     except queue.Full:
+       pass
+     if self.spool:
+       try:
+         self.__sink([item])
+         self.__spool(item)
+         with self.lock:
+           self.stats["spooled"] += 1
+         return False
+       except Exception as e:
+         logging.error("storage queue item could not be spooled, waiting for queue", exc_info = e)
+     threading.Thread(target = self.put, args = (item,), name = "storage-queue-put", daemon = True).start()
+     return False
+
+   def put_inventory(self, inventory, runtime = None, **kwargs):
+     return self.put({"inventory": inventory, "runtime": runtime}, **kwargs)
+
+   def put_status(self, source, status, runtime = None, error = None, **kwargs):
+     return self.put({"status": {"source": source, "status": status, "runtime": runtime, "error": error}}, **kwargs)
+
+   def __next_batch(self):
+     # wait for first item, take whatever else is queued up to batch size
+     items = [self.queue.get()]
+     while len(items) < self.batch and items[-1] is not None:
+       try:
+         items.append(self.queue.get_nowait())
+       except queue.Empty:
+         break
+     return items
+
+   def __worker(self):
+     store = InventoryStorage(self.config)
+     while True:
+       items = self.__next_batch()
+       stop = items[-1] is None
+       items = [item for item in items if item is not None]
+       if items:
+         self.__sink(items)
+         self.__store(store, items)
+         for item in items:
+           self.queue.task_done()
+       if stop:
+         self.queue.task_done()
+         return
+
+   def __sink(self, items):
+     # as CloudInventario.store(), failing sink does not stop others nor storage
+     for sink in self.sinks:
+       for item in items:
+         try:
+           if "status" in item:
+             sink.save({"data": [], "errors": [item["status"]]})
+           else:
+             sink.save(item["inventory"], item["runtime"])
+         except Exception as e:
+           logging.error("storage queue failed to write sink={} path={}".format(sink.type, sink.path), exc_info = e)
+
+   def flush(self):
+     """Make data buffered by sinks visible"""
+     for sink in self.sinks:
+       try:
+         sink.flush()
+       except Exception as e:
+         logging.error("storage queue failed to flush sink={} path={}".format(sink.type, sink.path), exc_info = e)
+     return True
+
+   def __store(self, store, items):
+     try:
+       self.__write(store, items)
+     except Exception as e:
+       logging.error("storage queue batch of {} failed, writing one by one".format(len(items)), exc_info = e)
+       for item in items:
+         self.__retry(store, item)
+       return
+     if self.spool and self.spool.segments():
+       self.__replay(store)
+
+   def __retry(self, store, item):
+     for attempt in range(self.retries + 1):
+       if attempt:
+         time.sleep(self.retry_delay)
+       try:
+         self.__write(store, [item])
+         return True
+       except Exception as e:
+         logging.error("storage queue item failed (attempt {}/{})".format(attempt + 1, self.retries + 1), exc_info = e)
+         error = str(e)
+
+     if self.spool:
+       try:
+         self.__spool(item)
+         with self.lock:
+           self.stats["spooled"] += 1
+           self.stats["last_error"] = error
+         return False
+       except Exception as e:
+         logging.error("storage queue item could not be spooled", exc_info = e)
+     logging.error("storage queue item dropped after {} attempts".format(self.retries + 1))
+     self.__done(0, 1, error)
+     return False
+
+   def __spool(self, item):
+     if "status" in item:
+       status = item["status"]
+       return self.spool.write({"data": [], "errors": [status]}, status["runtime"])
+     return self.spool.write(item["inventory"], item["runtime"])
+
+   def __replay(self, store):
+     try:
+       self.spool.replay(store)
+     except Exception as e:
+       logging.error("storage queue spool replay failed", exc_info = e)
+
+   def __write(self, store, items):
+     start = time.time()
+     store.connect()
+     try:
+       with store.writer() as writer:
+         for item in items:
+           if "status" in item:
+             writer.add_status([item["status"]])
+             continue
+           inventory = item["inventory"]
+           if type(inventory) is dict:
+             writer.add_status(inventory['errors'])
+             inventory = inventory['data']
+           writer.append(inventory, item["runtime"])
+     finally:
+       store.disconnect()
+     self.__done(len(items), 0)
+     logging.debug("storage queue wrote {} collections in {:.3f}s".format(len(items), time.time() - start))
+
+   def __done(self, written, failed, error = None):
+     with self.lock:
+       self.stats["written"] += written
+       self.stats["failed"] += failed
+       if written:
+         self.stats["batches"] += 1
+       if error:
+         self.stats["last_error"] = error
+
+   def join(self):
+     """Wait until everything queued is written"""
+     self.queue.join()
@@ -0,0 +1,241 @@
+"""Durable work queue of collectors (SQLite), leased by service.py workers through coordinator.py"""
+import os, json, time, sqlite3, threading, logging
+
+WORK_QUEUE_DEFAULTS = {
+  "path": "coordinator.db",
+  "lease": 120,       # seconds a leased task is kept without heartbeat
+  "attempts": 3,      # leases of one task (first + retries after lost lease)
+  "keep": 7 * 86400,  # seconds finished tasks are kept for status
+}
+
+QUEUED, LEASED, DONE, FAILED = "queued", "leased", "done", "failed"
+
+SCHEMA = [
+  """CREATE TABLE IF NOT EXISTS ci_task (
+       id INTEGER PRIMARY KEY AUTOINCREMENT,
+       run TEXT NOT NULL,
+       name TEXT NOT NULL,
+       config TEXT NOT NULL,
+       state TEXT NOT NULL,
+       attempts INTEGER NOT NULL DEFAULT 0,
+       worker TEXT,
+       lease_until REAL,
+       created REAL NOT NULL,
+       started REAL,
+       finished REAL,
+       result TEXT,
+       error TEXT)""",
+  "CREATE INDEX IF NOT EXISTS ci_task_state ON ci_task (state, id)",
+  "CREATE INDEX IF NOT EXISTS ci_task_run ON ci_task (run)",
+  """CREATE TABLE IF NOT EXISTS ci_worker (
+       name TEXT PRIMARY KEY,
+       seen REAL NOT NULL,
+       status TEXT)""",
+]
+
+class WorkQueue:
+   """Collector tasks: queued -> leased (by worker, until lease_until) -> done | failed.
+
+   Workers lease the oldest queued tasks and extend their leases with
+   heartbeats. A task whose lease expires (worker died, lost network) is
+   queued again until it used up its attempts, then it fails. Completion is
+   accepted only from the worker holding the lease, so a task requeued
+   behind a slow worker's back is not finished twice. State is in SQLite,
+   a restarted coordinator continues with the same queue.
+   """
+
+   def __init__(self, config = None):
+     self.config = {**WORK_QUEUE_DEFAULTS, **(config or {})}
+     self.path = self.config["path"]
+     self.lease_time = self.config["lease"]
+     self.attempts = self.config["attempts"]
+     self.lock = threading.Lock()
+     # woken up by new and requeued tasks (long polling lease)
+     self.cond = threading.Condition(self.lock)
+
+     # tasks hold collector credentials
+     if self.path != ":memory:" and not os.path.exists(self.path):
+       os.close(os.open(self.path, os.O_CREAT | os.O_WRONLY, 0o600))
+     self.conn = sqlite3.connect(self.path, check_same_thread = False, isolation_level = None)
+     self.conn.row_factory = sqlite3.Row
+     self.conn.execute("PRAGMA journal_mode=WAL")
+     self.conn.execute("PRAGMA synchronous=NORMAL")
+     for sql in SCHEMA:
+       self.conn.execute(sql)
+
+   def close(self):
+     with self.lock:
+       self.conn.close()
+
+   def __transaction(self, fn, *args):
+     # under self.lock
+     self.conn.execute("BEGIN IMMEDIATE")
+     try:
+       result = fn(*args)
+     except BaseException:
+       self.conn.execute("ROLLBACK")
+       raise
+     self.conn.execute("COMMIT")
+     return result
+
+   def __task(self, row, config = False):
+     task = {key: row[key] for key in row.keys() if key not in ["config", "result"]}
+     task["result"] = json.loads(row["result"]) if row["result"] else None
+     if config:
+       task["config"] = json.loads(row["config"])
+     return task
+
+   def submit(self, collectors, run = None):
+     """Queue collectors ({name: collector config}) in given order as one run.
+
+     Collectors already queued or leased are skipped. Returns (run, {name: task id}).
+     """
+     run = run or "{:.6f}".format(time.time())
+     def add():
+       active = {row["name"] for row in self.conn.execute("SELECT name FROM ci_task WHERE state IN (?, ?)", (QUEUED, LEASED))}
+       ids = {}
+       now = time.time()
+       for name, config in collectors.items():
+         if name in active:
+           logging.info("work queue: collector name={} already queued, skipped".format(name))
+           continue
+         ids[name] = self.conn.execute("INSERT INTO ci_task (run, name, config, state, created) VALUES (?, ?, ?, ?, ?)",
+                                       (run, name, json.dumps(config), QUEUED, now)).lastrowid
+       return ids
+     with self.cond:
+       ids = self.__transaction(add)
+       self.cond.notify_all()
+     logging.info("work queue: run={} queued {} of {} collectors".format(run, len(ids), len(collectors)))
+     return run, ids
+
+   def __expire(self, now):
+     # lost leases: queue again or fail after last attempt
+     expired = self.conn.execute("SELECT id, name, worker, attempts FROM ci_task WHERE state = ? AND lease_until < ?",
+                                 (LEASED, now)).fetchall()
+     for row in expired:
+       if row["attempts"] < self.attempts:
+         self.conn.execute("UPDATE ci_task SET state = ?, worker = NULL, lease_until = NULL WHERE id = ?", (QUEUED, row["id"]))
+         logging.warning("work queue: lease of task={} name={} by worker={} expired, queued again (attempt {}/{})".format(
+                           row["id"], row["name"], row["worker"], row["attempts"], self.attempts))
+       else:
+         self.conn.execute("UPDATE ci_task SET state = ?, lease_until = NULL, finished = ?, error = ? WHERE id = ?",
+                           (FAILED, now, "lease expired after {} attempts".format(row["attempts"]), row["id"]))
+         logging.error("work queue: task={} name={} failed, lease expired after {} attempts".format(
+                         row["id"], row["name"], row["attempts"]))
+     return len(expired)
+
+   def expire(self):
+     """Requeue (or fail) tasks of expired leases, returns their count"""
+     with self.cond:
+       count = self.__transaction(self.__expire, time.time())
+       if count:
+         self.cond.notify_all()
+     return count
+
+   def __seen(self, worker, status, now):
+     self.conn.execute("INSERT INTO ci_worker (name, seen, status) VALUES (?, ?, ?) "
+                       "ON CONFLICT (name) DO UPDATE SET seen = excluded.seen, status = excluded.status",
+                       (worker, now, json.dumps(status) if status is not None else None))
+
+   def lease(self, worker, count = 1, wait = 0, status = None):
+     """Lease up to count oldest queued tasks (with their config) for worker.
+
+     Waits up to wait seconds for a task when none is queued.
+     """
+     deadline = time.time() + wait
+     def take():
+       now = time.time()
+       self.__expire(now)
+       self.__seen(worker, status, now)
+       rows = self.conn.execute("SELECT * FROM ci_task WHERE state = ? ORDER BY id LIMIT ?", (QUEUED, count)).fetchall()
+       for row in rows:
+         self.conn.execute("UPDATE ci_task SET state = ?, worker = ?, lease_until = ?, started = ?, attempts = attempts + 1 "
+                           "WHERE id = ?", (LEASED, worker, now + self.lease_time, now, row["id"]))
+       return [self.__task(row, config = True) for row in rows]
+     with self.cond:
+       while True:
+         tasks = self.__transaction(take) if count > 0 else []
+         remaining = deadline - time.time()
+         if tasks or remaining <= 0:
+           break
+         self.cond.wait(min(remaining, self.lease_time))
+     for task in tasks:
+       logging.info("work queue: task={} name={} leased by worker={}".format(task["id"], task["name"], worker))
+     return tasks
+
+   def heartbeat(self, worker, ids, status = None):
+     """Extend leases of worker's tasks, returns ids it still holds (others were requeued)"""
+     def extend():
+       now = time.time()
+       self.__seen(worker, status, now)
+       held = []
+       for task_id in ids:
+         if self.conn.execute("UPDATE ci_task SET lease_until = ? WHERE id = ? AND state = ? AND worker = ?",
+                              (now + self.lease_time, task_id, LEASED, worker)).rowcount:
+           held.append(task_id)
+       return held
+     with self.lock:
+       held = self.__transaction(extend)
+     if len(held) < len(ids):
+       logging.warning("work queue: worker={} lost leases of tasks {}".format(worker, sorted(set(ids) - set(held))))
+     return held
+
+   def complete(self, worker, task_id, success, result = None, error = None):
+     """Finish task leased by worker, False when worker does not hold its lease"""
+     with self.lock:
+       done = self.conn.execute("UPDATE ci_task SET state = ?, lease_until = NULL, finished = ?, result = ?, error = ? "
+                                "WHERE id = ? AND state = ? AND worker = ?",
+                                (DONE if success else FAILED, time.time(), json.dumps(result) if result is not None else None,
+                                 error, task_id, LEASED, worker)).rowcount
+     if not done:
+       logging.warning("work queue: completion of task={} by worker={} ignored, lease not held".format(task_id, worker))
+     return bool(done)
+
+   def cleanup(self):
+     """Remove finished tasks older than keep seconds"""
+     with self.lock:
+       return self.conn.execute("DELETE FROM ci_task WHERE state IN (?, ?) AND finished < ?",
+                                (DONE, FAILED, time.time() - self.config["keep"])).rowcount
+
+   def tasks(self, run = None, state = None):
+     sql, params = "SELECT * FROM ci_task WHERE 1 = 1", []
+     if run is not None:
+       sql, params = sql + " AND run = ?", params + [run]
+     if state is not None:
+       sql, params = sql + " AND state = ?", params + [state]
+     with self.lock:
+       rows = self.conn.execute(sql + " ORDER BY id", params).fetchall()
+     return [self.__task(row) for row in rows]
+
+   def status(self, run = None, worker_timeout = None):
+     """Aggregated status: tasks by state, runs, workers with their last reported status"""
+     worker_timeout = worker_timeout or self.lease_time
+     where, params = ("WHERE run = ?", [run]) if run is not None else ("", [])
+     now = time.time()
+     with self.lock:
+       states = {row["state"]: row["count"] for row in
+                 self.conn.execute("SELECT state, count(*) AS count FROM ci_task {} GROUP BY state".format(where), params)}
+       runs = {}
+       for row in self.conn.execute("SELECT run, state, count(*) AS count, min(created) AS created, max(finished) AS finished "
+                                    "FROM ci_task {} GROUP BY run, state ORDER BY run".format(where), params):
+         entry = runs.setdefault(row["run"], {"created": row["created"], "finished": None, "tasks": {}})
+         entry["tasks"][row["state"]] = row["count"]
+         entry["created"] = min(entry["created"], row["created"])
+         entry["finished"] = max(filter(None, [entry["finished"], row["finished"]]), default = None)
+       leased = {}
+       for row in self.conn.execute("SELECT worker, name FROM ci_task WHERE state = ?", (LEASED,)):
+         leased.setdefault(row["worker"], []).append(row["name"])
+       workers = {row["name"]: {"seen": row["seen"], "alive": now - row["seen"] < worker_timeout,
+                                "tasks": leased.get(row["name"], []),
+                                "status": json.loads(row["status"]) if row["status"] else None}
+                  for row in self.conn.execute("SELECT * FROM ci_worker ORDER BY name")}
+     for entry in runs.values():
+       entry["done"] = not entry["tasks"].get(QUEUED) and not entry["tasks"].get(LEASED)
+       if not entry["done"]:
+         entry["finished"] = None
+     return {
+       "tasks": {state: states.get(state, 0) for state in [QUEUED, LEASED, DONE, FAILED]},
+       "done": not states.get(QUEUED) and not states.get(LEASED),
+       "runs": runs,
+       "workers": workers,
+     }
@@ -2,7 +2,6 @@ import concurrent.futures
 import logging, re, sys, asyncio, time
 from pprint import pprint
 
-import boto3
 
 from cloudinventario_amazon_aws_resource.collector import CloudInvetarioAmazonAWSResource
 from cloudinventario.helpers import CloudCollector, CloudInvetarioResourceManager
@@ -28,8 +27,8 @@ class CloudCollectorAmazonAWS(CloudInvetarioAmazonAWSResource):
     }
 
   def _get_dependencies(self):
-    return []
-    # return ["ebs"]
+    # VM pass reads ebs data, not forced into collection
+    return ["ebs"] if "ebs" in (self.resources or []) else []
 
   def _login(self):
     access_key = self.config['access_key']
@@ -43,16 +42,13 @@ class CloudCollectorAmazonAWS(CloudInvetarioAmazonAWSResource):
       logging.getLogger(logger).setLevel(logging.WARNING)
 
     if self.account_id is None:
-      sts = boto3.client('sts', aws_access_key_id = access_key, aws_secret_access_key = secret_key)
-      ident = sts.get_caller_identity()
-      self.account_id = ident['Account']
+      self.account_id = self._caller_account(access_key, secret_key)
 
     if self.account_id:
       self.defaults['owner'] = self.account_id
 
     logging.info("logging in AWS account_id={}, region={}".format(self.account_id, region))
-    self.session = boto3.Session(aws_access_key_id = access_key, aws_secret_access_key = secret_key,
-                                  aws_session_token = session_token, region_name = region)
+    self.session = self._session(access_key, secret_key, session_token, region)
     self.client = self.session.client('ec2')
 
     self.instance_types = {}
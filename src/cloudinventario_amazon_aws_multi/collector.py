@@ -1,13 +1,10 @@
-import concurrent.futures
+import functools
 import logging, re, sys, asyncio, time
 from pprint import pprint
 
-import boto3
-import boto3.session
-from botocore.exceptions import ClientError
-
 from cloudinventario.cloudinventario import CloudInventario
 from cloudinventario.helpers import CloudCollector
+import cloudinventario.sessions as sessions
 from cloudinventario_amazon_aws_resource.collector import CloudInvetarioAmazonAWSResource
 
 # TEST MODE
@@ -46,16 +43,20 @@ class CloudCollectorAmazonAWSMulti(CloudInvetarioAmazonAWSResource):
     logging.info("assuming AWS roles")
     #self._add_creds_regions(None, access_key, secret_key, None, regions)
     if roles:
+      import boto3
       client = boto3.client('sts', aws_access_key_id = access_key, aws_secret_access_key = secret_key)
 
       for role in roles:
         try:
           role_regions = role.get('region', regions)
-          assumed = client.assume_role(
-            RoleArn = "arn:aws:iam::{}:role/{}".format(role['account'], role['role']),
-            RoleSessionName = "ASSR-{}".format(role['account'])
-          )
-          as_creds = assumed['Credentials']
+          role_arn = "arn:aws:iam::{}:role/{}".format(role['account'], role['role'])
+          # temporary credentials are reused by collections of this worker until near their expiry
+          as_creds = sessions.cached("aws-assume-role", (access_key, secret_key, role_arn),
+                       lambda: client.assume_role(
+                         RoleArn = role_arn,
+                         RoleSessionName = "ASSR-{}".format(role['account'])
+                       )['Credentials'],
+                       ttl = lambda creds: sessions.until(creds['Expiration']))
           self._add_creds_regions(role['name'], str(role['account']), as_creds['AccessKeyId'], as_creds['SecretAccessKey'], as_creds['SessionToken'], role_regions)
         except Exception as error:
           logging.warning(f"AccessDenied on User: {role['account']} to perform: {role['role']}")
@@ -73,11 +74,13 @@ class CloudCollectorAmazonAWSMulti(CloudInvetarioAmazonAWSResource):
         self.defaults['project'] = cred['name']
 
       cred['collect'] = self.config['collect']
-      handle = self._loadCollectorModule(name, cred, self.defaults, self.options)
+      # sub-accounts are checkpointed as whole by this collector
+      handle = self._loadCollectorModule(name, cred, self.defaults, {**self.options, 'checkpoint': None})
       handle.login()
 
       self.clients.append({
         "account_id": cred['account_id'] or 0,
+        "part": "{}:{}".format(name, cred['region']),
         "handle": handle
       })
 
@@ -103,10 +106,12 @@ class CloudCollectorAmazonAWSMulti(CloudInvetarioAmazonAWSResource):
       })
     else:
       # XXXX: discover enable regions using EC2 (what if other services have different enabled ?)
-      client = boto3.client('ec2', aws_access_key_id = access_key, aws_secret_access_key = secret_key,
-                               aws_session_token = session_token, region_name = self.primary_region)
+      import boto3
+      from botocore.exceptions import ClientError
       try:
-        region_list = client.describe_regions()
+        region_list = sessions.cached("aws-regions", (access_key, secret_key, session_token, self.primary_region),
+                        lambda: boto3.client('ec2', aws_access_key_id = access_key, aws_secret_access_key = secret_key,
+                                  aws_session_token = session_token, region_name = self.primary_region).describe_regions())
       except ClientError as e:
         logging.error("Failed to discover enabled regions, please specify manually or grant permission")
         raise
@@ -124,11 +129,11 @@ class CloudCollectorAmazonAWSMulti(CloudInvetarioAmazonAWSResource):
 
   def _fetch(self, collect):
     res = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers = self.options["tasks"] or 1) as executor:
+    with self._executor() as executor:
       futures = []
       for client in self.clients:
-         futures.append(executor.submit(client['handle'].fetch, collect))
-      for future in concurrent.futures.as_completed(futures):
+         futures.append(executor.submit(self._fetch_client, client, collect))
+      for future in executor.as_completed(futures):
         try:
           res.extend(future.result())
         except Exception as e:
@@ -136,5 +141,12 @@ class CloudCollectorAmazonAWSMulti(CloudInvetarioAmazonAWSResource):
           raise
     return res
 
+  def _fetch_client(self, client, collect):
+    if self.checkpoint is None:
+      return client['handle'].fetch(collect, self.writer)
+    # records must reach checkpoint before the (uncommitted) writer
+    records = self._checkpointed(client['part'], functools.partial(client['handle'].fetch, collect))
+    return self._stream(records)
+
   def _logout(self):
     self.clients = None
@@ -2,10 +2,11 @@ import concurrent.futures
 import logging, re, sys, asyncio, time
 from pprint import pprint
 
-import boto3
-import botocore.exceptions as aws_exception
-
 from cloudinventario.helpers import CloudCollector, CloudInvetarioResourceManager
+import cloudinventario.sessions as sessions
+
+# account of access key does not change
+IDENTITY_TTL = 86400
 
 # TEST MODE
 TEST = 0
@@ -19,7 +20,23 @@ class CloudInvetarioAmazonAWSResource(CloudCollector):
     self.ERRORS = ['AccessDenied', 'UnauthorizedOperation', 'InvalidInstanceType', 'DescribeInstanceTypes']
     super().__init__(name, config, defaults, options)
 
+  def _caller_account(self, access_key, secret_key):
+    # one STS call per worker process, not per collection
+    import boto3
+    return sessions.cached("aws-identity", (access_key, secret_key),
+             lambda: boto3.client('sts', aws_access_key_id = access_key, aws_secret_access_key = secret_key)
+                       .get_caller_identity()['Account'], ttl = IDENTITY_TTL)
+
+  def _session(self, access_key, secret_key, session_token, region):
+    # session keeps loaded service models, clients of reused worker are created fast,
+    # sessions are not thread safe, one per thread
+    import boto3
+    return sessions.per_thread("aws-session", (access_key, secret_key, session_token, region),
+             lambda: boto3.Session(aws_access_key_id = access_key, aws_secret_access_key = secret_key,
+                                   aws_session_token = session_token, region_name = region))
+
   def check_permission(self, client, error):
+    import botocore.exceptions as aws_exception
     if type(error) == aws_exception.ClientError and error.response['Error']['Code'] in self.ERRORS:
       print("Don't have permission for service, stopped collecting user: {}, because: {}".format(client, error.response['Error']['Code']))
       logging.warning("Don't have permission for service, stopped collecting user: {}, because: {}".format(client, error.response['Error']['Code']))
@@ -1,5 +1,4 @@
 import logging
-import boto3
 
 from cloudinventario_amazon_aws.collector import CloudCollectorAmazonAWS
 
@@ -26,13 +25,10 @@ class CloudCollectorAmazonLightsail(CloudCollectorAmazonAWS):
       logging.getLogger(logger).setLevel(logging.WARNING)
 
     if self.account_id is None:
-      sts = boto3.client('sts', aws_access_key_id = access_key, aws_secret_access_key = secret_key)
-      ident = sts.get_caller_identity()
-      self.account_id = ident['Account']
+      self.account_id = self._caller_account(access_key, secret_key)
 
     logging.info("logging in AWS account_id={}, region={}".format(self.account_id, region))
-    self.session = boto3.Session(aws_access_key_id = access_key, aws_secret_access_key = secret_key,
-                                  aws_session_token = session_token, region_name = region)
+    self.session = self._session(access_key, secret_key, session_token, region)
     self.client = self.session.client('lightsail')
 
     self.instance_types = {}
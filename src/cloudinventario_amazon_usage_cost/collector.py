@@ -7,8 +7,6 @@ import time
 import datetime
 from pprint import pprint
 
-import boto3
-
 from cloudinventario_amazon_aws_resource.collector import CloudInvetarioAmazonAWSResource
 from cloudinventario.helpers import CloudCollector, CloudInvetarioResourceManager
 
@@ -51,15 +49,11 @@ class CloudCollectorAmazonUsageCost(CloudInvetarioAmazonAWSResource):
       logging.getLogger(logger).setLevel(logging.WARNING)
 
     if self.account_id is None:
-      sts=boto3.client('sts', aws_access_key_id = access_key,
-                       aws_secret_access_key = secret_key)
-      ident=sts.get_caller_identity()
-      self.account_id=ident['Account']
+      self.account_id=self._caller_account(access_key, secret_key)
 
     logging.info("logging in AWS Usage and Cost with account_id={}, region={}".format(
         self.account_id, region))
-    self.session=boto3.Session(aws_access_key_id = access_key, aws_secret_access_key = secret_key,
-                                  aws_session_token = session_token, region_name = region)
+    self.session=self._session(access_key, secret_key, session_token, region)
     self.client=self.session.client('ce')
 
     self.instance_types={}
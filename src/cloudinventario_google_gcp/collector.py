@@ -6,10 +6,6 @@ import asyncio
 import time
 from pprint import pprint
 
-from google.oauth2 import service_account
-import googleapiclient.discovery
-from google.cloud import storage
-
 from cloudinventario.helpers import CloudCollector, CloudInvetarioResourceManager
 
 # TEST MODE
@@ -58,6 +54,7 @@ class CloudCollectorGoogleGCP(CloudCollector):
 
         self.zone = self.config['zone']
         self.project_name = self.config['project_id']
+        from google.oauth2 import service_account
         self.credentials = service_account.Credentials.from_service_account_info(credentials)
         logging.info("logging config for GCP vm client_email={}, project_name={}".format(self.config['client_email'], self.project_name))
 
@@ -66,6 +63,7 @@ class CloudCollectorGoogleGCP(CloudCollector):
     def _fetch(self, collect):
         data = []
         # GET compute engine
+        import googleapiclient.discovery
         self.compute_engine = googleapiclient.discovery.build('compute', 'v1', credentials=self.credentials, cache_discovery=False)
 
         # GET all instances with specific project name and zone (return JSON, where data are in items)
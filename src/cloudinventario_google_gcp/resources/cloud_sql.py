@@ -2,9 +2,6 @@ from pprint import pprint
 import logging
 import re
 
-from google.oauth2 import service_account
-import googleapiclient.discovery
-
 from cloudinventario.helpers import CloudInvetarioResource
 
 def setup(resource, collector):
@@ -25,6 +22,7 @@ class CloudInventarioCloudSQL(CloudInvetarioResource):
   def _fetch(self):
     data = []
     # GET sqladmin
+    import googleapiclient.discovery
     _sqladmin = googleapiclient.discovery.build('sqladmin', 'v1beta4', credentials=self.credentials)
 
     # GET instances
@@ -2,9 +2,6 @@ from pprint import pprint
 import logging
 import re
 
-from google.oauth2 import service_account
-import googleapiclient.discovery
-
 from cloudinventario.helpers import CloudInvetarioResource
 
 def setup(resource, collector):
@@ -25,6 +22,7 @@ class CloudInventarioGclb(CloudInvetarioResource):
   def _fetch(self):
     data = []
     # GET compute engine
+    import googleapiclient.discovery
     _compute_engine = googleapiclient.discovery.build('compute', 'v1', credentials=self.credentials)
 
     # GET backend services/ info about load balancer
@@ -2,11 +2,6 @@ import json
 from pprint import pprint
 import logging
 
-from google.cloud import storage
-from google.cloud.storage import bucket
-from google.oauth2 import service_account
-import googleapiclient.discovery
-
 from cloudinventario.helpers import CloudInvetarioResource
 
 
@@ -29,6 +24,7 @@ class CloudInventarioStorage(CloudInvetarioResource):
     def _fetch(self):
         data = []
         # GET storages
+        import googleapiclient.discovery
         self.storage = googleapiclient.discovery.build('storage', 'v1', credentials=self.credentials)
 
         # GET all buckets in specific project
@@ -2,7 +2,6 @@
 import concurrent.futures
 import logging, re, sys, asyncio, time
 from pprint import pprint
-from boto3 import resources
 
 from hcloud import Client
 from httplib2 import Response
@@ -5,19 +5,9 @@ from pprint import pprint
 from typing import Dict, List
 import datetime
 
-from sqlalchemy.sql.sqltypes import Boolean
-
 from cloudinventario.helpers import CloudCollector
 
-from azure.identity import ClientSecretCredential
-from azure.mgmt.compute import ComputeManagementClient
-from azure.mgmt.resource import ResourceManagementClient, resources
-from azure.mgmt.network import NetworkManagementClient
-
-from azure.mgmt.compute.v2021_03_01.models._models_py3 import VirtualMachine
-from azure.mgmt.resource.resources.v2021_04_01.models._models_py3 import (
-    GenericResourceExpanded,
-)
+# SDK clients are imported by resource collectors that use them
 
 # TEST MODE
 TEST = 0
@@ -37,6 +27,7 @@ class CloudCollectorMicrosoftAzure(CloudCollector):
         self.client_id = self.config["client_id"]
         self.client_secret = self.config["client_secret"]
 
+        from azure.identity import ClientSecretCredential
         self.credential = ClientSecretCredential(
             tenant_id=self.tenant_id,
             client_id=self.client_id,
@@ -4,7 +4,6 @@ from copy import Error
 
 from azure.core.exceptions import AzureError
 from cloudinventario.helpers import CloudInvetarioResource
-from azure.mgmt.network import NetworkManagementClient
 
 
 def setup(resource, collector):
@@ -17,6 +16,7 @@ class CloudInventarioAzureLoadBalancer(CloudInvetarioResource):
         super().__init__(resource, collector)
 
     def _login(self, credentials):
+        from azure.mgmt.network import NetworkManagementClient
         try:
             self.credentials = credentials
             subscription_id = self.collector.subscription_id
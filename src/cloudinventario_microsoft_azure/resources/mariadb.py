@@ -6,8 +6,6 @@ from cloudinventario.helpers import CloudInvetarioResource
 from cloudinventario_microsoft_azure.collector import CloudCollectorMicrosoftAzure
 
 from azure.core.exceptions import AzureError
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.rdbms.mariadb import MariaDBManagementClient
 
 def setup(resource, collector):
     return CloudInventarioAzureMariaDB(resource, collector)
@@ -19,6 +17,7 @@ class CloudInventarioAzureMariaDB(CloudInvetarioResource):
         super().__init__(resource, collector)
 
     def _login(self, credentials):
+        from azure.mgmt.rdbms.mariadb import MariaDBManagementClient
         try:
             self.credentials = credentials
             subscription_id = self.collector.subscription_id
@@ -1,9 +1,7 @@
 import logging
 import re
 from copy import Error
-from azure.mgmt.rdbms import postgresql
 
-from boto3 import resource
 
 from azure.core.exceptions import AzureError
 
@@ -6,8 +6,6 @@ from cloudinventario.helpers import CloudInvetarioResource
 from cloudinventario_microsoft_azure.collector import CloudCollectorMicrosoftAzure
 
 from azure.core.exceptions import AzureError
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.rdbms.mysql import MySQLManagementClient
 
 def setup(resource, collector):
     return CloudInventarioAzureMysql(resource, collector)
@@ -19,6 +17,7 @@ class CloudInventarioAzureMysql(CloudInvetarioResource):
         super().__init__(resource, collector)
 
     def _login(self, credentials):
+        from azure.mgmt.rdbms.mysql import MySQLManagementClient
         try:
             self.credentials = credentials
             subscription_id = self.collector.subscription_id
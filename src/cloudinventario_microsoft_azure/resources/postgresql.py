@@ -6,8 +6,6 @@ from cloudinventario.helpers import CloudInvetarioResource
 from cloudinventario_microsoft_azure.collector import CloudCollectorMicrosoftAzure
 
 from azure.core.exceptions import AzureError
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.rdbms.postgresql import PostgreSQLManagementClient
 
 def setup(resource, collector):
     return CloudInventarioAzurePostgreSQL(resource, collector)
@@ -19,6 +17,7 @@ class CloudInventarioAzurePostgreSQL(CloudInvetarioResource):
         super().__init__(resource, collector)
 
     def _login(self, credentials):
+        from azure.mgmt.rdbms.postgresql import PostgreSQLManagementClient
         try:
             self.credentials = credentials
             subscription_id = self.collector.subscription_id
@@ -6,8 +6,6 @@ from cloudinventario.helpers import CloudInvetarioResource
 from cloudinventario_microsoft_azure.collector import CloudCollectorMicrosoftAzure
 
 from azure.core.exceptions import AzureError
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.sql import SqlManagementClient
 
 
 def setup(resource, collector):
@@ -20,6 +18,7 @@ class CloudInventarioAzureSQLServer(CloudInvetarioResource):
         super().__init__(resource, collector)
 
     def _login(self, credentials):
+        from azure.mgmt.sql import SqlManagementClient
         try:
             self.credentials = credentials
             subscription_id = self.collector.subscription_id
@@ -1,3 +1,4 @@
+from __future__ import annotations
 import concurrent.futures
 from copy import Error
 import logging
@@ -6,23 +7,18 @@ import sys
 import asyncio
 import time
 from pprint import pprint
-from typing import Dict, List
+from typing import Dict, List, TYPE_CHECKING
 import datetime
 
-from sqlalchemy.sql.sqltypes import Boolean
-
 from cloudinventario.helpers import CloudInvetarioResource
 
 from azure.core.exceptions import AzureError
-from azure.identity import ClientSecretCredential
-from azure.mgmt.compute import ComputeManagementClient
-from azure.mgmt.resource import ResourceManagementClient, resources
-from azure.mgmt.network import NetworkManagementClient
 
-from azure.mgmt.compute.v2021_03_01.models._models_py3 import VirtualMachine
-from azure.mgmt.resource.resources.v2021_04_01.models._models_py3 import (
-    GenericResourceExpanded,
-)
+if TYPE_CHECKING:
+    from azure.mgmt.compute.v2021_03_01.models._models_py3 import VirtualMachine
+    from azure.mgmt.resource.resources.v2021_04_01.models._models_py3 import (
+        GenericResourceExpanded,
+    )
 
 # TEST MODE
 TEST = 0
@@ -41,6 +37,9 @@ class CloudInventarioAzureVM(CloudInvetarioResource):
         """
         Login into MS Azure Cloud account and get usable client object(s).
         """
+        from azure.mgmt.compute import ComputeManagementClient
+        from azure.mgmt.resource import ResourceManagementClient
+        from azure.mgmt.network import NetworkManagementClient
         try:
             subscription_id = self.collector.subscription_id
             self.compute_client = ComputeManagementClient(
@@ -248,7 +247,7 @@ class CloudInventarioAzureVM(CloudInvetarioResource):
                 return disk.get('disk_size_gb') * 1024
         return None
 
-    def __check_resource_and_vm_id(self, resource_id: str, vm_id: str) -> Boolean:
+    def __check_resource_and_vm_id(self, resource_id: str, vm_id: str) -> bool:
         """Check if the resource attribute id is same as virtual machine id.
 
         Sometimes is the same group name in different forms - capitalized or not. 
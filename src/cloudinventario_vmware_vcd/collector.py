@@ -1,4 +1,3 @@
-import concurrent.futures
 import logging, re, sys, asyncio
 from pprint import pprint
 
@@ -236,11 +235,11 @@ class CloudCollectorVMWareVCD(CloudCollector):
     except Exception as error:
       raise error
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers = self.options["tasks"] or 1) as executor:
+    with self._executor() as executor:
       futures = []
       for vm_def in vm_list:
          futures.append(executor.submit(self.__process_vmlist_vm, org_name, vdc_name, vapp_name, vdc, vapp, vm_def, resource_type))
-      for future in concurrent.futures.as_completed(futures):
+      for future in executor.as_completed(futures):
          res.append(future.result())
     return res
 
@@ -1,4 +1,3 @@
-import concurrent.futures
 import sys, logging, re
 from pprint import pprint
 
@@ -136,12 +135,12 @@ class CloudCollectorVMWareVSphere(CloudCollector):
       if hasattr(child, 'vmFolder'):
         datacenter = child
         vmFolder = datacenter.vmFolder
-        with concurrent.futures.ThreadPoolExecutor(max_workers = self.options["tasks"] or 1) as executor:
+        with self._executor() as executor:
           futures = []
           for vm in vmFolder.childEntity:
             futures.append(executor.submit(self.__process_vmchild, vm))
 
-          for future in concurrent.futures.as_completed(futures):
+          for future in executor.as_completed(futures):
             recs = future.result()
             if recs:
               res.extend(recs)
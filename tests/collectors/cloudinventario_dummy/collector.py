@@ -0,0 +1,32 @@
+"""Test collector (module: dummy), config: records, sleep (seconds per record), fail, crash, ignore_alarm"""
+import os, time, signal
+
+from cloudinventario.helpers import CloudCollector
+
+def setup(name, config, defaults, options):
+  return DummyCollector(name, config, defaults, options)
+
+class DummyCollector(CloudCollector):
+  COLLECTOR_PKG = "cloudinventario_dummy"
+
+  def __init__(self, name, config, defaults, options):
+    super().__init__(name, config, defaults, options)
+    if self.config.get("ignore_alarm"):
+      # stuck where the time limit signal can't stop it
+      signal.signal(signal.SIGALRM, signal.SIG_IGN)
+
+  def _login(self):
+    return True
+
+  def _fetch(self, collect):
+    if self.config.get("fail"):
+      raise Exception("dummy collector failed")
+    if self.config.get("crash"):
+      # worker process dies, its pool breaks
+      os._exit(1)
+    for idx in range(self.config.get("records", 2)):
+      time.sleep(self.config.get("sleep", 0))
+      yield self.new_record("vm", {"uniqueid": "u{}".format(idx), "name": "vm{}".format(idx)}, {"idx": idx})
+
+  def _logout(self):
+    pass
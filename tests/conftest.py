@@ -0,0 +1,21 @@
+import os, sys
+
+import pytest
+
+DN = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DN + '/../src')
+# test collector package (module: dummy)
+sys.path.insert(0, DN + '/collectors')
+
+import cloudinventario.storage as storage
+
+@pytest.fixture
+def dsn(tmp_path):
+   yield "sqlite:///{}".format(tmp_path / "inventory.db")
+   # engines are cached per DSN, don't leak them between tests
+   storage.dispose_engines()
+   storage._SCHEMAS_VERIFIED.clear()
+
+def record(source, idx, **fields):
+   return {"source_name": source, "inventory_type": "vm", "uniqueid": "u{}".format(idx),
+           "name": "vm{}".format(idx), "details": '{"idx": %d}' % idx, **fields}
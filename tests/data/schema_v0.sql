@@ -0,0 +1,109 @@
+-- ci_* tables as created by storage before schema versioning (version 0)
+CREATE TABLE ci_source (
+	id INTEGER NOT NULL, 
+	ts VARCHAR, 
+	source VARCHAR, 
+	version INTEGER, 
+	runtime INTEGER, 
+	entries INTEGER, 
+	status VARCHAR, 
+	error TEXT, 
+	PRIMARY KEY (id), 
+	UNIQUE (source, version)
+);
+
+CREATE TABLE ci_inventory (
+	id INTEGER NOT NULL, 
+	source_id INTEGER, 
+	source_name VARCHAR NOT NULL, 
+	source_version INTEGER NOT NULL, 
+	inventory_type VARCHAR NOT NULL, 
+	uniqueid VARCHAR, 
+	name VARCHAR, 
+	cluster VARCHAR, 
+	project VARCHAR, 
+	location VARCHAR, 
+	created VARCHAR, 
+	cpus INTEGER, 
+	memory INTEGER, 
+	disks INTEGER, 
+	storage INTEGER, 
+	primary_ip VARCHAR, 
+	primary_fqdn VARCHAR, 
+	os VARCHAR, 
+	os_family VARCHAR, 
+	status VARCHAR, 
+	is_on INTEGER, 
+	networks VARCHAR, 
+	storages VARCHAR, 
+	owner VARCHAR, 
+	tags TEXT, 
+	description VARCHAR, 
+	attributes TEXT, 
+	details TEXT, 
+	PRIMARY KEY (id), 
+	UNIQUE (source_version, source_name, inventory_type, name, cluster, project, uniqueid)
+);
+
+CREATE TABLE ci_dns_domain (
+	id INTEGER NOT NULL, 
+	source_id INTEGER, 
+	source_name VARCHAR NOT NULL, 
+	source_version INTEGER NOT NULL, 
+	inventory_type VARCHAR NOT NULL, 
+	cluster VARCHAR, 
+	project VARCHAR, 
+	created VARCHAR, 
+	uniqueid VARCHAR NOT NULL, 
+	name VARCHAR, 
+	type VARCHAR, 
+	ttl VARCHAR, 
+	owner VARCHAR, 
+	tags TEXT, 
+	description VARCHAR, 
+	attributes TEXT, 
+	details TEXT, 
+	PRIMARY KEY (id)
+);
+
+CREATE TABLE ci_dns_record (
+	id INTEGER NOT NULL, 
+	source_id INTEGER NOT NULL, 
+	source_name VARCHAR NOT NULL, 
+	source_version INTEGER NOT NULL, 
+	domain_id INTEGER NOT NULL, 
+	domain_name VARCHAR NOT NULL, 
+	inventory_type VARCHAR NOT NULL, 
+	cluster VARCHAR, 
+	project VARCHAR, 
+	created VARCHAR, 
+	uniqueid VARCHAR NOT NULL, 
+	name VARCHAR, 
+	type VARCHAR, 
+	ttl VARCHAR, 
+	data TEXT, 
+	owner VARCHAR, 
+	tags TEXT, 
+	description VARCHAR, 
+	attributes TEXT, 
+	details TEXT, 
+	PRIMARY KEY (id)
+);
+
+CREATE TABLE ci_usage_cost (
+	id INTEGER NOT NULL, 
+	source_id INTEGER NOT NULL, 
+	source_name VARCHAR NOT NULL, 
+	source_version INTEGER NOT NULL, 
+	inventory_type VARCHAR NOT NULL, 
+	period_type VARCHAR, 
+	period_from VARCHAR, 
+	period_to VARCHAR, 
+	cost_centre VARCHAR, 
+	cost FLOAT, 
+	unit VARCHAR, 
+	attributes TEXT, 
+	details TEXT, 
+	attachment BLOB, 
+	PRIMARY KEY (id)
+);
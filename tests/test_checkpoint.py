@@ -0,0 +1,25 @@
+import os, time
+
+from cloudinventario.checkpoint import CollectorCheckpoint
+
+def test_failed_run_is_resumed(tmp_path):
+   config = {"path": str(tmp_path), "fsync": False}
+   checkpoint = CollectorCheckpoint("aws/prod", config)
+   checkpoint.save("resource-ebs", [{"name": "vol1"}, None, {"name": "vol2"}])
+   assert checkpoint.done("resource-ebs")
+
+   # run failed, retry loads completed parts only
+   retry = CollectorCheckpoint("aws/prod", config)
+   assert retry.done("resource-ebs")
+   assert not retry.done("resource-s3")
+   assert retry.load("resource-ebs") == [{"name": "vol1"}, {"name": "vol2"}]
+
+   retry.clear()
+   assert not os.path.exists(retry.path)
+   assert not CollectorCheckpoint("aws/prod", config).done("resource-ebs")
+
+def test_expired_checkpoint_is_discarded(tmp_path):
+   config = {"path": str(tmp_path), "window": 0.1, "fsync": False}
+   CollectorCheckpoint("aws", config).save("resource-ebs", [{"name": "vol1"}])
+   time.sleep(0.2)
+   assert not CollectorCheckpoint("aws", config).done("resource-ebs")
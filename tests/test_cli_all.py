@@ -0,0 +1,102 @@
+import os, sys, sqlite3, subprocess, time
+
+import pytest
+import yaml
+
+from conftest import DN
+
+# --all needs the full runtime environment
+for module in ["prometheus_client", "psutil", "setproctitle"]:
+   pytest.importorskip(module)
+
+CLI = DN + "/../cloudinventario"
+
+def collector(timeout = None, **config):
+   col = {"module": "dummy", "config": {"inventory-limit": 100, **config}}
+   if timeout:
+     col["timeout"] = timeout
+   return col
+
+def run_all(tmp_path, collectors, *args, **config):
+   db = tmp_path / "inventory.db"
+   with open(tmp_path / "config.yaml", "w") as f:
+     yaml.safe_dump({"storage": {"dsn": "sqlite:///{}".format(db), **config.pop("storage", {})},
+                     "collectors": collectors, **config}, f)
+   env = {**os.environ, "PYTHONPATH": os.pathsep.join([DN + "/collectors"] + sys.path)}
+   start = time.time()
+   proc = subprocess.run([sys.executable, CLI, "-c", str(tmp_path / "config.yaml"), "--all"] + list(args),
+                         env = env, capture_output = True, text = True, timeout = 120)
+   return proc, time.time() - start, db
+
+def sources(db):
+   conn = sqlite3.connect(str(db))
+   try:
+     return {row[0]: (row[1], row[2]) for row in conn.execute("SELECT source, status, entries FROM ci_source ORDER BY id")}
+   finally:
+     conn.close()
+
+def test_queued_collector_time_limit_starts_with_collector(tmp_path):
+   # one worker, every collector waits for the previous ones, limit is per collector run
+   collectors = {name: collector(timeout = 4, records = 3, sleep = 1) for name in ["a", "b", "c"]}
+   proc, runtime, db = run_all(tmp_path, collectors, "-f", "1", process = {"timeout_grace": 0.5})
+   assert proc.returncode == 0, proc.stderr
+   assert sources(db) == {"a": ("OK", 3), "b": ("OK", 3), "c": ("OK", 3)}
+
+def test_stuck_forked_collector_is_killed(tmp_path):
+   collectors = {
+     "stuck": collector(timeout = 1, records = 30, sleep = 1, ignore_alarm = True),
+     "ok1": collector(records = 3, sleep = 1),
+     "ok2": collector(records = 1),
+   }
+   proc, runtime, db = run_all(tmp_path, collectors, "-f", "2", process = {"timeout_grace": 1})
+   assert proc.returncode == 0, proc.stderr
+   # other collectors of the broken pool run again
+   assert sources(db) == {"stuck": ("ERROR", None), "ok1": ("OK", 3), "ok2": ("OK", 1)}
+   assert runtime < 20
+
+def progress(proc):
+   # finished collectors without [count/total] and runtime
+   return sorted(line.split(" ", 1)[1].split(" in ")[0] for line in proc.stderr.splitlines() if line.startswith("["))
+
+def test_collector_of_pool_broken_by_kill_is_not_failed(tmp_path):
+   # ok runs next to stuck when its worker is killed, it is run again without counting as failed
+   collectors = {
+     "stuck": collector(timeout = 1, records = 30, sleep = 1, ignore_alarm = True),
+     "ok": collector(records = 4, sleep = 1),
+   }
+   proc, runtime, db = run_all(tmp_path, collectors, "-f", "2", "--progress", process = {"timeout_grace": 1})
+   assert proc.returncode == 0, proc.stderr
+   assert "collector name=ok stopped with broken pool, running again" in proc.stderr
+   assert progress(proc) == ["ok ok", "stuck failed (timeout)"]
+   assert sources(db) == {"stuck": ("ERROR", None), "ok": ("OK", 4)}
+
+def test_crashing_collector_is_not_run_forever(tmp_path):
+   # ok is queued behind crash on the only worker, it does not lose an attempt
+   collectors = {"crash": collector(crash = True), "ok": collector(records = 1)}
+   proc, runtime, db = run_all(tmp_path, collectors, "-f", "1", "--progress")
+   assert proc.returncode == 0, proc.stderr
+   assert proc.stderr.count("collector name=crash stopped with broken pool, running again") == 1
+   assert "collector name=crash stopped with broken pool 2 times, giving up" in proc.stderr
+   assert progress(proc) == ["crash failed (executor)", "ok ok"]
+   assert sources(db) == {"crash": ("ERROR", None), "ok": ("OK", 1)}
+
+def test_thread_collector_over_time_limit_stores_only_error(tmp_path):
+   # slow finishes (and would store) while long keeps the process running
+   collectors = {
+     "slow": collector(timeout = 1, records = 2, sleep = 1),
+     "long": collector(records = 4, sleep = 1),
+   }
+   proc, runtime, db = run_all(tmp_path, collectors, scheduler = {"workers": 4})
+   assert proc.returncode == 0, proc.stderr
+   assert "data discarded" in proc.stderr
+   assert sources(db) == {"slow": ("ERROR", None), "long": ("OK", 4)}
+
+def test_parallel_streaming_collectors(tmp_path):
+   collectors = {
+     "slow": collector(records = 3, sleep = 2),
+     "fast1": collector(records = 20, sleep = 0.05),
+     "fast2": collector(records = 20, sleep = 0.05),
+   }
+   proc, runtime, db = run_all(tmp_path, collectors, "-f", "3", storage = {"stream": True})
+   assert proc.returncode == 0, proc.stderr
+   assert sources(db) == {"slow": ("OK", 3), "fast1": ("OK", 20), "fast2": ("OK", 20)}
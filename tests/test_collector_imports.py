@@ -0,0 +1,43 @@
+import os, sys, subprocess, pkgutil
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+SDKS = ("boto3", "botocore", "azure", "google", "googleapiclient")
+
+# fails import of cloud SDKs, exits 2 when collector needs them at import time
+PROBE = """
+import sys, importlib, importlib.abc
+
+class Blocked(ImportError):
+  pass
+
+class SDKFinder(importlib.abc.MetaPathFinder):
+  def find_spec(self, name, path, target = None):
+    if name.split(".")[0] in {sdks!r}:
+      raise Blocked(name)
+
+sys.meta_path.insert(0, SDKFinder())
+try:
+  importlib.import_module({module!r})
+except Blocked as e:
+  print(e)
+  sys.exit(2)
+except ImportError as e:
+  print(e)
+  sys.exit(3)
+"""
+
+COLLECTORS = sorted(mod.name for mod in pkgutil.iter_modules([SRC])
+                      if mod.name.startswith("cloudinventario_"))
+
+@pytest.mark.parametrize("package", COLLECTORS)
+def test_collector_import_does_not_load_sdk(package):
+   module = package + ".collector"
+   env = {**os.environ, "PYTHONPATH": os.pathsep.join([SRC, os.environ.get("PYTHONPATH", "")])}
+   res = subprocess.run([sys.executable, "-c", PROBE.format(sdks = SDKS, module = module)],
+                        env = env, capture_output = True, text = True)
+   if res.returncode == 3:
+     pytest.skip("{}: {}".format(module, res.stdout.strip()))
+   assert res.returncode != 2, "{} imports {} at module level".format(module, res.stdout.strip())
+   assert res.returncode == 0, res.stderr
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+import cloudinventario.storage as storage
+from conftest import record
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.parquet as pq
+
+def test_export_types(dsn, tmp_path):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   store.save([
+     record("src", 1, tags = json.dumps({"env": "prod", "owner": "a"}),
+            networks = json.dumps([{"ip": "10.0.0.1", "mac": "aa"}])),
+     record("src", 2, tags = json.dumps([{"Key": "env", "Value": "dev"}, {"Key": "size", "Value": 2}]),
+            details = json.dumps({"other": {"nested": True}})),
+     record("src", 3),
+   ])
+
+   assert store.export(str(tmp_path / "inventory.parquet"), chunk_size = 2) == 3
+   table = pq.read_table(str(tmp_path / "inventory.parquet"))
+   schema = table.schema
+   # scalar types from storage table, even when all values are null
+   assert schema.field("cpus").type == pa.int64()
+   assert schema.field("owner").type == pa.string()
+   assert schema.field("tags").type == pa.map_(pa.string(), pa.string())
+   assert schema.field("details").type == pa.string()
+   assert pa.types.is_list(schema.field("networks").type)
+
+   rows = {row["name"]: row for row in table.to_pylist()}
+   assert dict(rows["vm1"]["tags"]) == {"env": "prod", "owner": "a"}
+   assert dict(rows["vm2"]["tags"]) == {"env": "dev", "size": "2"}
+   assert rows["vm3"]["tags"] is None
+   assert json.loads(rows["vm2"]["details"]) == {"other": {"nested": True}}
+   assert rows["vm1"]["networks"] == [{"ip": "10.0.0.1", "mac": "aa"}]
+   assert rows["vm1"]["cpus"] is None
+   store.disconnect()
+
+def test_export_arrow_version(dsn, tmp_path):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   store.save([record("src", 1), record("src", 2)])
+   store.save([record("src", 3)])
+
+   assert store.export(str(tmp_path / "src.arrow"), format = "arrow", source = "src", version = 1) == 2
+   with pa.OSFile(str(tmp_path / "src.arrow")) as f:
+     table = pa.ipc.open_file(f).read_all()
+   assert sorted(table.column("name").to_pylist()) == ["vm1", "vm2"]
+   assert table.schema.field("networks").type == pa.string()
+   store.disconnect()
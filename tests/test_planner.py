@@ -0,0 +1,42 @@
+import itertools
+
+import cloudinventario.planner as planner
+import cloudinventario.storage as storage
+from conftest import record
+
+def test_longest_first():
+   runtimes = {"a": 10, "b": 60, "c": 30, "d": 30}
+   # collectors without history first (config order), then longest first, ties keep config order
+   assert planner.plan(["a", "new1", "b", "c", "new2", "d"], runtimes, 2) == ["new1", "new2", "b", "c", "d", "a"]
+   assert planner.plan([], runtimes, 2) == []
+
+def test_makespan():
+   runtimes = {"a": 10, "b": 60, "c": 30}
+   assert planner.makespan(["a", "b", "c"], runtimes, 1) == 100
+   # a and c share a worker while b runs
+   assert planner.makespan(["a", "b", "c"], runtimes, 2) == 60
+   assert planner.makespan(["a", "c", "b"], runtimes, 2) == 70
+   assert planner.makespan(["a", "b"], runtimes, 0) == 70
+
+def test_plan_within_bound_of_optimal():
+   runtimes = {"a": 3, "b": 3, "c": 2, "d": 2, "e": 2, "f": 7, "g": 1}
+   collectors = sorted(runtimes)
+   for workers in [2, 3]:
+     optimal = min(planner.makespan(order, runtimes, workers) for order in itertools.permutations(collectors))
+     planned = planner.makespan(planner.plan(collectors, runtimes, workers), runtimes, workers)
+     assert planned <= optimal * 4 / 3
+     assert planned <= planner.makespan(collectors, runtimes, workers)
+
+def test_runtimes_median_of_recent_runs(dsn):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   for runtime in [100, 10, 20, 30, 40, 50]:
+     store.save([record("a", 1)], runtime)
+   store.save([record("b", 1)], 5)
+   store.log_status("b", storage.STATUS_ERROR, 500, "failed")
+   store.save([record("c", 1)])
+
+   # last 5 runs of a, failed run of b and runs without runtime are not counted
+   assert store.runtimes() == {"a": 30, "b": 5}
+   assert store.runtimes(["b"]) == {"b": 5}
+   store.disconnect()
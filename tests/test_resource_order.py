@@ -0,0 +1,91 @@
+import sys, time, types
+
+import pytest
+
+from cloudinventario.helpers import CloudInvetarioResourceManager, CloudInvetarioResource
+from cloudinventario_dummy.collector import DummyCollector
+
+class FakeResource(CloudInvetarioResource):
+   """Resource with given dependencies, logs start and end of its fetch"""
+   def __init__(self, res_type, collector, events, depends = (), sleep = 0, fail = False):
+     super().__init__(res_type, collector)
+     self.events = events
+     self.depends = list(depends)
+     self.sleep = sleep
+     self.fail = fail
+
+   def _get_dependencies(self):
+     return self.depends
+
+   def _fetch(self):
+     self.events.append(("start", self.res_type))
+     time.sleep(self.sleep)
+     if self.fail:
+       raise Exception("{} failed".format(self.res_type))
+     self.events.append(("end", self.res_type))
+     return [{"resource": self.res_type}]
+
+def collector(monkeypatch, resources, requested = None, dependencies = (), tasks = 4):
+   """Dummy collector with fake resource modules {name: FakeResource arguments}"""
+   events = []
+   for name, args in resources.items():
+     module = types.ModuleType("cloudinventario_dummy.resources." + name)
+     module.setup = lambda res_type, col, args = args: FakeResource(res_type, col, events, **args)
+     monkeypatch.setitem(sys.modules, module.__name__, module)
+
+   config = {"inventory-limit": 1000, "_dependencies": list(dependencies)}
+   col = DummyCollector("dummy", config, {}, {"tasks": tasks, "check_permission": False})
+   col._init(collector_pkg = "cloudinventario_dummy", resources = list(requested or resources))
+   return col, events
+
+def main_pass(events):
+   def main():
+     events.append(("start", "main"))
+     return [{"resource": "main"}]
+   return main
+
+def started_after(events, name, deps):
+   start = events.index(("start", name))
+   return all(events.index(("end", dep)) < start for dep in deps)
+
+def test_topological_levels():
+   graph = {"vm": {"disk", "network"}, "disk": set(), "network": set(), "snapshot": {"disk"}, "lb": {"vm"}}
+   assert CloudInvetarioResourceManager.topological_levels(graph) == \
+            [["disk", "network"], ["snapshot", "vm"], ["lb"]]
+
+def test_dependency_cycle():
+   graph = {"a": {"b"}, "b": {"c"}, "c": {"a"}, "d": set()}
+   with pytest.raises(Exception, match = "cycle: a -> b -> c -> a"):
+     CloudInvetarioResourceManager.topological_levels(graph)
+
+def test_resource_cycle_is_rejected(monkeypatch):
+   resources = {"vm": {"depends": ["disk"]}, "disk": {"depends": ["snapshot"]}, "snapshot": {"depends": ["vm"]}}
+   with pytest.raises(Exception, match = "cycle: disk -> snapshot -> vm -> disk"):
+     collector(monkeypatch, resources, requested = ["vm"])
+
+def test_resources_fetched_in_dependency_order(monkeypatch):
+   resources = {"disk": {"sleep": 0.1}, "network": {}, "vm": {"depends": ["disk", "network"]},
+                "lb": {"depends": ["vm"]}, "snapshot": {"depends": ["disk"], "sleep": 0.05}}
+   # dependencies of requested resources are loaded too
+   col, events = collector(monkeypatch, resources, requested = ["lb", "snapshot"], dependencies = ["vm"])
+   assert col.resource_manager.levels == [["disk", "network"], ["snapshot", "vm"], ["lb"]]
+
+   data = col._resource_fetch(main_pass(events))
+   assert started_after(events, "vm", ["disk", "network"])
+   assert started_after(events, "snapshot", ["disk"])
+   assert started_after(events, "lb", ["vm"])
+   assert started_after(events, "main", ["vm"])
+   # independent resources run in parallel
+   assert events.index(("start", "network")) < events.index(("end", "disk"))
+   assert [rec["resource"] for rec in data] == ["disk", "network", "snapshot", "vm", "lb", "main"]
+   assert len(col.resource_manager.level_times) == 3
+
+def test_failed_dependency_stops_dependents(monkeypatch):
+   resources = {"disk": {"fail": True}, "network": {"sleep": 0.1}, "vm": {"depends": ["disk", "network"]},
+                "lb": {"depends": ["vm"]}}
+   col, events = collector(monkeypatch, resources, dependencies = ["lb"])
+   with pytest.raises(Exception, match = "disk failed"):
+     col._resource_fetch(main_pass(events))
+   started = {name for event, name in events if event == "start"}
+   assert started <= {"disk", "network"}
+   assert "vm" not in started and "lb" not in started and "main" not in started
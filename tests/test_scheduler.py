@@ -0,0 +1,46 @@
+import threading, time
+
+from cloudinventario.scheduler import TaskScheduler
+
+def test_provider_limit():
+   scheduler = TaskScheduler({"workers": 4, "limits": {"slow": 1}})
+   lock = threading.Lock()
+   running, peak = {"slow": 0, "fast": 0}, {"slow": 0, "fast": 0}
+
+   def task(provider):
+     with lock:
+       running[provider] += 1
+       peak[provider] = max(peak[provider], running[provider])
+     time.sleep(0.05)
+     with lock:
+       running[provider] -= 1
+     return provider
+
+   futures = [scheduler.submit(provider, task, provider) for provider in ["slow", "fast"] * 4]
+   done, pending = scheduler.wait(futures)
+   assert not pending
+   assert sorted(future.result() for future in futures) == ["fast"] * 4 + ["slow"] * 4
+   assert peak["slow"] == 1
+   assert peak["fast"] > 1
+
+def test_nested_tasks_do_not_deadlock():
+   # every worker waits for subtasks, subtasks run on the waiting workers
+   scheduler = TaskScheduler({"workers": 2})
+   executor = scheduler.executor("aws")
+
+   def account(idx):
+     regions = [executor.submit(lambda region: (idx, region), region) for region in range(3)]
+     done, pending = executor.wait(regions)
+     return sorted(future.result() for future in done)
+
+   accounts = [executor.submit(account, idx) for idx in range(4)]
+   done, pending = scheduler.wait(accounts)
+   assert not pending
+   assert [future.result() for future in accounts] == [[(idx, region) for region in range(3)] for idx in range(4)]
+   assert scheduler.status()["done"] == 16
+
+def test_exception_is_returned_in_future():
+   scheduler = TaskScheduler({"workers": 1})
+   future = scheduler.submit("aws", lambda: 1 / 0)
+   scheduler.wait([future])
+   assert isinstance(future.exception(), ZeroDivisionError)
@@ -0,0 +1,60 @@
+import threading, time
+from datetime import datetime, timedelta, timezone
+
+import cloudinventario.sessions as sessions
+
+def setup_function():
+   sessions.clear()
+
+def test_cached_until_ttl():
+   values = iter(range(10))
+   assert sessions.cached("kind", ("key", "secret"), lambda: next(values), ttl = 0.2) == 0
+   assert sessions.cached("kind", ("key", "secret"), lambda: next(values), ttl = 0.2) == 0
+   assert sessions.cached("kind", ("other", "secret"), lambda: next(values), ttl = 0.2) == 1
+   time.sleep(0.3)
+   assert sessions.cached("kind", ("key", "secret"), lambda: next(values), ttl = 0.2) == 2
+
+def test_ttl_from_expiration_of_value():
+   # assume_role credentials: cached until margin before their Expiration
+   def assume_role():
+     created.append(datetime.now(timezone.utc) + timedelta(seconds = 10.3))
+     return {"AccessKeyId": "id{}".format(len(created)), "Expiration": created[-1]}
+
+   created = []
+   ttl = lambda creds: sessions.until(creds["Expiration"], margin = 10)
+   assert sessions.cached("role", ("key", "arn"), assume_role, ttl = ttl)["AccessKeyId"] == "id1"
+   assert sessions.cached("role", ("key", "arn"), assume_role, ttl = ttl)["AccessKeyId"] == "id1"
+   time.sleep(0.4)
+   assert sessions.cached("role", ("key", "arn"), assume_role, ttl = ttl)["AccessKeyId"] == "id2"
+
+def test_until():
+   now = time.time()
+   assert 95 <= sessions.until(now + 100, margin = 0) <= 100
+   assert 395 <= sessions.until(datetime.now(timezone.utc) + timedelta(seconds = 700)) <= 400
+   # already (nearly) expired
+   assert sessions.until(now + 60) == 0
+
+def test_expired_entries_are_evicted_on_insert():
+   for idx in range(10):
+     sessions.cached("kind", ("key", idx), object, ttl = 0.1)
+   assert sessions.stats()["entries"] == 10
+   time.sleep(0.2)
+   sessions.cached("kind", ("key", "new"), object)
+   assert sessions.stats()["entries"] == 1
+
+def test_per_thread_values_share_one_entry():
+   def worker():
+     for idx in range(3):
+       values.append(sessions.per_thread("session", ("key", "secret"), object))
+
+   values = []
+   threads = [threading.Thread(target = worker) for idx in range(20)]
+   for thread in threads:
+     thread.start()
+   for thread in threads:
+     thread.join()
+   # one value per thread, reused by its calls, one cache entry for all threads
+   assert len(set(map(id, values))) == 20
+   assert sessions.stats()["entries"] == 1
+   main = sessions.per_thread("session", ("key", "secret"), object)
+   assert sessions.per_thread("session", ("key", "secret"), object) is main
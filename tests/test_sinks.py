@@ -0,0 +1,105 @@
+import json, os
+
+import pytest
+
+import cloudinventario.storage as storage
+from cloudinventario.cloudinventario import CloudInventario
+from cloudinventario.sinks import get_sinks, SegmentLogSink
+from cloudinventario.storage_queue import StorageQueue
+from conftest import record
+
+def parquet_files(path):
+   return sorted(name for name in os.listdir(path) if name.endswith(".parquet"))
+
+def jsonl_entries(path):
+   entries = []
+   for name in sorted(os.listdir(path)):
+     if name.endswith(".jsonl"):
+       with open(os.path.join(path, name)) as f:
+         entries.extend(json.loads(line) for line in f)
+   return entries
+
+def test_parquet_sink_collects_saves_into_one_file(tmp_path):
+   pq = pytest.importorskip("pyarrow.parquet")
+   sink, = get_sinks({"sinks": [{"type": "parquet", "path": str(tmp_path), "batch": 2, "max_rows": 100}]})
+   sink.save([record("a", 1), record("a", 2)], runtime = 1)
+   sink.save({"data": [record("b", 1, cpus = 2)], "errors": [{"source": "b-sub", "status": "ERROR"}]})
+   sink.log_status("c", "FAIL")
+   assert parquet_files(tmp_path) == []
+
+   sink.flush()
+   files = parquet_files(tmp_path)
+   assert len(files) == 1
+   table = pq.read_table(str(tmp_path / files[0]))
+   assert table.num_rows == 3
+   assert table.column("cpus").to_pylist() == [None, None, "2"]
+
+   # status and commit entries are kept next to records
+   with open(tmp_path / "status.jsonl") as f:
+     entries = [json.loads(line) for line in f]
+   assert [(entry["type"], entry.get("source"), entry.get("entries")) for entry in entries] == [
+     ("commit", None, 2), ("status", "b-sub", None), ("commit", None, 1), ("status", "c", None), ("commit", None, 0)]
+
+   sink.flush()
+   assert len(parquet_files(tmp_path)) == 1
+
+def test_parquet_sink_rolls_over_at_max_rows(tmp_path):
+   pq = pytest.importorskip("pyarrow.parquet")
+   sink, = get_sinks({"sinks": [{"type": "parquet", "path": str(tmp_path), "max_rows": 5}]})
+   for idx in range(4):
+     sink.save([record("a", idx * 2), record("a", idx * 2 + 1)])
+   sink.flush()
+   files = parquet_files(tmp_path)
+   assert [pq.read_metadata(str(tmp_path / name)).num_rows for name in files] == [6, 2]
+
+def test_log_sink_read_from_offset(tmp_path):
+   sink = SegmentLogSink({"path": str(tmp_path), "index_interval": 2, "segment_bytes": 200})
+   sink.save([record("a", idx) for idx in range(5)])
+   sink.save([record("b", 1)])
+   entries = list(sink.read())
+   assert [entry["type"] for offset, entry in entries] == ["record"] * 5 + ["commit", "record", "commit"]
+   assert len(sink.segments()) > 1
+   assert list(sink.read(6)) == entries[6:]
+
+def test_streamed_collection_reaches_sinks(tmp_path, dsn):
+   pq = pytest.importorskip("pyarrow.parquet")
+   sinks = [{"type": "jsonl", "path": str(tmp_path / "jsonl")}, {"type": "parquet", "path": str(tmp_path / "parquet")}]
+   cinv = CloudInventario({"collectors": {"d": {"module": "dummy", "config": {"inventory-limit": 100, "records": 3}}},
+                           "storage": {"dsn": dsn, "stream": True, "sinks": sinks}})
+   assert cinv.collectStore("d", {}) == 3
+   cinv.store_status("e", storage.STATUS_FAIL)
+
+   entries = jsonl_entries(tmp_path / "jsonl")
+   assert [entry["type"] for entry in entries] == ["record"] * 3 + ["commit", "status", "commit"]
+   assert [entry["data"]["uniqueid"] for entry in entries[:3]] == ["u0", "u1", "u2"]
+   # records as collected, not as changed by storage writer
+   assert "period" not in entries[0]["data"]
+   assert entries[3]["entries"] == 3 and entries[3]["runtime"] is not None
+   assert entries[4]["source"] == "e"
+
+   cinv.flushSinks()
+   files = parquet_files(tmp_path / "parquet")
+   assert [pq.read_metadata(str(tmp_path / "parquet" / name)).num_rows for name in files] == [3]
+
+def test_aborted_streamed_collection_skips_sinks(tmp_path, dsn):
+   cinv = CloudInventario({"collectors": {"d": {"module": "dummy", "config": {"inventory-limit": 100}}},
+                           "storage": {"dsn": dsn, "stream": True, "sinks": [{"type": "jsonl", "path": str(tmp_path)}]}})
+   assert cinv.collectStore("d", {}, claim = lambda: False) is None
+   assert jsonl_entries(tmp_path) == []
+
+def test_storage_queue_writes_sinks(tmp_path, dsn):
+   pq = pytest.importorskip("pyarrow.parquet")
+   sinks = [{"type": "parquet", "path": str(tmp_path)}]
+   writer = StorageQueue({"dsn": dsn, "sinks": sinks})
+   writer.start()
+   writer.put_inventory([record("a", 1), record("a", 2)], runtime = 1)
+   writer.put_status("b", storage.STATUS_ERROR)
+   writer.join()
+   assert parquet_files(tmp_path) == []
+
+   # stop flushes sinks
+   writer.stop()
+   files = parquet_files(tmp_path)
+   assert [pq.read_metadata(str(tmp_path / name)).num_rows for name in files] == [2]
+   with open(tmp_path / "status.jsonl") as f:
+     assert [json.loads(line)["type"] for line in f] == ["commit", "status", "commit"]
@@ -0,0 +1,86 @@
+import os, fcntl
+
+import sqlalchemy as sa
+
+import cloudinventario.storage as storage
+from cloudinventario.cloudinventario import CloudInventario
+from cloudinventario.spool import InventorySpool
+from conftest import record
+
+def sources(store):
+   return {row["source"]: (row["version"], row["status"], row["entries"]) for row in
+           store.conn.execute(sa.select([store.source_table]).order_by(store.source_table.c.id))}
+
+def test_spool_replays_after_outage(tmp_path, dsn):
+   spool = InventorySpool({"path": str(tmp_path / "spool"), "fsync": False, "chunk_size": 2})
+   spool.write([record("a", 1), record("a", 2), record("a", 3)], runtime = 2)
+   spool.write({"data": [], "errors": [{"source": "b", "status": storage.STATUS_ERROR, "error": "boom"}]})
+
+   # database unavailable, segments stay spooled
+   missing = storage.InventoryStorage({"dsn": "sqlite:///{}".format(tmp_path / "missing" / "inventory.db")})
+   assert spool.replay(missing) == 0
+   assert len(spool.segments()) == 2
+
+   store = storage.InventoryStorage({"dsn": dsn})
+   assert spool.replay(store) == 2
+   assert spool.segments() == []
+   store.connect()
+   assert sources(store) == {"a": (1, storage.STATUS_OK, 3), "b": (1, storage.STATUS_ERROR, None)}
+   store.disconnect()
+
+def test_replayed_segment_is_not_stored_twice(tmp_path, dsn):
+   spool = InventorySpool({"path": str(tmp_path / "spool"), "fsync": False})
+   segment_id = spool.write([record("a", 1)])
+   # stored, but removing the segment failed: keep a copy and put it back
+   with open(os.path.join(spool.path, segment_id + ".jsonl")) as f:
+     content = f.read()
+   store = storage.InventoryStorage({"dsn": dsn})
+   assert spool.replay(store) == 1
+   with open(os.path.join(spool.path, segment_id + ".jsonl"), "w") as f:
+     f.write(content)
+
+   assert spool.replay(store) == 0
+   assert spool.segments() == []
+   store.connect()
+   assert sources(store) == {"a": (1, storage.STATUS_OK, 1)}
+   store.disconnect()
+
+def test_store_goes_through_spool(tmp_path, dsn):
+   cinv = CloudInventario({"storage": {"dsn": dsn, "spool": {"path": str(tmp_path / "spool"), "fsync": False}}})
+   cinv.store([record("a", 1)], runtime = 1)
+   assert cinv.getSpool().segments() == []
+   store = cinv.getStorage()
+   store.connect()
+   assert sources(store) == {"a": (1, storage.STATUS_OK, 1)}
+   store.disconnect()
+
+def test_segment_written_during_replay_is_replayed(tmp_path, dsn):
+   spool = InventorySpool({"path": str(tmp_path / "spool"), "fsync": False})
+   spool.write([record("a", 1)])
+   store = storage.InventoryStorage({"dsn": dsn})
+   connect, written = store.connect, []
+
+   def connect_and_spool():
+     # other collector spools while the first segment is replayed
+     connect()
+     if not written:
+       written.append(spool.write([record("b", 1)]))
+   store.connect = connect_and_spool
+
+   assert spool.replay(store) == 2
+   assert spool.segments() == []
+   store.connect = connect
+   store.connect()
+   assert sources(store) == {"a": (1, storage.STATUS_OK, 1), "b": (1, storage.STATUS_OK, 1)}
+   store.disconnect()
+
+def test_replay_locked_by_other_replayer(tmp_path, dsn):
+   spool = InventorySpool({"path": str(tmp_path / "spool"), "fsync": False})
+   spool.write([record("a", 1)])
+   store = storage.InventoryStorage({"dsn": dsn})
+   with open(os.path.join(spool.path, ".lock"), "w") as lock:
+     fcntl.flock(lock, fcntl.LOCK_EX)
+     assert spool.replay(store) == 0
+   assert len(spool.segments()) == 1
+   assert spool.replay(store) == 1
+   assert spool.segments() == []
@@ -0,0 +1,90 @@
+from sqlalchemy.dialects.postgresql import psycopg2
+from sqlalchemy.dialects.mysql import pymysql
+
+import cloudinventario.storage as storage
+from conftest import record
+
+class FakeCursor:
+   def __init__(self):
+     self.copies = []
+
+   def copy_expert(self, sql, buf):
+     self.copies.append((sql, buf.read()))
+
+   def close(self):
+     pass
+
+class FakeConnection:
+   """Records statements instead of executing them"""
+   def __init__(self, dialect):
+     self.dialect = dialect
+     self.dbapi_cursor = FakeCursor()
+     self.connection = self
+     self.statements = []
+
+   def cursor(self):
+     return self.dbapi_cursor
+
+   def execute(self, statement, *params):
+     self.statements.append(statement)
+
+def inventory(dsn, config = None):
+   store = storage.InventoryStorage({"dsn": dsn, **(config or {})})
+   store.connect()
+   return store
+
+def test_copy_value_escaping():
+   copy_value = storage.InventoryStorage._InventoryStorage__copy_value
+   assert copy_value(None) == "\\N"
+   assert copy_value(42) == "42"
+   assert copy_value("a\tb\nc\rd") == "a\\tb\\nc\\rd"
+   assert copy_value("C:\\tmp\\N") == "C:\\\\tmp\\\\N"
+   assert copy_value(b"\x00\xff") == "\\\\x00ff"
+
+def test_copy_insert(dsn):
+   store = inventory(dsn, {"bulk": {"chunk_size": 2}})
+   conn = FakeConnection(psycopg2.dialect())
+   rows = [record("src", idx, extra = "not a column") for idx in range(5)]
+   rows[1]["name"] = "tab\there"
+   del rows[2]["name"]
+   assert store.bulk_insert(conn, store.inventory_table, rows) == 5
+
+   # one COPY per chunk
+   assert len(conn.dbapi_cursor.copies) == 3
+   sql, data = conn.dbapi_cursor.copies[0]
+   assert sql.startswith("COPY ci_inventory (")
+   columns = sql[sql.index("(") + 1:sql.index(")")].split(", ")
+   assert "id" not in columns and "extra" not in columns
+   lines = "".join(data for sql, data in conn.dbapi_cursor.copies).splitlines()
+   assert len(lines) == 5
+   values = [dict(zip(columns, line.split("\t"))) for line in lines]
+   assert [value["uniqueid"] for value in values] == ["u0", "u1", "u2", "u3", "u4"]
+   assert values[1]["name"] == "tab\\there"
+   assert values[2]["name"] == "\\N"
+   store.disconnect()
+
+def test_values_chunk_capped_by_parameter_limit(dsn, monkeypatch):
+   monkeypatch.setitem(storage.BIND_PARAM_LIMITS, "mysql", 100)
+   store = inventory(dsn, {"bulk": {"chunk_size": 1000}})
+   dialect = pymysql.dialect()
+   conn = FakeConnection(dialect)
+   rows = [record("src", idx) for idx in range(20)]
+   assert store.bulk_insert(conn, store.inventory_table, rows) == 20
+
+   columns = len(store.inventory_table.columns) - 1
+   assert len(conn.statements) == -(-20 // (100 // columns))
+   for statement in conn.statements:
+     assert len(statement.compile(dialect = dialect).positiontup) <= 100
+   store.disconnect()
+
+def test_sqlite_chunks_with_differing_columns(dsn):
+   store = inventory(dsn, {"bulk": {"chunk_size": 3}})
+   rows = [record("src", idx) for idx in range(7)]
+   rows[1]["extra"] = "not a column"
+   del rows[4]["details"]
+   store.save(rows)
+   stored = {row["uniqueid"]: row for row in store.query(source = "src")}
+   assert sorted(stored) == ["u{}".format(idx) for idx in range(7)]
+   assert stored["u1"]["details"] == '{"idx": 1}'
+   assert stored["u4"]["details"] is None
+   store.disconnect()
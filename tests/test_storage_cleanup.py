@@ -0,0 +1,48 @@
+import logging
+
+import sqlalchemy as sa
+
+import cloudinventario.storage as storage
+from conftest import record
+
+def inventory(dsn, config = None):
+   store = storage.InventoryStorage({"dsn": dsn, **(config or {})})
+   store.connect()
+   return store
+
+def expire(store, source, versions):
+   table = store.source_table
+   with store.begin() as conn:
+     conn.execute(table.update().where((table.c.source == source) & table.c.version.in_(versions))
+                    .values(ts = "2020-01-01 00:00:00"))
+
+def versions(store):
+   table = store.source_table
+   return [tuple(row) for row in store.conn.execute(sa.select([table.c.source, table.c.version])
+                                                      .order_by(table.c.source, table.c.version))]
+
+def test_cleanup_in_batches(dsn, caplog):
+   store = inventory(dsn, {"cleanup_batch": 3})
+   for version in range(4):
+     store.save([record("a", version), record("a", version + 10)])
+   for version in range(3):
+     store.save([record("b", version)])
+   expire(store, "a", [1, 2, 3])
+   expire(store, "b", [1, 2, 3])
+
+   with caplog.at_level(logging.INFO):
+     assert store.cleanup(30) == {"versions": 6, "rows": 9, "blobs": 0}
+   batches = [rec.getMessage() for rec in caplog.records if rec.getMessage().startswith("prune: ") and "/" in rec.getMessage()]
+   assert batches == ["prune: 3/6 source versions, 6 rows deleted", "prune: 6/6 source versions, 9 rows deleted"]
+
+   assert versions(store) == [("a", 4)]
+   assert sorted(row["uniqueid"] for row in store.query(source = "a")) == ["u13", "u3"]
+   assert list(store.query(source = "b")) == []
+   store.disconnect()
+
+def test_cleanup_without_expired_versions(dsn):
+   store = inventory(dsn, {"cleanup_batch": 1})
+   store.save([record("a", 1)])
+   assert store.cleanup(30) == {"versions": 0, "rows": 0, "blobs": 0}
+   assert versions(store) == [("a", 1)]
+   store.disconnect()
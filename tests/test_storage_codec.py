@@ -0,0 +1,50 @@
+import json
+
+import sqlalchemy as sa
+
+import cloudinventario.storage as storage
+import cloudinventario.codec as codec
+from conftest import record
+
+def test_compressed_columns(dsn):
+   store = storage.InventoryStorage({"dsn": dsn, "codec": "zlib"})
+   store.connect()
+   details = json.dumps({"key": "value " * 50})
+   store.save([record("a", 1, details = details, tags = json.dumps({"env": "prod"}))])
+
+   raw = store.conn.execute(sa.text("SELECT details, tags FROM ci_inventory")).fetchone()
+   assert raw[0].startswith(codec.MARKER + "zlib.")
+   assert len(raw[0]) < len(details)
+   row = next(store.query())
+   assert row["details"] == details
+   assert json.loads(row["tags"]) == {"env": "prod"}
+   store.disconnect()
+
+def test_plain_rows_readable_with_codec(dsn):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   store.save([record("a", 1)])
+   store.disconnect()
+
+   store = storage.InventoryStorage({"dsn": dsn, "codec": {"type": "zlib", "dictionary": False}})
+   store.connect()
+   store.save([record("b", 1)])
+   assert sorted(row["details"] for row in store.query()) == ['{"idx": 1}', '{"idx": 1}']
+   store.disconnect()
+
+def test_plain_values_resembling_header(dsn):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   values = ["~weird:tag", "~zlib.:eJwrzs8tyM9LBQA=", codec.MARKER + "zlib.:not base64!",
+             codec.MARKER + "zlib.:eJwrLinKzEsHAAlCApg=", codec.MARKER + "gzip.:x"]
+   store.save([record("a", idx, tags = value) for idx, value in enumerate(values)])
+   stored = {row["uniqueid"]: row["tags"] for row in store.query()}
+   # only well formed header with decodable data is decoded
+   assert stored["u0"] == "~weird:tag"
+   assert stored["u1"] == "~zlib.:eJwrzs8tyM9LBQA="
+   assert stored["u2"] == codec.MARKER + "zlib.:not base64!"
+   assert stored["u3"] == "string"
+   assert stored["u4"] == codec.MARKER + "gzip.:x"
+   assert codec.decode(b"~weird:bytes") == b"~weird:bytes"
+   assert codec.decode(codec.MARKER.encode() + b"zlib.:\x00") == codec.MARKER.encode() + b"zlib.:\x00"
+   store.disconnect()
@@ -0,0 +1,25 @@
+import json
+
+import sqlalchemy as sa
+
+import cloudinventario.storage as storage
+from conftest import record
+
+def count(store, table):
+   return store.conn.execute(sa.select([sa.func.count()]).select_from(table)).scalar()
+
+def test_details_stored_once(dsn):
+   store = storage.InventoryStorage({"dsn": dsn, "dedup": True})
+   store.connect()
+   details = json.dumps({"same": "x" * 100})
+   store.save([record("a", 1, details = details), record("a", 2, details = details)])
+   store.save([record("b", 1, details = details)])
+
+   assert count(store, store.blob_table) == 1
+   assert [row["details"] for row in store.query()] == [details] * 3
+   assert store.conn.execute(sa.select([store.inventory_table.c.details])).fetchall() == [(None,)] * 3
+
+   # blobs of pruned versions go away
+   assert store.cleanup(0)["blobs"] == 1
+   assert count(store, store.blob_table) == 0
+   store.disconnect()
@@ -0,0 +1,52 @@
+import sqlalchemy as sa
+
+import cloudinventario.storage as storage
+from conftest import record
+
+def rows(store, table = "inventory"):
+   table = store.TABLES[table]
+   return store.conn.execute(sa.select([sa.func.count()]).select_from(table)).scalar()
+
+def names(store, source, version = None):
+   return sorted(row["name"] for row in store.conn.execute(store.select_version(source, version)))
+
+def test_delta_versions(dsn):
+   store = storage.InventoryStorage({"dsn": dsn, "delta": True})
+   store.connect()
+   store.save([record("src", 1), record("src", 2)])
+   store.save([record("src", 1), record("src", 3)])
+   store.save([record("src", 1), record("src", 3)])
+
+   # unchanged vm1 is stored once, removed vm2 is closed
+   assert rows(store) == 3
+   assert names(store, "src", 1) == ["vm1", "vm2"]
+   assert names(store, "src", 2) == ["vm1", "vm3"]
+   assert names(store, "src") == ["vm1", "vm3"]
+   store.disconnect()
+
+def test_cleanup_removes_open_rows_of_pruned_source(dsn):
+   store = storage.InventoryStorage({"dsn": dsn, "delta": True})
+   store.connect()
+   store.save([record("src", 1), record("src", 2)])
+   store.save([record("src", 1), record("src", 3)])
+
+   result = store.cleanup(0)
+   assert result["versions"] == 2
+   # no version of src is left, neither are its rows
+   assert rows(store) == 0
+   assert list(store.query()) == []
+   store.disconnect()
+
+def test_cleanup_keeps_open_rows_of_remaining_versions(dsn):
+   store = storage.InventoryStorage({"dsn": dsn, "delta": True})
+   store.connect()
+   store.save([record("src", 1), record("src", 2)])
+   store.save([record("src", 1), record("src", 3)])
+   store.conn.execute(store.source_table.update().where(store.source_table.c.version == 1)
+                        .values(ts = "2000-01-01 00:00:00"))
+
+   assert store.cleanup(1)["versions"] == 1
+   # vm1 was written by pruned version 1 and is still valid in version 2
+   assert names(store, "src") == ["vm1", "vm3"]
+   assert rows(store) == 2
+   store.disconnect()
@@ -0,0 +1,63 @@
+import multiprocessing
+
+import sqlalchemy as sa
+
+import cloudinventario.storage as storage
+from conftest import record
+
+def test_engine_shared_per_dsn(dsn, tmp_path):
+   engine, stats = storage.get_engine({"dsn": dsn})
+   assert storage.get_engine({"dsn": dsn}) == (engine, stats)
+   assert storage.get_engine({"dsn": "sqlite:///{}".format(tmp_path / "other.db")})[0] is not engine
+
+   first = storage.InventoryStorage({"dsn": dsn})
+   first.connect()
+   second = storage.InventoryStorage({"dsn": dsn})
+   second.connect()
+   assert first.engine is second.engine
+   assert stats.as_dict()["checkouts"] >= 2
+   first.disconnect()
+   second.disconnect()
+
+def check_child_engine(dsn, inherited):
+   # fork hook dropped inherited engines before anything runs in the child
+   assert storage._ENGINES == {}
+   engine, stats = storage.get_engine({"dsn": dsn})
+   assert engine is not inherited
+   assert stats.as_dict()["connects"] == 0
+
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   store.save([record("child", 1)])
+   store.disconnect()
+   assert stats.as_dict()["connects"] >= 1
+
+def test_forked_child_gets_own_engine(dsn):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   proc = multiprocessing.get_context("fork").Process(target = check_child_engine, args = (dsn, store.engine))
+   proc.start()
+   proc.join(30)
+   assert proc.exitcode == 0
+
+   # parent pool is intact
+   assert storage.get_engine({"dsn": dsn})[0] is store.engine
+   assert [row["name"] for row in store.query(source = "child")] == ["vm1"]
+   store.disconnect()
+
+def test_engines_reset_on_pid_change(dsn, monkeypatch):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   disposed = []
+   dispose = store.engine.dispose
+   monkeypatch.setattr(store.engine, "dispose", lambda **kwargs: disposed.append(kwargs) or dispose(**kwargs))
+
+   # fork without at-fork hooks, noticed on next get_engine()
+   monkeypatch.setattr(storage, "_ENGINES_PID", -1)
+   engine, stats = storage.get_engine({"dsn": dsn})
+   assert engine is not store.engine
+   assert disposed == [{"close": False}]
+
+   # connection checked out before the reset keeps working
+   assert store.conn.execute(sa.select([sa.func.count()]).select_from(store.source_table)).scalar() == 0
+   store.disconnect()
@@ -0,0 +1,116 @@
+import sqlite3
+
+import pytest
+
+import sqlalchemy as sa
+
+import cloudinventario.storage as storage
+from conftest import DN, record
+
+def create_v0(path):
+   with open(DN + "/data/schema_v0.sql") as f:
+     schema = f.read()
+   conn = sqlite3.connect(path)
+   conn.executescript(schema)
+   conn.execute("INSERT INTO ci_source (ts, source, version, entries, status) VALUES ('2020-01-01 00:00:00', 'old', 1, 1, 'OK')")
+   conn.execute("INSERT INTO ci_inventory (source_id, source_name, source_version, inventory_type, uniqueid, name) "
+                "VALUES (1, 'old', 1, 'vm', 'u1', 'vm1')")
+   conn.commit()
+   conn.close()
+
+DATA_TABLES = ["ci_inventory", "ci_dns_domain", "ci_dns_record", "ci_usage_cost"]
+
+# what every schema version added to the previous one, tables and indexes by
+# name, columns as (table, column); DDL is taken from a freshly created schema
+SCHEMA_CHANGES = {
+   1: ["ci_schema"],
+   2: ["ci_source_ts_idx"] + [table + "_source_idx" for table in DATA_TABLES],
+   3: [("ci_inventory", "period")],
+   4: ["ci_blob"] + [(table, column) for table in DATA_TABLES for column in ["attributes_hash", "details_hash"]],
+   5: [(table, column) for table in DATA_TABLES for column in ["fingerprint", "version_to"]]
+        + [table + "_delta_idx" for table in DATA_TABLES],
+   6: ["ci_codec"],
+   7: ["ci_inventory_current", "ci_inventory_current_source_idx", "ci_inventory_current_uniqueid_idx"],
+   8: ["ci_inventory_uniqueid_idx", "ci_inventory_ip_idx", "ci_inventory_name_idx",
+       "ci_inventory_current_ip_idx", "ci_inventory_current_name_idx", "ci_inventory_current_type_idx"],
+   9: ["ci_spool"],
+}
+
+def create_version(path, reference, version):
+   create_v0(path)
+   conn = sqlite3.connect(path)
+   for ver in range(1, version + 1):
+     for change in SCHEMA_CHANGES[ver]:
+       if isinstance(change, tuple):
+         table, column = change
+         types = {row[1]: row[2] for row in reference.execute("PRAGMA table_info({})".format(table))}
+         conn.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, column, types[column]))
+       else:
+         conn.execute(reference.execute("SELECT sql FROM sqlite_master WHERE name = ?", (change,)).fetchone()[0])
+   if version >= 7:
+     columns = "source_id, source_name, source_version, inventory_type, uniqueid, name"
+     conn.execute("INSERT INTO ci_inventory_current ({0}) SELECT {0} FROM ci_inventory".format(columns))
+   if version >= 1:
+     conn.execute("INSERT INTO ci_schema (version) VALUES (?)", (version,))
+   conn.commit()
+   conn.close()
+
+def schema(conn):
+   objects = conn.execute("SELECT type, name, tbl_name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'").fetchall()
+   columns = {name: {row[1] for row in conn.execute("PRAGMA table_info({})".format(name))}
+                for type, name, table in objects if type == "table"}
+   return set(objects), columns
+
+def test_schema_changes_cover_all_versions():
+   assert sorted(SCHEMA_CHANGES) == list(range(1, storage.SCHEMA_VERSION + 1))
+
+@pytest.mark.parametrize("version", range(storage.SCHEMA_VERSION))
+def test_upgrade_from_version(dsn, tmp_path, version):
+   fresh = storage.InventoryStorage({"dsn": "sqlite:///{}".format(tmp_path / "fresh.db")})
+   fresh.connect()
+   fresh.disconnect()
+   reference = sqlite3.connect(str(tmp_path / "fresh.db"))
+   create_version(str(tmp_path / "inventory.db"), reference, version)
+
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   assert store.conn.execute(sa.select([store.schema_table.c.version])).fetchall() == [(storage.SCHEMA_VERSION,)]
+   upgraded = sqlite3.connect(str(tmp_path / "inventory.db"))
+   assert schema(upgraded) == schema(reference)
+   upgraded.close()
+   reference.close()
+
+   # rows of old version are still the latest inventory of their source
+   assert [row["name"] for row in store.query(source = "old")] == ["vm1"]
+   store.save([record("old", 2)])
+   assert [row["name"] for row in store.query(source = "old")] == ["vm2"]
+   store.disconnect()
+
+def test_upgrade_from_v0(dsn, tmp_path):
+   create_v0(str(tmp_path / "inventory.db"))
+
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   assert store.conn.execute(sa.select([sa.func.max(store.schema_table.c.version)])).scalar() == storage.SCHEMA_VERSION
+
+   columns = {column["name"] for column in sa.inspect(store.conn).get_columns("ci_inventory")}
+   assert {"period", "details_hash", "fingerprint", "version_to"} <= columns
+   indexes = {index["name"] for index in sa.inspect(store.conn).get_indexes("ci_inventory")}
+   assert {"ci_inventory_source_idx", "ci_inventory_delta_idx", "ci_inventory_uniqueid_idx"} <= indexes
+
+   # existing rows are readable, new ones are written next to them
+   assert [row["name"] for row in store.conn.execute(store.select_version("old", 1))] == ["vm1"]
+   store.save([record("old", 2)])
+   assert [row["name"] for row in store.query(source="old")] == ["vm2"]
+   store.disconnect()
+
+def test_upgrade_is_recorded(dsn, tmp_path):
+   create_v0(str(tmp_path / "inventory.db"))
+   storage.InventoryStorage({"dsn": dsn}).connect()
+
+   # next process sees current version and does not migrate again
+   storage._SCHEMAS_VERIFIED.clear()
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   assert store.conn.execute(sa.select([store.schema_table.c.version])).fetchall() == [(storage.SCHEMA_VERSION,)]
+   store.disconnect()
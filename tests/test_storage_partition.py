@@ -0,0 +1,118 @@
+from datetime import date, datetime, timedelta
+
+import sqlalchemy as sa
+
+import cloudinventario.storage as storage
+from conftest import record
+
+class FakeConnection:
+   """Records statements instead of executing them"""
+   def __init__(self):
+     self.statements = []
+
+   def execute(self, statement, *params):
+     self.statements.append(str(statement))
+
+def partitioned(dsn, period = "day"):
+   store = storage.InventoryStorage({"dsn": dsn, "partition": period})
+   store.connect()
+   return store
+
+def kinds(store):
+   res = store.conn.execute(sa.text("SELECT name, type FROM sqlite_master WHERE name LIKE 'ci_inventory%' AND type IN ('table', 'view')"))
+   return {row[0]: row[1] for row in res}
+
+def rows(store):
+   return store.conn.execute(sa.text("SELECT source_name, uniqueid, period FROM ci_inventory ORDER BY uniqueid")).fetchall()
+
+def test_period_bounds(dsn):
+   store = partitioned(dsn, "week")
+   # sunday belongs to week starting on monday
+   start = store.partitions.start(datetime(2026, 10, 18, 23, 59))
+   assert start == date(2026, 10, 12)
+   assert store.partitions.end(start) == date(2026, 10, 19)
+   assert store.partitions.name(start) == "ci_inventory_p20261012"
+   store.disconnect()
+
+def test_postgresql_range_partitions(monkeypatch):
+   engine = sa.create_mock_engine("postgresql://localhost/ci", lambda sql, *args, **kwargs: None)
+   monkeypatch.setattr(storage, "get_engine", lambda config: (engine, storage.PoolStats()))
+   monkeypatch.setattr(storage, "_SCHEMAS", {})
+   store = storage.InventoryStorage({"dsn": "postgresql://localhost/ci", "partition": "day"})
+   store._InventoryStorage__define_schema()
+
+   ddl = str(sa.schema.CreateTable(store.inventory_table).compile(dialect = engine.dialect))
+   assert ddl.rstrip().endswith("PARTITION BY RANGE (period)")
+   # partition key is part of primary and unique keys
+   assert "PRIMARY KEY (id, period)" in ddl
+   assert "uniqueid, period)" in ddl
+
+   conn = FakeConnection()
+   assert store.partitions.ensure(conn, datetime(2026, 10, 18, 12)) is store.inventory_table
+   assert conn.statements == ["CREATE TABLE IF NOT EXISTS ci_inventory_p20261018 PARTITION OF ci_inventory"
+                              " FOR VALUES FROM ('2026-10-18') TO ('2026-10-19')"]
+   # known partition is not created again
+   store.partitions.ensure(conn, datetime(2026, 10, 18, 20))
+   assert len(conn.statements) == 1
+
+def test_sqlite_table_per_period_and_view(dsn):
+   store = partitioned(dsn)
+   today = store.partitions.start()
+   current = store.partitions.name(today)
+   store.save([record("a", 1), record("a", 2)])
+
+   assert kinds(store) == {"ci_inventory": "view", current: "table", "ci_inventory_current": "table",
+                           "ci_inventory_full": "view", "ci_inventory_current_full": "view"}
+   assert store.partitions.list(store.conn) == [(current, today)]
+   assert [tuple(row) for row in rows(store)] == [("a", "u1", today.isoformat()), ("a", "u2", today.isoformat())]
+
+   # older partition joins the view
+   with store.begin() as conn:
+     table = store.partitions.ensure(conn, datetime(2020, 1, 1))
+     conn.execute(table.insert(), {**record("old", 3), "source_version": 1, "period": "2020-01-01"})
+   assert [name for name, start in store.partitions.list(store.conn)] == ["ci_inventory_p20200101", current]
+   assert [row["uniqueid"] for row in rows(store)] == ["u1", "u2", "u3"]
+   store.disconnect()
+
+def test_writer_appends_to_current_partition(dsn):
+   store = partitioned(dsn)
+   with store.writer() as writer:
+     writer.append([record("a", 1)])
+     writer.append([record("b", 1)])
+   writer = store.writer(incremental = True)
+   writer.append([record("a", 2)])
+   writer.commit()
+
+   current = store.partitions.name(store.partitions.start())
+   res = store.conn.execute(sa.text("SELECT source_name, source_version, uniqueid FROM {} ORDER BY id".format(current)))
+   assert [tuple(row) for row in res] == [("a", 1, "u1"), ("b", 1, "u1"), ("a", 2, "u2")]
+   assert sorted(row["uniqueid"] for row in store.query(source = "a")) == ["u2"]
+   store.disconnect()
+
+def test_drop_expired_partitions(dsn):
+   store = partitioned(dsn)
+   today = store.partitions.start()
+   with store.begin() as conn:
+     for days in [10, 3, 2]:
+       store.partitions.ensure(conn, datetime.utcnow() - timedelta(days = days))
+
+   with store.begin() as conn:
+     dropped = store.partitions.drop(conn, today - timedelta(days = 2))
+   # partition of 2 days ago ends 1 day ago, after the expiry date
+   assert dropped == [store.partitions.name(today - timedelta(days = 10)),
+                      store.partitions.name(today - timedelta(days = 3))]
+   assert [start for name, start in store.partitions.list(store.conn)] == [today - timedelta(days = 2), today]
+   assert kinds(store)["ci_inventory"] == "view"
+   store.disconnect()
+
+def test_cleanup_keeps_rows_of_unexpired_partition(dsn):
+   store = partitioned(dsn)
+   store.save([record("a", 1)])
+   store.save([record("a", 1), record("a", 2)])
+   store.cleanup(0)
+
+   # expired versions are pruned from ci_source, their rows stay until whole partition expires
+   assert store.conn.execute(sa.select([sa.func.count()]).select_from(store.source_table)).scalar() == 0
+   assert [row["uniqueid"] for row in rows(store)] == ["u1", "u1", "u2"]
+   assert len(store.partitions.list(store.conn)) == 1
+   store.disconnect()
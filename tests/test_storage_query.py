@@ -0,0 +1,88 @@
+import pytest
+import sqlalchemy as sa
+
+import cloudinventario.storage as storage
+from conftest import record
+
+def inventory(dsn, config = None):
+   store = storage.InventoryStorage({"dsn": dsn, **(config or {})})
+   store.connect()
+   return store
+
+def current(store, source = None):
+   table = store.inventory_current
+   query = sa.select([table.c.source_name, table.c.source_version, table.c.uniqueid]).order_by(table.c.source_name, table.c.uniqueid)
+   if source is not None:
+     query = query.where(table.c.source_name == source)
+   return [tuple(row) for row in store.conn.execute(query)]
+
+def test_query_paging(dsn):
+   store = inventory(dsn, {"query_chunk_size": 2})
+   store.save([record("a", idx) for idx in range(7)])
+
+   pages = []
+   after = None
+   while True:
+     page = list(store.query(source = "a", limit = 3, after = after))
+     if not page:
+       break
+     pages.append([row["uniqueid"] for row in page])
+     after = page[-1]["id"]
+   assert pages == [["u0", "u1", "u2"], ["u3", "u4", "u5"], ["u6"]]
+   store.disconnect()
+
+def test_query_filters(dsn):
+   store = inventory(dsn)
+   store.save([record("a", 1, primary_ip = "10.0.0.1", project = "p1"),
+               record("a", 2, primary_ip = "10.0.0.2", project = "p1"),
+               record("a", 3, primary_ip = "10.0.0.3", project = "p2")])
+   store.save([record("b", 1, primary_ip = "10.0.0.1", project = "p1")])
+
+   assert [(row["source_name"], row["name"]) for row in store.query(primary_ip = "10.0.0.1")] == [("a", "vm1"), ("b", "vm1")]
+   assert [row["name"] for row in store.query(source = "a", project = "p1")] == ["vm1", "vm2"]
+   assert [row["name"] for row in store.query(source = "a", name = ["vm1", "vm3"])] == ["vm1", "vm3"]
+   assert list(store.query(source = "a", project = "p3")) == []
+
+   with pytest.raises(Exception, match = "Unknown query filter 'memory'"):
+     list(store.query(memory = 1))
+   with pytest.raises(Exception, match = "requires source"):
+     list(store.query(version = 1))
+   store.disconnect()
+
+def test_query_of_older_version(dsn):
+   store = inventory(dsn)
+   store.save([record("a", 1), record("a", 2)])
+   store.save([record("a", 3)])
+
+   assert [row["name"] for row in store.query(source = "a")] == ["vm3"]
+   assert [row["name"] for row in store.query(source = "a", version = 1)] == ["vm1", "vm2"]
+   assert [row["name"] for row in store.query(source = "a", version = 1, name = "vm2")] == ["vm2"]
+   store.disconnect()
+
+def test_current_holds_latest_version_of_every_source(dsn):
+   store = inventory(dsn)
+   store.save([record("a", 1), record("a", 2)])
+   store.save([record("b", 1)])
+   store.save([record("a", 3)])
+   assert current(store) == [("a", 2, "u3"), ("b", 1, "u1")]
+
+   # older version does not replace newer one written meanwhile
+   with store.begin() as conn:
+     assert not store.update_current(conn, "a", 1)
+   assert current(store, "a") == [("a", 2, "u3")]
+
+   # rebuilt from history
+   with store.begin() as conn:
+     conn.execute(store.inventory_current.delete())
+     assert store.update_current(conn, "a")
+   assert current(store) == [("a", 2, "u3")]
+   store.disconnect()
+
+def test_current_of_source_without_versions(dsn):
+   store = inventory(dsn)
+   store.save([record("a", 1)])
+   with store.begin() as conn:
+     conn.execute(store.source_table.delete().where(store.source_table.c.source == "a"))
+     assert store.update_current(conn, "a")
+   assert current(store) == []
+   store.disconnect()
@@ -0,0 +1,93 @@
+import os, queue
+
+import pytest
+import sqlalchemy as sa
+
+import cloudinventario.storage as storage
+from cloudinventario.storage_queue import StorageQueue
+from conftest import record
+
+def versions(dsn):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   try:
+     return {row["source"]: (row["status"], row["entries"]) for row in
+             store.conn.execute(sa.select([store.source_table]).order_by(store.source_table.c.id))}
+   finally:
+     store.disconnect()
+
+def spooled(tmp_path):
+   return [name for name in os.listdir(tmp_path / "spool") if name.endswith(".jsonl")]
+
+def test_batched_writes(dsn):
+   writes = StorageQueue({"dsn": dsn}, workers = 2, batch = 3)
+   writes.start()
+   writes.put_inventory([record("a", 1), record("a", 2)], runtime = 1)
+   writes.put_inventory({"data": [record("b", 1)], "errors": [{"source": "b-sub", "status": storage.STATUS_ERROR}]})
+   writes.put_status("c", storage.STATUS_FAIL, runtime = 2)
+   writes.join()
+   writes.stop()
+   assert versions(dsn) == {"a": ("OK", 2), "b": ("OK", 1), "b-sub": ("ERROR", None), "c": ("FAIL", None)}
+   assert writes.status()["written"] == 3
+
+def test_full_queue_does_not_block(dsn):
+   writes = StorageQueue({"dsn": dsn}, size = 1)
+   writes.put_inventory([record("a", 1)], block = False)
+   assert not writes.ready
+   with pytest.raises(queue.Full):
+     writes.put_inventory([record("b", 1)], block = False)
+   # queued by background thread once there is space
+   assert writes.offer({"inventory": [record("b", 1)], "runtime": None}) is False
+   assert versions(dsn) == {}
+
+   writes.start()
+   writes.join()
+   writes.stop()
+   assert versions(dsn) == {"a": ("OK", 1), "b": ("OK", 1)}
+
+def test_full_queue_offer_is_spooled(tmp_path, dsn):
+   writes = StorageQueue({"dsn": dsn, "spool": str(tmp_path / "spool")}, size = 1)
+   assert writes.offer({"inventory": [record("a", 1)], "runtime": None}) is True
+   assert writes.offer({"inventory": [record("b", 1)], "runtime": None}) is False
+   assert writes.status()["spooled"] == 1
+   assert len(spooled(tmp_path)) == 1
+
+   # replayed after queued item is written
+   writes.start()
+   writes.join()
+   writes.stop()
+   assert versions(dsn) == {"a": ("OK", 1), "b": ("OK", 1)}
+   assert spooled(tmp_path) == []
+
+def test_failed_item_is_spooled_and_replayed(tmp_path, dsn):
+   # database directory does not exist yet, writes fail
+   missing = tmp_path / "db"
+   config = {"dsn": "sqlite:///{}".format(missing / "inventory.db"), "spool": str(tmp_path / "spool")}
+   writes = StorageQueue(config, retries = 1, retry_delay = 0)
+   writes.start()
+   writes.put_inventory([record("a", 1)], runtime = 1)
+   writes.put_status("b", storage.STATUS_ERROR, error = "boom")
+   writes.join()
+   assert writes.status()["spooled"] == 2
+   assert writes.status()["failed"] == 0
+   assert len(spooled(tmp_path)) == 2
+
+   # next successful write replays the spool
+   os.mkdir(missing)
+   writes.put_inventory([record("c", 1)])
+   writes.join()
+   writes.stop()
+   assert versions(config["dsn"]) == {"c": ("OK", 1), "a": ("OK", 1), "b": ("ERROR", None)}
+   assert spooled(tmp_path) == []
+   storage.dispose_engines()
+
+def test_failed_item_without_spool_is_counted(tmp_path):
+   config = {"dsn": "sqlite:///{}".format(tmp_path / "missing" / "inventory.db")}
+   writes = StorageQueue(config, retries = 1, retry_delay = 0)
+   writes.start()
+   writes.put_inventory([record("a", 1)])
+   writes.join()
+   writes.stop()
+   assert writes.status()["failed"] == 1
+   assert writes.status()["last_error"]
+   storage.dispose_engines()
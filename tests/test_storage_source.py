@@ -0,0 +1,79 @@
+import multiprocessing
+
+import pytest
+import sqlalchemy as sa
+
+import cloudinventario.storage as storage
+from conftest import record
+
+def source(name):
+   return {"ts": "2026-01-01 00:00:00", "source": name, "entries": 0, "status": storage.STATUS_OK}
+
+def versions(store, name):
+   return [row["version"] for row in store.conn.execute(sa.select([store.source_table.c.version])
+             .where(store.source_table.c.source == name).order_by(store.source_table.c.version))]
+
+def stale_max(monkeypatch, stale):
+   """First <stale> reads of max version miss versions allocated meanwhile"""
+   version_max = storage.InventoryStorage._InventoryStorage__get_sources_version_max
+   reads = []
+   def get_max(self, conn, names):
+     reads.append(names)
+     if len(reads) <= stale:
+       return {}
+     return version_max(self, conn, names)
+   monkeypatch.setattr(storage.InventoryStorage, "_InventoryStorage__get_sources_version_max", get_max)
+   monkeypatch.setattr(storage.time, "sleep", lambda seconds: None)
+   return reads
+
+def test_version_conflict_is_retried(dsn, monkeypatch):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   with store.begin() as conn:
+     store.allocate_source(conn, source("src"))
+
+   # concurrent writer took version 1 after it was read
+   reads = stale_max(monkeypatch, 2)
+   with store.begin() as conn:
+     source_id, version = store.allocate_source(conn, source("src"))
+   assert version == 2 and len(reads) == 3
+   assert versions(store, "src") == [1, 2]
+   store.disconnect()
+
+def test_version_conflict_retries_exhausted(dsn, monkeypatch):
+   store = storage.InventoryStorage({"dsn": dsn, "retries": 1})
+   store.connect()
+   with store.begin() as conn:
+     store.allocate_source(conn, source("src"))
+
+   reads = stale_max(monkeypatch, 2)
+   with pytest.raises(sa.exc.IntegrityError):
+     with store.begin() as conn:
+       store.allocate_source(conn, source("src"))
+   assert len(reads) == 2
+   assert versions(store, "src") == [1]
+   store.disconnect()
+
+def save_versions(dsn, count):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   for idx in range(count):
+     store.save([record("shared", idx)])
+   store.disconnect()
+
+def test_concurrent_writers_get_distinct_versions(dsn):
+   storage.InventoryStorage({"dsn": dsn}).connect()
+   storage.dispose_engines()
+
+   context = multiprocessing.get_context("fork")
+   procs = [context.Process(target = save_versions, args = (dsn, 5)) for idx in range(4)]
+   for proc in procs:
+     proc.start()
+   for proc in procs:
+     proc.join(60)
+   assert [proc.exitcode for proc in procs] == [0, 0, 0, 0]
+
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   assert versions(store, "shared") == list(range(1, 21))
+   store.disconnect()
@@ -0,0 +1,138 @@
+import multiprocessing, time
+
+import sqlalchemy as sa
+
+import cloudinventario.storage as storage
+from conftest import record
+
+def versions(store, source):
+   return [(row["version"], row["status"], row["entries"]) for row in
+           store.conn.execute(sa.select([store.source_table]).where(store.source_table.c.source == source)
+                                .order_by(store.source_table.c.version))]
+
+def names(store, source = None):
+   return sorted(row["name"] for row in store.query(source = source))
+
+def test_single_transaction_writer(dsn):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   with store.writer() as writer:
+     writer.add_status([{"source": "failed", "status": storage.STATUS_ERROR, "error": "boom"}])
+     writer.append([record("src", 1)])
+     writer.append([record("src", 2)])
+   assert names(store, "src") == ["vm1", "vm2"]
+   assert versions(store, "src") == [(1, storage.STATUS_OK, 2)]
+   assert versions(store, "failed") == [(1, storage.STATUS_ERROR, None)]
+   store.disconnect()
+
+def test_incremental_writer_is_invisible_until_commit(dsn):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   store.save([record("src", 1)])
+
+   writer = store.writer(incremental = True)
+   writer.append([record("src", 2), record("src", 3)])
+   assert versions(store, "src") == [(1, storage.STATUS_OK, 1), (2, storage.STATUS_RUNNING, 0)]
+   assert names(store, "src") == ["vm1"]
+   assert store.latest_version(store.conn, "src") == 1
+
+   # no write lock is held between appends
+   store.save([record("other", 1)])
+   assert names(store, "other") == ["vm1"]
+
+   writer.append([record("src", 4)])
+   writer.commit(runtime = 5)
+   assert versions(store, "src") == [(1, storage.STATUS_OK, 1), (2, storage.STATUS_OK, 3)]
+   assert names(store, "src") == ["vm2", "vm3", "vm4"]
+   store.disconnect()
+
+def test_incremental_writer_abort(dsn):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   store.save([record("src", 1)])
+
+   writer = store.writer(incremental = True)
+   writer.add_status([{"source": "failed", "status": storage.STATUS_ERROR}])
+   writer.append([record("src", 2)])
+   writer.abort()
+   assert versions(store, "src") == [(1, storage.STATUS_OK, 1)]
+   assert versions(store, "failed") == []
+   assert names(store) == ["vm1"]
+   store.disconnect()
+
+def test_interrupted_incremental_writer_is_discarded(dsn):
+   store = storage.InventoryStorage({"dsn": dsn, "delta": True})
+   store.connect()
+   store.save([record("src", 1)])
+
+   # writer process killed: versions stay RUNNING with rows of their appends
+   writer = store.writer(incremental = True)
+   writer.append([record("src", 2)])
+   writer.conn.close()
+
+   with store.writer(incremental = True) as writer:
+     writer.append([record("src", 1), record("src", 3)])
+   assert [status for version, status, entries in versions(store, "src")] == \
+            [storage.STATUS_OK, storage.STATUS_ERROR, storage.STATUS_OK]
+   assert names(store, "src") == ["vm1", "vm3"]
+   assert sorted(row["name"] for row in store.conn.execute(store.select_version("src"))) == ["vm1", "vm3"]
+   store.disconnect()
+
+def stream(dsn, source, chunks, delay):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   store.disconnect()
+   with store.writer(incremental = True) as writer:
+     for chunk in range(chunks):
+       writer.append([record(source, chunk)])
+       time.sleep(delay)
+
+def test_concurrent_streaming_writers(dsn):
+   storage.InventoryStorage({"dsn": dsn}).connect()
+   storage.dispose_engines()
+
+   # slow writer must not lock out the fast ones (sqlite database lock)
+   context = multiprocessing.get_context("fork")
+   procs = [context.Process(target = stream, args = (dsn, "slow", 4, 2)),
+            context.Process(target = stream, args = (dsn, "fast1", 20, 0.05)),
+            context.Process(target = stream, args = (dsn, "fast2", 20, 0.05))]
+   for proc in procs:
+     proc.start()
+   for proc in procs:
+     proc.join(60)
+   assert [proc.exitcode for proc in procs] == [0, 0, 0]
+
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   for source, entries in [("slow", 4), ("fast1", 20), ("fast2", 20)]:
+     assert versions(store, source) == [(1, storage.STATUS_OK, entries)]
+   store.disconnect()
+
+def save_in_child(dsn):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   store.save([record("child", 1)])
+   store.disconnect()
+
+def test_forked_child_does_not_close_parent_connections(dsn):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   store.save([record("parent", 1)])
+
+   # child gets its own engine, inherited pool is dropped without closing
+   proc = multiprocessing.get_context("fork").Process(target = save_in_child, args = (dsn,))
+   proc.start()
+   proc.join(30)
+   assert proc.exitcode == 0
+
+   store.save([record("parent", 2)])
+   assert names(store, "child") == ["vm1"]
+   assert names(store, "parent") == ["vm2"]
+   store.disconnect()
+
+def test_records_with_different_columns(dsn):
+   store = storage.InventoryStorage({"dsn": dsn})
+   store.connect()
+   store.save([record("src", 1, cpus = 2, unknown = "x"), record("src", 2)])
+   assert sorted((row["name"], row["cpus"]) for row in store.query(source = "src")) == [("vm1", 2), ("vm2", None)]
+   store.disconnect()
@@ -0,0 +1,85 @@
+import threading, time
+
+from cloudinventario.work_queue import WorkQueue
+
+def work_queue(tmp_path, **config):
+   return WorkQueue({"path": str(tmp_path / "coordinator.db"), **config})
+
+def states(wq):
+   return {task["name"]: (task["state"], task["attempts"], task["worker"]) for task in wq.tasks()}
+
+def test_lease_in_order_and_complete(tmp_path):
+   wq = work_queue(tmp_path)
+   run, ids = wq.submit({"a": {"module": "dummy"}, "b": {"module": "dummy"}, "c": {"module": "dummy"}})
+   tasks = wq.lease("w1", 2)
+   assert [task["name"] for task in tasks] == ["a", "b"]
+   assert tasks[0]["config"] == {"module": "dummy"}
+
+   # already queued or leased collectors are not queued twice
+   assert wq.submit({"a": {}, "d": {}})[1] == {"d": ids["c"] + 1}
+
+   assert wq.complete("w1", ids["a"], True, {"runtime": 1})
+   assert wq.complete("w1", ids["b"], False, error = "boom")
+   assert states(wq)["a"] == ("done", 1, "w1")
+   assert states(wq)["b"] == ("failed", 1, "w1")
+   assert wq.status(run)["runs"][run]["tasks"] == {"done": 1, "failed": 1, "queued": 1}
+   assert not wq.status(run)["done"]
+
+def test_expired_lease_is_leased_again(tmp_path):
+   wq = work_queue(tmp_path, lease = 1, attempts = 2)
+   run, ids = wq.submit({"a": {}})
+   assert [task["id"] for task in wq.lease("w1")] == [ids["a"]]
+
+   # heartbeat extends the lease
+   time.sleep(0.6)
+   assert wq.heartbeat("w1", [ids["a"]]) == [ids["a"]]
+   time.sleep(0.6)
+   assert wq.expire() == 0
+
+   time.sleep(0.5)
+   assert wq.expire() == 1
+   assert states(wq)["a"] == ("queued", 1, None)
+   assert wq.heartbeat("w1", [ids["a"]]) == []
+
+   # second worker gets it, late completion of the first one is ignored
+   assert [task["id"] for task in wq.lease("w2")] == [ids["a"]]
+   assert not wq.complete("w1", ids["a"], True)
+   assert wq.complete("w2", ids["a"], True)
+   assert states(wq)["a"] == ("done", 2, "w2")
+
+def test_attempts_exhausted(tmp_path):
+   wq = work_queue(tmp_path, lease = 0.2, attempts = 2)
+   run, ids = wq.submit({"a": {}})
+   for worker in ["w1", "w2"]:
+     assert len(wq.lease(worker)) == 1
+     time.sleep(0.3)
+   # expired on next lease
+   assert wq.lease("w3") == []
+   task = wq.tasks(state = "failed")[0]
+   assert task["attempts"] == 2
+   assert "lease expired" in task["error"]
+   assert wq.status()["done"]
+
+def test_long_poll_wakes_up_on_submit(tmp_path):
+   wq = work_queue(tmp_path)
+   leased = []
+   thread = threading.Thread(target = lambda: leased.extend(wq.lease("w1", 1, wait = 10)))
+   start = time.time()
+   thread.start()
+   time.sleep(0.2)
+   wq.submit({"a": {}})
+   thread.join()
+   assert [task["name"] for task in leased] == ["a"]
+   assert time.time() - start < 5
+
+def test_queue_survives_restart(tmp_path):
+   wq = work_queue(tmp_path)
+   run, ids = wq.submit({"a": {"module": "dummy"}, "b": {}})
+   wq.lease("w1")
+   wq.close()
+
+   wq = work_queue(tmp_path)
+   assert states(wq) == {"a": ("leased", 1, "w1"), "b": ("queued", 0, None)}
+   assert wq.complete("w1", ids["a"], True)
+   assert [task["name"] for task in wq.lease("w2")] == ["b"]
+   assert wq.status()["workers"]["w2"]["tasks"] == ["b"]